@@ -0,0 +1,204 @@
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import psutil
+
+from src import Config
+from src.modules import Label, PointCloud
+from .synthetic import RoadParameters, bump_mask, generate
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCHMARK_DIR, "data")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+
+class PeakMemory:
+    """
+    Context manager sampling the resident set size of the process in a background thread, to find the peak memory of
+    a stage including memory allocated by Open3D
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        """
+        Constructor for the PeakMemory class
+        :param interval: Seconds between samples
+        """
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__sample, daemon=True)
+
+    def __sample(self) -> None:
+        """
+        Samples the resident set size until stopped
+        :return:
+        """
+        while not self.__stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self.__stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakMemory":
+        self.peak = self.process.memory_info().rss
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.__stop.set()
+        self.__thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def timed_stage(results: dict, name: str, points: int, function, *args, **kwargs):
+    """
+    Runs a stage and records its wall time, throughput and peak memory
+    :param results: Dictionary the stage results are added to
+    :param name: Name of the stage
+    :param points: Number of points processed by the stage
+    :param function: Stage function
+    :return: The return value of the stage function
+    """
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        value = function(*args, **kwargs)
+        wall_time = time.perf_counter() - start
+
+    results[name] = {
+        "wall_time": wall_time,
+        "points": points,
+        "throughput": points / wall_time if wall_time > 0 else None,  # Points per second
+        "peak_rss": memory.peak,  # Bytes
+    }
+    print(
+        f"{name:<16}{wall_time:>10.3f} s{points / max(wall_time, 1e-9):>16.0f} points/s"
+        f"{memory.peak / 2 ** 20:>10.0f} MiB"
+    )
+
+    return value
+
+
+def accuracy(pcd, marked_pcd, metadata: dict) -> dict:
+    """
+    Compares the detected speed bump points with the generated speed bumps
+    :param pcd: Pre-processed point cloud
+    :param marked_pcd: The points of pcd labelled by PointCloud.label
+    :param metadata: Metadata of the generated file
+    :return: Point-wise precision, recall and F1 score
+    """
+    truth = bump_mask(xyz=pcd.xyz, metadata=metadata)
+    detected = np.isin(pcd.record_indexes, marked_pcd.record_indexes[marked_pcd.labels == Label.SPEED_BUMP])
+    true_positives = np.count_nonzero(truth & detected)
+
+    precision = true_positives / np.count_nonzero(detected) if np.any(detected) else 0.0
+    recall = true_positives / np.count_nonzero(truth) if np.any(truth) else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def benchmark(parameters: RoadParameters) -> dict:
+    """
+    Generates (or reuses) a synthetic road and times every stage of the pipeline on it, through the same public
+    PointCloud methods as the pipeline
+    :param parameters: Road parameters
+    :return: Results of each stage and the detection accuracy
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Named after every parameter, so a file generated with other parameters is not reused
+    digest = hashlib.sha256(json.dumps(dataclasses.asdict(parameters), sort_keys=True).encode()).hexdigest()
+    name = f"road_{parameters.n_points}_{digest[:12]}"
+    las_path = os.path.join(DATA_DIR, name + ".las")
+
+    if not os.path.exists(las_path):
+        print(f"Generating {las_path}")
+        generate(file_path=las_path, parameters=parameters)
+
+    with open(os.path.join(DATA_DIR, name + ".json"), "r") as f:
+        metadata = json.load(f)
+
+    print(f"Benchmarking {parameters.n_points} points")
+    stages = {}
+    pcd = timed_stage(stages, "create", parameters.n_points, PointCloud.create, file_path=las_path)
+    pcd = timed_stage(stages, "pre_process", len(pcd), PointCloud.pre_process, pcd=pcd, source_path=las_path)
+    if Config.SPATIAL_INDEX.value:
+        pcd = timed_stage(stages, "spatial_index", len(pcd), PointCloud.build_spatial_index, pcd=pcd)
+    pcd = timed_stage(stages, "estimate_normals", len(pcd), PointCloud.estimate_normals, pcd=pcd)
+
+    segments, features = timed_stage(stages, "segment", len(pcd), PointCloud.extract_features, pcd=pcd)
+    detections = timed_stage(stages, "classify", len(pcd), PointCloud.classify, features=features)
+    marked_pcd = timed_stage(
+        stages, "label", len(pcd), PointCloud.label, pcd=pcd, segments=segments, detections=detections
+    )
+    path = timed_stage(
+        stages, "write", len(marked_pcd), PointCloud.write,
+        pcd=marked_pcd, source_path=las_path, filename=f"benchmark_{name}"
+    )
+    os.remove(path)
+
+    return {
+        "parameters": metadata["parameters"],
+        "stages": stages,
+        "total_wall_time": sum(stage["wall_time"] for stage in stages.values()),
+        "accuracy": accuracy(pcd=pcd, marked_pcd=marked_pcd, metadata=metadata),
+    }
+
+
+def environment() -> dict:
+    """
+    Describes the environment the benchmark was run in
+    :return:
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {member.name: member.value for member in Config if not member.name.endswith(("_DIR", "_PATH"))},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline on synthetic road point clouds")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1e5, 1e6], help="Number of points, 1e5 to 1e8")
+    parser.add_argument("--density", type=float, default=RoadParameters.density, help="Points per square meter")
+    parser.add_argument("--bumps", type=int, default=RoadParameters.no_bumps, help="Number of speed bumps")
+    parser.add_argument("--bump-height", type=float, default=RoadParameters.bump_height, help="Meters")
+    parser.add_argument("--noise", type=float, default=RoadParameters.noise, help="Vertical noise in meters")
+    parser.add_argument("--seed", type=int, default=RoadParameters.seed)
+    parser.add_argument("--output", default=RESULTS_DIR, help="Directory the JSON results are saved to")
+    args = parser.parse_args()
+
+    runs = [
+        benchmark(RoadParameters(
+            n_points=int(size), density=args.density, no_bumps=args.bumps, bump_height=args.bump_height,
+            noise=args.noise, seed=args.seed
+        )) for size in args.sizes
+    ]
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "runs": runs}, f, indent=4, default=str)
+
+    print(f"Results saved at {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Entry points of the program, timed in fresh interpreters
+TARGETS = ["src", "src.modules", "main"]
+# Dependencies that take long to import, and should only be imported by the code paths that use them
+HEAVY_MODULES = ["open3d", "geopandas", "fiona", "pyogrio", "shapely", "pyproj", "pandas", "laspy", "scipy",
+                 "matplotlib"]
+# Seconds that importing an entry point may take
+IMPORT_BUDGET = 0.5
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {target}
+print(time.perf_counter() - start)
+print(",".join(name for name in {heavy_modules!r} if name in sys.modules))
+"""
+
+
+def import_time(target: str) -> tuple[float, list[str]]:
+    """
+    Imports a module in a fresh interpreter
+    :param target: Name of the module, e.g. "main"
+    :return: The import time in seconds, and the heavy modules it imported
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(target=target, heavy_modules=HEAVY_MODULES)],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(output[0]), [name for name in output[1].split(",") if name]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the import time of the entry points of the program")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters per entry point")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="Seconds an import may take")
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'module':<16}{'median':>10}{'max':>10}  heavy modules")
+    for target in TARGETS:
+        times, loaded = [], set()
+        for _ in range(args.runs):
+            seconds, modules = import_time(target)
+            times.append(seconds)
+            loaded.update(modules)
+
+        median = statistics.median(times)
+        print(f"{target:<16}{median:>8.3f} s{max(times):>8.3f} s  {', '.join(sorted(loaded)) or '-'}")
+        if median > args.budget:
+            over_budget.append(target)
+
+    if over_budget:
+        sys.exit(f"Importing {', '.join(over_budget)} takes longer than the budget of {args.budget} s")
+
+
+if __name__ == "__main__":
+    main()
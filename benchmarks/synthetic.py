@@ -0,0 +1,114 @@
+import json
+import math
+import os
+from dataclasses import asdict, dataclass
+
+import laspy
+import numpy as np
+
+SCALE = 0.001  # Millimetre resolution, as the thresholds in the config are given in LAS integer units
+OFFSET = (500_000.0, 7_000_000.0, 0.0)  # UTM-like offset of the generated tiles
+
+
+@dataclass
+class RoadParameters:
+    """
+    Parameters of a synthetic road surface
+    """
+    n_points: int = 100_000  # Number of points
+    density: float = 500  # Points per square meter
+    width: float = 6  # Width of the road in meters
+    slope: float = 0.02  # Longitudinal slope
+    crown: float = 0.02  # Cross slope from the centre line to the edges
+    noise: float = 0.005  # Standard deviation of the vertical noise in meters
+    no_bumps: int = 3  # Number of speed bumps, evenly spaced along the road
+    bump_height: float = 0.08  # Height of the speed bumps in meters
+    bump_length: float = 3.0  # Length of the speed bumps along the road in meters
+    seed: int = 0  # Seed of the random generator
+    chunk_size: int = 1_000_000  # Number of points generated and written at a time
+
+    @property
+    def length(self) -> float:
+        """
+        Length of the road in meters
+        :return:
+        """
+        return self.n_points / (self.density * self.width)
+
+    @property
+    def bump_intervals(self) -> list[tuple[float, float]]:
+        """
+        Start and end of each speed bump along the road, in meters from the start of the road
+        :return:
+        """
+        spacing = self.length / (self.no_bumps + 1)
+        return [
+            (spacing * (i + 1) - self.bump_length / 2, spacing * (i + 1) + self.bump_length / 2)
+            for i in range(self.no_bumps)
+        ]
+
+
+def road_surface(x: np.ndarray, y: np.ndarray, parameters: RoadParameters, rng: np.random.Generator) -> np.ndarray:
+    """
+    Calculates the height of the road surface with speed bumps and noise
+    :param x: Distance along the road in meters
+    :param y: Distance across the road in meters
+    :param parameters: Road parameters
+    :param rng: Random generator
+    :return: Height in meters
+    """
+    z = parameters.slope * x - parameters.crown * np.abs(y - parameters.width / 2)
+    for start, end in parameters.bump_intervals:
+        inside = (start <= x) & (x <= end)
+        z[inside] += parameters.bump_height * np.sin(np.pi * (x[inside] - start) / (end - start))  # Rounded profile
+
+    return z + rng.normal(0, parameters.noise, len(x))
+
+
+def generate(file_path: str, parameters: RoadParameters) -> dict:
+    """
+    Generates a LAS file of a synthetic road in chunks. The points are ordered along the road, like a mobile mapping
+    scan. The parameters and speed bump positions are saved next to the LAS file as .json
+    :param file_path: Path to the .las file
+    :param parameters: Road parameters
+    :return: Metadata of the generated file
+    """
+    rng = np.random.default_rng(parameters.seed)
+    header = laspy.LasHeader(point_format=1, version="1.2")
+    header.scales = np.array([SCALE] * 3)
+    header.offsets = np.array(OFFSET)
+
+    chunk_length = parameters.length * parameters.chunk_size / parameters.n_points
+    with laspy.open(file_path, mode="w", header=header) as writer:
+        for i in range(math.ceil(parameters.n_points / parameters.chunk_size)):
+            n = min(parameters.chunk_size, parameters.n_points - i * parameters.chunk_size)
+            x = np.sort(rng.uniform(i * chunk_length, i * chunk_length + chunk_length * n / parameters.chunk_size, n))
+            y = rng.uniform(0, parameters.width, n)
+
+            points = laspy.ScaleAwarePointRecord.zeros(n, header=header)
+            points.x, points.y = x + OFFSET[0], y + OFFSET[1]
+            points.z = road_surface(x=x, y=y, parameters=parameters, rng=rng) + OFFSET[2]
+            points.intensity = rng.integers(100, 4000, n, dtype=np.uint16)
+            points.gps_time = x  # Time along the drive
+            writer.write_points(points)
+
+    metadata = {"parameters": asdict(parameters), "bump_intervals": parameters.bump_intervals}
+    with open(os.path.splitext(file_path)[0] + ".json", "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return metadata
+
+
+def bump_mask(xyz: np.ndarray, metadata: dict) -> np.ndarray:
+    """
+    Finds the points on a speed bump
+    :param xyz: LAS integer coordinates of shape (N, 3)
+    :param metadata: Metadata of the generated file
+    :return: Boolean array of shape (N,) that is True for points on a speed bump
+    """
+    x = xyz[:, 0] * SCALE  # Distance along the road, as the offset is the start of the road
+    mask = np.zeros(len(xyz), dtype=bool)
+    for start, end in metadata["bump_intervals"]:
+        mask |= (start <= x) & (x <= end)
+
+    return mask
@@ -1,9 +1,24 @@
+import argparse
+import contextvars
+import json
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
 
 from src import Config
 from src.logging import logger
-from src.modules import PointCloud
+from src.modules import (
+    Cache, Detections, Label, Pipeline, PointBuffer, PointCloud, Profiler, SegmentFeatures, Service, Shapefile, Stage,
+    Survey, Tiling
+)
+from src.utils import lazy_import, pcd_file_names
+
+laspy = lazy_import("laspy")
+
 
 @dataclass
 class Main:
@@ -14,31 +29,445 @@ class Main:
     @staticmethod
     def run() -> None:
         """
-        Main function of the program
+        Main function of the program. Runs the stages of the pipeline that are needed for the output mode in the
+        config. Every stage is checkpointed, so stages whose inputs are unchanged since an earlier run are skipped, and
+        an interrupted run resumes after the last completed stage, see Pipeline. If Config.OUT_OF_CORE is set, the
+        point cloud is processed tile by tile instead, see Tiling
+        :return:
+        """
+        las_path = Config.POINT_CLOUD_PATH.value
+        if not os.path.exists(las_path):
+            raise FileNotFoundError(
+                f"Point cloud {las_path} not found. "
+                f"Make sure the LAS file is in the following directory: {Config.RAW_PC_DIR.value}"
+            )
+
+        if Config.OUTPUT_MODE.value not in ("points", "detections", "both"):
+            raise ValueError(f"Unknown output mode {Config.OUTPUT_MODE.value}")
+
+        targets = {"points": ("output_path",), "detections": ("detections_path",)}.get(
+            Config.OUTPUT_MODE.value, ("output_path", "detections_path")
+        )
+
+        with Profiler.session("run"):  # Saves a profile report of the run if enabled in the config
+            if Config.OUT_OF_CORE.value:
+                outputs = Tiling.run(file_path=las_path)  # The tiles are not checkpointed
+            else:
+                pipeline = Pipeline(
+                    stages=Main.stages(las_path=las_path),
+                    checkpoint_dir=os.path.join(Config.CHECKPOINT_DIR.value, Config.LAS_NAME.value)
+                )
+                outputs = pipeline.run(values={"las_path": las_path}, targets=targets)
+
+        for path in outputs.values():
+            logger.info(f"Output saved at {path}")
+
+    @staticmethod
+    def stages(las_path: str) -> list[Stage]:
+        """
+        The stages of the pipeline of Main.run
+        :param las_path: Path to the .las file that is processed
+        :return: The stages, in the order they are run
+        """
+        return [
+            Stage(
+                name="load", function=Main.__load_stage, inputs=("las_path",), outputs=("pcd",),
+                settings=("DOWN_SAMPLE_ON_READ",),
+                fingerprint=lambda: Cache.key(file_path=las_path)  # File content and pre-processing settings
+            ),
+            Stage(
+                name="normals", function=Main.__normals_stage, inputs=("pcd",), outputs=("normals",),
+                settings=("SPATIAL_INDEX", "SEARCH_RADIUS", "MAX_NEAREST_NEIGHBOURS")
+            ),
+            Stage(
+                name="segment", function=Main.__segment_stage, inputs=("pcd", "normals"),
+                outputs=("segments", "features"),
+                settings=(
+                    "SPATIAL_INDEX", "SEGMENT_FIT_MODE", "NO_SEGMENTS", "OVERLAP_PERCENTAGE", "SOR_NO_NEIGHBOURS",
+                    "SOR_STD_RATIO", "RANSAC_ITER", "RANSAC_CONFIDENCE", "RANSAC_BATCH_SIZE", "RANSAC_THRESH"
+                )
+            ),
+            Stage(
+                name="classify", function=Main.__classify_stage, inputs=("features",), outputs=("detections",),
+                settings=("MIN_DIST_STD", "MAX_DIST_STD", "MIN_ANGLE_DEV", "MAX_ANGLE_DEV")
+            ),
+            Stage(
+                name="write", function=Main.__write_stage, inputs=("pcd", "segments", "detections", "las_path"),
+                outputs=("output_path",),
+                settings=("SURFACE_CLASSIFICATION", "SPEED_BUMP_CLASSIFICATION", "COMPRESS_OUTPUT")
+            ),
+            Stage(
+                name="write_detections", function=Main.__write_detections_stage,
+                inputs=("segments", "features", "detections", "las_path"), outputs=("detections_path",),
+                settings=("DETECTION_GEOMETRY", "DETECTION_FORMAT", "DETECTION_CRS")
+            ),
+        ]
+
+    @staticmethod
+    def __load_stage(las_path: str) -> dict[str, Any]:
+        """
+        Reads and pre-processes the point cloud
+        :param las_path: Path to .las file
+        :return: The pre-processed point cloud
+        """
+        return {"pcd": Main.load(las_path=las_path)}
+
+    @staticmethod
+    def __normals_stage(pcd: PointBuffer) -> dict[str, Any]:
+        """
+        Estimates the normals of the point cloud
+        :param pcd: Pre-processed point cloud
+        :return: The normals
+        """
+        return {"normals": PointCloud.estimate_normals(pcd=Main.__indexed(pcd=pcd)).normals}
+
+    @staticmethod
+    def __segment_stage(pcd: PointBuffer, normals: np.ndarray) -> dict[str, Any]:
+        """
+        Segments the point cloud and computes the segment feature table, which is also saved for threshold sweeps
+        :param pcd: Pre-processed point cloud
+        :param normals: Normals of the point cloud
+        :return: The plane of each segment and the feature table
+        """
+        pcd.normals = normals
+        segments, features = PointCloud.extract_features(pcd=Main.__indexed(pcd=pcd))
+        SegmentFeatures.save(features=features, filename="segment_features")
+
+        return {"segments": segments, "features": features}
+
+    @staticmethod
+    def __classify_stage(features: np.ndarray) -> dict[str, Any]:
+        """
+        Classifies the segments
+        :param features: Segment feature table
+        :return: Boolean array that is True for the segments that may contain a speed bump
+        """
+        return {"detections": PointCloud.classify(features=features)}
+
+    @staticmethod
+    def __write_stage(
+            pcd: PointBuffer, segments: list, detections: np.ndarray, las_path: str
+    ) -> dict[str, Any]:
+        """
+        Labels the points and writes the marked point cloud
+        :param pcd: Pre-processed point cloud
+        :param segments: The plane of each segment
+        :param detections: Boolean array that is True for the segments that may contain a speed bump
+        :param las_path: Path to the .las file the point cloud was read from
+        :return: Path to the marked point cloud
+        """
+        pcd = PointCloud.label(pcd=pcd, segments=segments, detections=detections)
+        return {"output_path": PointCloud.write(pcd=pcd, source_path=las_path, filename="marked_point_cloud")}
+
+    @staticmethod
+    def __write_detections_stage(
+            segments: list, features: np.ndarray, detections: np.ndarray, las_path: str
+    ) -> dict[str, Any]:
+        """
+        Saves the detected segments as vector data
+        :param segments: The plane of each segment
+        :param features: Segment feature table
+        :param detections: Boolean array that is True for the segments that may contain a speed bump
+        :param las_path: Path to the .las file the point cloud was read from
+        :return: Path to the detections
+        """
+        gdf = Detections.create(segments=segments, features=features, detections=detections, source_path=las_path)
+        return {"detections_path": Detections.save(gdf=gdf, filename="detections")}
+
+    @staticmethod
+    def __indexed(pcd: PointBuffer) -> PointBuffer:
+        """
+        Builds the spatial index of a point cloud if it is enabled in the config and the point cloud has none, e.g.
+        when it was loaded from a checkpoint
+        :param pcd: Pre-processed point cloud
+        :return: The point cloud
+        """
+        if Config.SPATIAL_INDEX.value and pcd.spatial_index is None:
+            pcd = PointCloud.build_spatial_index(pcd=pcd)
+
+        return pcd
+
+    @staticmethod
+    def batch() -> None:
+        """
+        Processes every LAS file in the raw point cloud directory. The files are pipelined, so the next file is read
+        and the previous result is written while the current file is being detected. A summary of each file is
+        written to batch_summary.json in the processed point cloud directory
+        :return:
+        """
+        Main.clear_processed_dir()
+
+        names = pcd_file_names()
+        las_paths = [os.path.join(Config.RAW_PC_DIR.value, name + ".las") for name in names]
+        logger.info(f"Processing {len(las_paths)} point clouds")
+
+        summaries = []
+        summary_path = os.path.join(Config.PROCESSED_PC_DIR.value, "batch_summary.json")
+
+        def record(summary: dict) -> None:
+            summaries.append(summary)
+            with open(summary_path, "w") as f:
+                json.dump(summaries, f, indent=4)
+
+        # One thread reading the next file and one writing the previous result
+        with Profiler.session("batch"), ThreadPoolExecutor(max_workers=2) as io_pool:
+            def submit(function: Callable, *args: Any, **kwargs: Any) -> Future:
+                # Timed in a copy of the current context, so the thread sees the config overrides, see Config.override
+                return io_pool.submit(contextvars.copy_context().run, Main.__timed, function, *args, **kwargs)
+
+            next_load = submit(Main.load, las_paths[0]) if las_paths else None
+            pending_write = None
+
+            for i, (name, las_path) in enumerate(zip(names, las_paths)):
+                load = next_load
+                load.exception()  # Waiting for the file to be read before the next is read, so one is read at a time
+                next_load = submit(Main.load, las_paths[i + 1]) if i + 1 < len(names) else None
+                summary = {"file": las_path}
+
+                try:
+                    pcd, summary["read_time"] = load.result()
+                    summary["points"] = len(pcd)
+
+                    (pcd, summary["detections"]), summary["detect_time"] = Main.__timed(
+                        Main.detect, pcd=pcd, las_path=las_path, prefix=f"{name}_"
+                    )
+                    if pcd is not None:
+                        summary["output_points"] = len(pcd)
+                        summary["speed_bump_points"] = int(np.count_nonzero(pcd.labels == Label.SPEED_BUMP))
+                except Exception as e:
+                    logger.error(f"Processing {las_path} failed: {e}")
+                    record({**summary, "status": "failed", "error": str(e)})
+                    continue
+
+                if pending_write is not None:
+                    record(Main.__finish_write(*pending_write))  # Limiting the pipeline to one pending write
+                    pending_write = None
+
+                if pcd is None:
+                    record({**summary, "status": "done"})  # Only the detections are output
+                    continue
+
+                pending_write = submit(
+                    PointCloud.write, pcd=pcd, source_path=las_path, filename=f"{name}_marked_point_cloud"
+                ), summary
+
+            if pending_write is not None:
+                record(Main.__finish_write(*pending_write))
+
+        failed = sum(summary["status"] == "failed" for summary in summaries)
+        logger.info(
+            f"Processed {len(summaries) - failed} point clouds ({failed} failed). Summary saved at {summary_path}"
+        )
+
+    @staticmethod
+    def ingest(las_paths: list[str] = None) -> None:
+        """
+        Adds point clouds to the survey in Config.SURVEY_DIR. Only the new points and the segments touching the seam to
+        the earlier files are processed, and the outputs of the files they belong to are updated, see Survey
+        :param las_paths: Paths to the .las files in scan order. Default: the files in the raw point cloud directory,
+        in the order of their names. Files that are already in the survey are skipped
+        :return:
+        """
+        if las_paths is None:
+            las_paths = [os.path.join(Config.RAW_PC_DIR.value, name + ".las") for name in sorted(pcd_file_names())]
+
+        survey = Survey(directory=Config.SURVEY_DIR.value)
+        with Profiler.session("ingest"):
+            for las_path in las_paths:
+                if survey.contains(las_path=las_path):
+                    logger.info(f"Skipping {las_path}, it is already in the survey")
+                    continue
+
+                outputs = survey.ingest(las_path=las_path, pcd=Main.load(las_path=las_path, spatial_index=False))
+                for path in outputs.values():
+                    logger.info(f"Output saved at {path}")
+
+    @staticmethod
+    def serve(host: str = None, port: int = None, workers: int = None) -> None:
+        """
+        Runs the detection service until interrupted. Each job detects the speed bumps in one LAS file with its own
+        config overrides, see Main.job and Service
+        :param host: Default: Config.SERVICE_HOST
+        :param port: Default: Config.SERVICE_PORT
+        :param workers: Number of worker processes. Default: Config.SERVICE_WORKERS
+        :return:
+        """
+        Service(function=Main.job, workers=workers).serve(host=host, port=port)
+
+    @staticmethod
+    def job(las_path: str) -> dict[str, Any]:
+        """
+        Detects the speed bumps in a LAS file and saves the outputs enabled by Config.OUTPUT_MODE, named after the
+        file as in batch
+        :param las_path: Path to .las file
+        :return: Number of points and detections, and the path to the marked point cloud if it is output
+        """
+        name = os.path.splitext(os.path.basename(las_path))[0]
+        with Profiler.session(f"job_{name}"):
+            pcd = Main.load(las_path=las_path)
+            result = {"points": len(pcd)}
+            pcd, result["detections"] = Main.detect(pcd=pcd, las_path=las_path, prefix=f"{name}_")
+            if pcd is not None:
+                result["output_path"] = PointCloud.write(
+                    pcd=pcd, source_path=las_path, filename=f"{name}_marked_point_cloud"
+                )
+
+        return result
+
+    @staticmethod
+    def __finish_write(write: Future, summary: dict) -> dict:
+        """
+        Waits for a pending write and completes the summary of its file
+        :param write: Future of a timed PointCloud.write call
+        :param summary: Summary of the file
+        :return: The completed summary
+        """
+        try:
+            summary["output_path"], summary["write_time"] = write.result()
+            summary["status"] = "done"
+        except Exception as e:
+            logger.error(f"Writing the result of {summary['file']} failed: {e}")
+            summary["status"], summary["error"] = "failed", str(e)
+
+        return summary
+
+    @staticmethod
+    def __timed(function: Callable, *args, **kwargs) -> tuple[Any, float]:
+        """
+        Calls a function and measures its wall time
+        :param function: Function to call
+        :return: The return value of the function and the wall time in seconds
+        """
+        start = time.perf_counter()
+        return function(*args, **kwargs), time.perf_counter() - start
+
+    @staticmethod
+    def load(las_path: str, spatial_index: bool = True) -> PointBuffer:
+        """
+        Loads the pre-processed point cloud of a LAS file from the cache, or creates and pre-processes it, and builds
+        its spatial index if enabled in the config. Only the points within the region set in the config are read
+        :param las_path: Path to .las file
+        :param spatial_index: Build the spatial index. Disabled when the points are indexed together with others
+        :return: Pre-processed point cloud
+        """
+        pcd = Cache.load(file_path=las_path)  # Pre-processed point cloud from an earlier run, if any
+        if pcd is None:
+            region = Main.__region(las_path=las_path)
+            pcd = PointCloud.create(file_path=las_path) if region is None \
+                else PointCloud.create_region(file_path=las_path, region=region)
+            pcd = PointCloud.pre_process(pcd=pcd, source_path=las_path)
+            Cache.store(file_path=las_path, pcd=pcd)
+
+        if Config.SPATIAL_INDEX.value and spatial_index:
+            pcd = PointCloud.build_spatial_index(pcd=pcd)
+
+        return pcd
+
+    @staticmethod
+    def __region(las_path: str) -> tuple[float, float, float, float] | np.ndarray | None:
+        """
+        The region to read from a LAS file, set by Config.REGION_BOUNDS or Config.REGION_FROM_SHAPEFILE
+        :param las_path: Path to .las file. The shapefile is reprojected to its coordinate system
+        :return: Bounding box or array of geometries, or None to read the whole file
+        """
+        if Config.REGION_FROM_SHAPEFILE.value:
+            with laspy.open(las_path) as f:
+                crs = f.header.parse_crs()
+
+            gdf = Shapefile.create(file_path=Config.SHAPEFILE_PATH.value, crs=crs)
+            return Shapefile.buffer(gdf=gdf, distance=Config.MIDDLE_LINE_THRESHOLD.value)
+
+        return None if Config.REGION_BOUNDS.value is None else tuple(Config.REGION_BOUNDS.value)
+
+    @staticmethod
+    def detect(pcd: PointBuffer, las_path: str, prefix: str = "") -> tuple[PointBuffer | None, int]:
+        """
+        Estimates the normals of a pre-processed point cloud and detects the speed bumps. The segment feature table is
+        saved, and the detected segments are saved as vector data if enabled by Config.OUTPUT_MODE
+        :param pcd: Pre-processed point cloud
+        :param las_path: Path to the .las file the point cloud was read from
+        :param prefix: Prefix of the names of the saved files
+        :return: Labelled point cloud, or None if only the detections are output, and the number of detections
+        """
+        if Config.OUTPUT_MODE.value not in ("points", "detections", "both"):
+            raise ValueError(f"Unknown output mode {Config.OUTPUT_MODE.value}")
+
+        pcd = PointCloud.estimate_normals(pcd=pcd)
+        segments, features, detections = PointCloud.classify_segments(
+            pcd=pcd, features_filename=f"{prefix}segment_features"
+        )
+
+        if Config.OUTPUT_MODE.value in ("detections", "both"):
+            gdf = Detections.create(segments=segments, features=features, detections=detections, source_path=las_path)
+            Detections.save(gdf=gdf, filename=f"{prefix}detections")
+
+        if Config.OUTPUT_MODE.value == "detections":
+            return None, int(np.count_nonzero(detections))
+
+        return PointCloud.label(pcd=pcd, segments=segments, detections=detections), int(np.count_nonzero(detections))
+
+    @staticmethod
+    def clear_processed_dir() -> None:
+        """
+        Clears the processed point cloud directory of .las and .laz files if enabled in the config
         :return:
         """
         if Config.CLEAR_PROCESSED_PC.value:
             # Clearing processed point cloud directory if any .las files exists
-            if [file for file in os.listdir(Config.PROCESSED_PC_DIR.value) if file.endswith('.las')]:
+            if [file for file in os.listdir(Config.PROCESSED_PC_DIR.value) if file.endswith(('.las', '.laz'))]:
                 logger.info("Clearing processed point cloud directory")
                 [
                     os.remove(
                         os.path.join(Config.PROCESSED_PC_DIR.value, file)
-                    ) for file in os.listdir(Config.PROCESSED_PC_DIR.value) if file.endswith('.las')
+                    ) for file in os.listdir(Config.PROCESSED_PC_DIR.value) if file.endswith(('.las', '.laz'))
                 ]
 
-        las_path = Config.POINT_CLOUD_PATH.value
-        if not os.path.exists(las_path):
-            raise FileNotFoundError(
-                f"Point cloud {las_path} not found. "
-                f"Make sure the LAS file is in the following directory: {Config.RAW_PC_DIR.value}"
-            )
+    @staticmethod
+    def sweep(features_path: str, truth_path: str = None) -> None:
+        """
+        Evaluates the threshold grid in the config against a saved segment feature table
+        :param features_path: Path to a feature table saved by Main.run
+        :param truth_path: Path to a .npy file with a boolean per segment that is True if it contains a speed bump
+        :return:
+        """
+        features = SegmentFeatures.load(file_path=features_path)
+        truth = None if truth_path is None else np.load(truth_path)
+        grid = {name: np.linspace(*values) for name, values in Config.SWEEP_GRID.value.items()}
 
-        pcd = PointCloud.create(file_path=las_path)
-        pcd = PointCloud.pre_process(pcd=pcd)
-        pcd = PointCloud.detect(pcd=pcd)
-        PointCloud.save(pcd=pcd, filename="marked_point_cloud")
+        results = SegmentFeatures.sweep(features=features, grid=grid, truth=truth)
+        path = os.path.join(Config.PROCESSED_PC_DIR.value, "threshold_sweep.csv")
+        results.to_csv(path, index=False)
+        logger.info(f"Sweep results saved at {path}")
+
+        if truth is not None:
+            logger.info(f"Best thresholds:\n{results.loc[results['f1'].idxmax()].to_string()}")
 
 
 if __name__ == "__main__":
-    Main.run()
+    parser = argparse.ArgumentParser(description="Speed bump detection")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="Detect speed bumps in the configured point cloud (default)")
+    subparsers.add_parser("batch", help="Detect speed bumps in every point cloud in the raw point cloud directory")
+    ingest_parser = subparsers.add_parser("ingest", help="Add point clouds to a survey, processing only the new points")
+    ingest_parser.add_argument(
+        "files", nargs="*", help="Paths to .las files in scan order. Default: The raw point cloud directory"
+    )
+    serve_parser = subparsers.add_parser("serve", help="Run a local service detecting speed bumps in submitted jobs")
+    serve_parser.add_argument("--host", help="Address to listen on. Default: SERVICE_HOST in the config")
+    serve_parser.add_argument("--port", type=int, help="Port to listen on. Default: SERVICE_PORT in the config")
+    serve_parser.add_argument("--workers", type=int, help="Number of worker processes. Default: SERVICE_WORKERS")
+    sweep_parser = subparsers.add_parser("sweep", help="Evaluate detection thresholds on a saved feature table")
+    sweep_parser.add_argument("features", help="Path to a segment feature table (.npy)")
+    sweep_parser.add_argument("--truth", help="Path to a boolean array (.npy) marking the segments with speed bumps")
+    args = parser.parse_args()
+
+    if args.command == "batch":
+        Main.batch()
+    elif args.command == "ingest":
+        Main.ingest(las_paths=args.files or None)
+    elif args.command == "serve":
+        Main.serve(host=args.host, port=args.port, workers=args.workers)
+    elif args.command == "sweep":
+        Main.sweep(features_path=args.features, truth_path=args.truth)
+    else:
+        Main.run()
@@ -1,6 +1,11 @@
 import logging
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import Enum
+from typing import Any, Iterator
+
+_overrides = ContextVar("config_overrides", default={})  # Values of the settings overridden by Config.override
 
 
 class Config(Enum):
@@ -22,6 +27,11 @@ class Config(Enum):
     RAW_PC_DIR = os.path.join(PC_DIR, 'raw_files')
     PROCESSED_PC_DIR = os.path.join(PC_DIR, 'processed_files')
     POINT_CLOUD_PATH = os.path.join(RAW_PC_DIR, LAS_NAME + '.las')
+    CACHE_DIR = os.path.join(PROCESSED_PC_DIR, 'cache')  # Cache of pre-processed point clouds
+    PROFILE_DIR = os.path.join(PROCESSED_PC_DIR, 'profiles')  # Profile reports of each run
+    CHECKPOINT_DIR = os.path.join(PROCESSED_PC_DIR, 'checkpoints')  # Checkpoints of the pipeline stages
+    TILE_DIR = os.path.join(PROCESSED_PC_DIR, 'tiles')  # Memory-mapped tiles of the out-of-core mode
+    SURVEY_DIR = os.path.join(PROCESSED_PC_DIR, 'survey')  # State of the survey of the incremental mode
 
     # Shapefiles directory paths
     SHP_DIR = os.path.join(RESOURCE_DIR, 'shapefiles')
@@ -35,8 +45,26 @@ class Config(Enum):
     LOGGING_LEVEL = logging.INFO  # Logging level
     CLEAR_PROCESSED_PC = True  # Clear processed point cloud directory before processing
     LOADING_BAR_LENGTH = 100  # Length of loading bar
+    USE_CACHE = True  # Cache pre-processed point clouds, so they are only pre-processed once
+    CACHE_SIZE_LIMIT = 10 * 1024 ** 3  # Maximum size (bytes) of the cache before the least recently used are removed
+    USE_CHECKPOINTS = True  # Checkpoint each stage of a run, so unchanged stages are skipped and runs can resume
+    NO_WORKERS = 1  # Number of worker processes for segment fitting, e.g. os.cpu_count(). 1 runs sequentially
+    SPATIAL_INDEX = True  # Build a KD-tree after pre-processing, shared by the normal estimation and SOR per segment
 
     # Point cloud settings
+    # Reading settings
+    CHUNK_SIZE = 1_000_000  # Number of points read from the LAS file at a time
+    DOWN_SAMPLE_ON_READ = True  # Uniform down sampling while reading instead of during pre-processing
+    COMPACT_POINTS = True  # Keep int32 LAS coordinates, uint16 intensity and float32 normals instead of float64
+    REGION_BOUNDS = None  # Only read the points within (x_min, y_min, x_max, y_max), in the coordinates of the file
+    REGION_FROM_SHAPEFILE = False  # Only read the points within MIDDLE_LINE_THRESHOLD of the shapefile geometries
+    INDEX_BLOCK_SIZE = 65_536  # Number of records per block of the sidecar index used to read regions
+
+    # Out-of-core settings
+    OUT_OF_CORE = False  # Process the point cloud in tiles spilled to disk, for point clouds that do not fit in memory
+    MEMORY_BUDGET = 4 * 1024 ** 3  # Memory (bytes) available for processing one tile, which sets the tile size
+    TILE_HALO = 2.5  # Margin (meters) around each tile that is processed with the tile, but labelled by its neighbour
+
     # Pre-processing settings
     VOXEL_SIZE = 500  # Voxel size. NB: Not used because uniform down sampling is used
     UNIFORM_DOWN_SAMPLE = 5  # k-nearest neighbour for uniform down sampling
@@ -44,8 +72,9 @@ class Config(Enum):
     SOR_STD_RATIO = 0.3  # Standard deviation for statistical outlier removal
 
     # RANSAC settings
-    RANSAC_N = 3  # Number of points to sample for RANSAC
     RANSAC_ITER = 250  # Maximum number of iterations for RANSAC
+    RANSAC_CONFIDENCE = 0.99  # Confidence of finding the best plane, RANSAC stops early when it is reached
+    RANSAC_BATCH_SIZE = 32  # Number of plane hypotheses scored at a time
     RANSAC_THRESH = 68  # Maximum distance for a point to be considered an inlier for RANSAC
 
     # Normal estimation settings
@@ -53,14 +82,92 @@ class Config(Enum):
     MAX_NEAREST_NEIGHBOURS = 20  # Maximum number of nearest neighbours for normal estimation
 
     # Segmentation settings
+    SEGMENT_FIT_MODE = "ransac"  # "ransac": SOR and RANSAC per segment. "moments": Least squares from prefix sums
     OVERLAP_PERCENTAGE = 0.4  # Percentage of overlap between two segments
     NO_SEGMENTS = 300  # Number of segments to divide PCD into. Should be adjusted according to size of PCD
+    SURVEY_SEGMENT_SIZE = 5000  # Points per segment in the survey mode, which segments the files as one point cloud
 
     # Shapefile pre-processing settings
     MIDDLE_LINE_THRESHOLD = 2  # Maximum distance (meters) between a point and the middle line
+    CROP_TO_MIDDLE_LINE = False  # Remove points further than MIDDLE_LINE_THRESHOLD from the middle line
 
     # Detection setting
     MIN_DIST_STD = 14.78  # Minimum standard deviation required for a segment to be considered a containing a speedbump
     MAX_DIST_STD = 17.71  # Maximum standard deviation required for a segment to be considered a containing a speedbump
     MIN_ANGLE_DEV = 0  # Minimum deviation in degrees from normal vector of mathematical plane
     MAX_ANGLE_DEV = 3.67  # Maximum deviation in degrees from normal vector of mathematical plane
+
+    # Output settings
+    OUTPUT_MODE = "points"  # "points": Marked point cloud. "detections": Detected segments as vector data. "both"
+    DETECTION_GEOMETRY = "footprint"  # "footprint": Convex hull of the segment inliers. "centroid": Its centroid
+    DETECTION_FORMAT = "GPKG"  # "GPKG" or "GeoJSON"
+    DETECTION_CRS = None  # CRS of the detections if the LAS file has none, e.g. "EPSG:25832"
+    COMPRESS_OUTPUT = False  # Write the marked point cloud as a compressed .laz file. Requires lazrs or laszip
+    SURFACE_CLASSIFICATION = 11  # LAS classification of road surface points (ASPRS: Road Surface)
+    SPEED_BUMP_CLASSIFICATION = 19  # LAS classification of speed bump points. Must be at most 31 for point format 0-5
+
+    # Profiling settings
+    PROFILE = False  # Measure each stage and save a profile report of each run
+    PROFILE_CPROFILE = False  # Run cProfile around each run and save the stats next to the report
+    PROFILE_TRACEMALLOC = False  # Trace Python allocations during each run. Slows down the run considerably
+    PROFILE_TOP_ALLOCATIONS = 10  # Number of the largest allocation sites included in the report
+
+    # Service settings
+    SERVICE_HOST = "127.0.0.1"  # Address the service listens on. Jobs are not authenticated, so keep it local
+    SERVICE_PORT = 8765  # Port of the service
+    SERVICE_WORKERS = max((os.cpu_count() or 1) // 2, 1)  # Number of worker processes running jobs
+    SERVICE_JOB_HISTORY = 10000  # Number of finished jobs whose status is kept
+
+    # Threshold sweep settings. Values (start, stop, number of values) to evaluate for each threshold
+    SWEEP_GRID = {
+        "MIN_DIST_STD": (10, 20, 21),
+        "MAX_DIST_STD": (15, 25, 21),
+        "MIN_ANGLE_DEV": (0, 2, 5),
+        "MAX_ANGLE_DEV": (2, 6, 17),
+    }
+
+    def __new__(cls, *args: Any) -> "Config":
+        """
+        Creates a setting. Every setting gets its own member value, so settings with equal values are not aliases of
+        each other and can be overridden one at a time
+        :param args: Value of the setting, unpacked by Enum if it is a tuple
+        """
+        member = object.__new__(cls)
+        member._value_ = len(cls._member_names_)  # Position of the setting
+        member.__setting = args[0] if len(args) == 1 else args
+        return member
+
+    @property
+    def value(self) -> Any:
+        """
+        Value of the setting, or its override in the current context, see Config.override
+        :return:
+        """
+        return _overrides.get().get(self.name, self.__setting)
+
+    @staticmethod
+    @contextmanager
+    def override(values: dict[str, Any]) -> Iterator[None]:
+        """
+        Overrides settings within a block. The overrides are kept in a context variable, so they only apply to the
+        context that sets them. Threads and spawned processes do not inherit them, and are given Config.overrides
+        :param values: Values of the settings, keyed on the setting name
+        :return:
+        """
+        unknown = [name for name in values if name not in Config.__members__]
+        if unknown:
+            raise ValueError(f"Unknown settings {', '.join(unknown)}")
+
+        token = _overrides.set({**_overrides.get(), **values})
+        try:
+            yield
+        finally:
+            _overrides.reset(token)
+
+    @staticmethod
+    def overrides() -> dict[str, Any]:
+        """
+        The settings overridden in the current context, to pass on to worker processes, see Config.override
+        :return: Values of the settings, keyed on the setting name
+        """
+        return dict(_overrides.get())
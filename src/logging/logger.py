@@ -2,15 +2,12 @@ import logging
 import ntpath
 import os
 
-import fiona
-import matplotlib
-import open3d
-
 from ..config import Config
 
-matplotlib.set_loglevel("Error")
-open3d.utility.set_verbosity_level(open3d.utility.VerbosityLevel.Error)
-fiona.log.setLevel('CRITICAL')
+# Set through their loggers, so the libraries are not imported. Open3D does not log through logging, so its verbosity
+# is set when it is imported, see lazy_import
+logging.getLogger("matplotlib").setLevel(logging.ERROR)
+logging.getLogger("fiona").setLevel(logging.CRITICAL)
 
 filename = ntpath.basename(__name__).replace(".py", "")  # Get filename from filepath, and removes .py from the end
 log_save_path = os.path.join(Config.LOG_DIR.value, f"{filename}.log")
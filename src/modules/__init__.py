@@ -1,4 +1,66 @@
-from .plane import Plane
-from .point import Point
-from .point_cloud import PointCloud
-from .shapefile import Shapefile
+import importlib
+from typing import TYPE_CHECKING, Any
+
+# Submodule of each class. The submodules are imported on first access (PEP 562), so importing the package does not
+# import the dependencies of the classes that are not used
+_SUBMODULES = {
+    "Label": "label",
+    "Point": "point",
+    "PointBuffer": "point_buffer",
+    "Profiler": "profiler",
+    "SpatialIndex": "spatial_index",
+    "LasIndex": "las_index",
+    "Plane": "plane",
+    "Cache": "cache",
+    "SegmentFeatures": "segment_features",
+    "Shapefile": "shapefile",
+    "Detections": "detections",
+    "PointCloud": "point_cloud",
+    "Tile": "tiling",
+    "TileGrid": "tiling",
+    "Tiling": "tiling",
+    "Survey": "survey",
+    "Pipeline": "pipeline",
+    "Stage": "pipeline",
+    "Job": "service",
+    "Service": "service",
+}
+
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Imports the submodule of a class on first access
+    :param name: Name of the class
+    :return:
+    """
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_SUBMODULES[name]}", __name__), name)
+    globals()[name] = value  # Later accesses do not go through __getattr__
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .label import Label
+    from .point import Point
+    from .point_buffer import PointBuffer
+    from .profiler import Profiler
+    from .spatial_index import SpatialIndex
+    from .las_index import LasIndex
+    from .plane import Plane
+    from .cache import Cache
+    from .segment_features import SegmentFeatures
+    from .shapefile import Shapefile
+    from .detections import Detections
+    from .point_cloud import PointCloud
+    from .tiling import Tile, TileGrid, Tiling
+    from .survey import Survey
+    from .pipeline import Pipeline, Stage
+    from .service import Job, Service
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..config import Config
+from ..logging import logger
+from ..modules.point_buffer import PointBuffer
+from ..modules.profiler import Profiler
+
+_hashes_lock = threading.Lock()  # Held while the file hashes are read or updated by a thread of this process
+
+
+@dataclass
+class Cache:
+    """
+    On-disk cache of pre-processed point clouds. Entries are keyed on the content hash of the LAS file and the config
+    values that affect pre-processing, and are stored as .npy files that are memory-mapped when loaded
+    """
+    COLUMNS = ("xyz", "intensity", "record_indexes")  # Point buffer columns that are cached
+
+    @staticmethod
+    @Profiler.profiled("cache_load")
+    def load(file_path: str) -> PointBuffer | None:
+        """
+        Loads the pre-processed point cloud of a LAS file from the cache
+        :param file_path: Path to .las file
+        :return: Memory-mapped point cloud, or None if it is not cached
+        """
+        if not Config.USE_CACHE.value:
+            return None
+
+        entry_dir = os.path.join(Config.CACHE_DIR.value, Cache.key(file_path=file_path))
+        if not os.path.isdir(entry_dir):
+            logger.info(f"No cached point cloud found for {file_path}")
+            return None
+
+        logger.info(f"Loading cached point cloud from {entry_dir}")
+        os.utime(entry_dir)  # Marking the entry as recently used
+
+        # Copy-on-write memory maps, as Open3D only accepts writeable arrays
+        columns = {
+            column: np.load(os.path.join(entry_dir, f"{column}.npy"), mmap_mode="c") for column in Cache.COLUMNS
+            if os.path.exists(os.path.join(entry_dir, f"{column}.npy"))
+        }
+
+        return PointBuffer(**columns)
+
+    @staticmethod
+    @Profiler.profiled("cache_store")
+    def store(file_path: str, pcd: PointBuffer) -> None:
+        """
+        Stores the pre-processed point cloud of a LAS file in the cache, and evicts the least recently used entries
+        if the cache exceeds its size limit
+        :param file_path: Path to the .las file the point cloud was created from
+        :param pcd: Pre-processed point cloud
+        :return:
+        """
+        if not Config.USE_CACHE.value:
+            return
+
+        entry_dir = os.path.join(Config.CACHE_DIR.value, Cache.key(file_path=file_path))
+        tmp_dir = os.path.join(Config.CACHE_DIR.value, f".{uuid.uuid4().hex}")  # Written first, then renamed
+        os.makedirs(tmp_dir)
+
+        for column in Cache.COLUMNS:
+            if getattr(pcd, column) is not None:  # Record indexes are missing if the points were not read from file
+                np.save(os.path.join(tmp_dir, f"{column}.npy"), getattr(pcd, column))
+
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(tmp_dir)  # Stored by another process in the meantime
+        else:
+            os.replace(tmp_dir, entry_dir)
+            logger.info(f"Cached pre-processed point cloud at {entry_dir}")
+
+        Cache.evict()
+
+    @staticmethod
+    def evict() -> None:
+        """
+        Removes the least recently used entries until the cache is within Config.CACHE_SIZE_LIMIT bytes
+        :return:
+        """
+        entries = []
+        for name in os.listdir(Config.CACHE_DIR.value):
+            entry_dir = os.path.join(Config.CACHE_DIR.value, name)
+            if name.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= Config.CACHE_SIZE_LIMIT.value:
+                break
+
+            logger.debug(f"Evicting {entry_dir} from the cache")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+
+    @staticmethod
+    def key(file_path: str) -> str:
+        """
+        Creates the cache key of a LAS file from its content hash and the config values used in pre-processing
+        :param file_path: Path to .las file
+        :return: Cache key
+        """
+        settings = {
+            name: Config[name].value for name in (
+                "UNIFORM_DOWN_SAMPLE", "SOR_NO_NEIGHBOURS", "SOR_STD_RATIO", "CROP_TO_MIDDLE_LINE", "COMPACT_POINTS"
+            )
+        }
+        settings["COLUMNS"] = Cache.COLUMNS  # Entries stored with other columns are not reused
+
+        settings["REGION_BOUNDS"] = Config.REGION_BOUNDS.value
+        settings["REGION_FROM_SHAPEFILE"] = Config.REGION_FROM_SHAPEFILE.value
+        if Config.CROP_TO_MIDDLE_LINE.value or Config.REGION_FROM_SHAPEFILE.value:
+            settings["MIDDLE_LINE_THRESHOLD"] = Config.MIDDLE_LINE_THRESHOLD.value
+            settings["SHAPEFILE_HASH"] = Cache.file_hash(file_path=Config.SHAPEFILE_PATH.value)
+
+        key = json.dumps([Cache.file_hash(file_path=file_path), settings], sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """
+        Hashes the content of a file. The hash is remembered for the size and modification time of the file, so
+        unchanged files are only read once
+        :param file_path: Path to file
+        :return: SHA-256 hex digest of the file content
+        """
+        stat = os.stat(file_path)
+        hashes_path = os.path.join(Config.CACHE_DIR.value, "hashes.json")
+        fingerprint = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+        with _hashes_lock:
+            digest = Cache.__load_hashes(hashes_path=hashes_path).get(fingerprint)
+
+        if digest is not None:
+            return digest
+
+        logger.debug(f"Hashing {file_path}")
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                sha.update(block)
+
+        with _hashes_lock:
+            # Loaded again, as other threads and processes may have added hashes while the file was read
+            hashes = Cache.__load_hashes(hashes_path=hashes_path)
+            hashes[fingerprint] = sha.hexdigest()
+            os.makedirs(Config.CACHE_DIR.value, exist_ok=True)
+
+            # Written to a uniquely named file first, as other processes may be reading or writing the hashes
+            tmp_path = f"{hashes_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(hashes, f)
+
+            os.replace(tmp_path, hashes_path)
+
+        return hashes[fingerprint]
+
+    @staticmethod
+    def __load_hashes(hashes_path: str) -> dict[str, str]:
+        """
+        Loads the remembered file hashes
+        :param hashes_path: Path to the hashes file
+        :return: Hash of each file, keyed on its path, size and modification time
+        """
+        if not os.path.exists(hashes_path):
+            return {}
+
+        with open(hashes_path, "r") as f:
+            return json.load(f)
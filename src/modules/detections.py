@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..config import Config
+from ..logging import logger
+from ..modules.plane import Plane
+from ..modules.profiler import Profiler
+from ..utils import lazy_import
+
+gpd = lazy_import("geopandas")
+laspy = lazy_import("laspy")
+shapely = lazy_import("shapely")
+
+DRIVER_EXTENSIONS = {"GPKG": ".gpkg", "GeoJSON": ".geojson"}  # File extension of each supported driver
+
+
+@dataclass
+class Detections:
+    """
+    Vector output of the detected segments. Each detected segment is written as one feature with its footprint or
+    centroid and the plane statistics from the feature table, so the locations of the speed bumps can be used in GIS
+    without writing the point cloud
+    """
+
+    @staticmethod
+    def create(
+            segments: list[Plane], features: np.ndarray, detections: np.ndarray, source_path: str
+    ) -> gpd.GeoDataFrame:
+        """
+        Creates the geometries of the detected segments
+        :param segments: The plane of each segment
+        :param features: Feature table of the segments, see SegmentFeatures
+        :param detections: Boolean array that is True for the segments that may contain a speed bump
+        :param source_path: Path to the .las file the segments were read from. Its scale, offset and CRS are used to
+        convert the LAS integer coordinates
+        :return: Geo-dataframe with one row per detected segment
+        """
+        with laspy.open(source_path) as f:
+            scales, offsets = f.header.scales, f.header.offsets
+            crs = f.header.parse_crs() or Config.DETECTION_CRS.value
+
+        if crs is None:
+            logger.warning(f"{source_path} has no CRS, and DETECTION_CRS is not set. The detections have no CRS")
+
+        geometries, elevations = [], []
+        for i in np.flatnonzero(detections):
+            xyz = segments[i].pcd.xyz * scales + offsets  # Inliers of the segment in the coordinates of the file
+            footprint = shapely.convex_hull(shapely.multipoints(xyz[:, :2]))
+            geometries.append(footprint if Config.DETECTION_GEOMETRY.value == "footprint" else footprint.centroid)
+            elevations.append((xyz[:, 2].min(), xyz[:, 2].max()))
+
+        detected_features = features[detections]
+        gdf = gpd.GeoDataFrame(
+            {name: detected_features[name] for name in detected_features.dtype.names},
+            geometry=geometries,
+            crs=crs
+        )
+        gdf.insert(0, "segment", np.flatnonzero(detections) + 1)  # Same numbering as the detection log
+        gdf["z_min"], gdf["z_max"] = np.reshape(elevations, (-1, 2)).T
+
+        return gdf
+
+    @staticmethod
+    @Profiler.profiled("write_detections")
+    def save(gdf: gpd.GeoDataFrame, filename: str) -> str:
+        """
+        Saves the detections in the processed point cloud directory in the format set by Config.DETECTION_FORMAT
+        :param gdf: Detections, see Detections.create
+        :param filename: Name of the file, without extension
+        :return: Path to the saved file
+        """
+        driver = Config.DETECTION_FORMAT.value
+        if driver not in DRIVER_EXTENSIONS:
+            raise ValueError(f"Unknown detection format {driver}. Expected one of {', '.join(DRIVER_EXTENSIONS)}")
+
+        path = os.path.join(Config.PROCESSED_PC_DIR.value, filename + DRIVER_EXTENSIONS[driver])
+        if os.path.exists(path):
+            os.remove(path)  # Replacing the output of an earlier run
+
+        gdf.to_file(path, driver=driver)
+        logger.info(f"{len(gdf)} detections saved at {path}")
+
+        return path
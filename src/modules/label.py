@@ -0,0 +1,10 @@
+from enum import IntEnum
+
+
+class Label(IntEnum):
+    """
+    Per-point labels written by the detection. A higher label takes precedence where segments overlap
+    """
+    REMOVED = 0  # Removed from every segment it is part of, e.g. by SOR or as a RANSAC outlier
+    SURFACE = 1  # Inlier of at least one segment
+    SPEED_BUMP = 2  # Inlier of at least one segment that contains a speed bump
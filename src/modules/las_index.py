@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from tqdm import tqdm
+
+from ..config import Config
+from ..logging import logger
+from ..modules.profiler import Profiler
+from ..utils import lazy_import
+
+laspy = lazy_import("laspy")
+
+
+@dataclass
+class LasIndex:
+    """
+    Sidecar spatial index of a LAS file, stored next to the file. The records are split into blocks of consecutive
+    records, and the bounding box of each block is stored. Mobile mapping records are in the order they were scanned,
+    so each block covers a small part of the road, and a region is read by seeking to the blocks that overlap it
+    """
+    DTYPE = np.dtype([
+        ("start", np.int64),  # First record of the block
+        ("count", np.int64),  # Number of records in the block
+        ("x_min", np.int32),  # Bounding box of the block in LAS integer coordinates
+        ("y_min", np.int32),
+        ("x_max", np.int32),
+        ("y_max", np.int32),
+        ("max_intensity", np.uint16),  # Used to normalize the intensity as when the whole file is read
+    ])
+
+    @staticmethod
+    def path(file_path: str) -> str:
+        """
+        Path to the sidecar index of a LAS file
+        :param file_path: Path to .las file
+        :return:
+        """
+        return os.path.splitext(file_path)[0] + ".lasindex.npz"
+
+    @staticmethod
+    def load(file_path: str) -> np.ndarray:
+        """
+        Loads the index of a LAS file, or builds it if the file has no index or has changed since it was built
+        :param file_path: Path to .las file
+        :return: Structured array with one row per block, see LasIndex.DTYPE
+        """
+        index_path = LasIndex.path(file_path=file_path)
+        if os.path.exists(index_path):
+            with np.load(index_path) as index:
+                if index["source"].tolist() == LasIndex.__source(file_path=file_path):
+                    return index["blocks"]
+
+            logger.info(f"{file_path} has changed since its index was built")
+
+        return LasIndex.build(file_path=file_path)
+
+    @staticmethod
+    @Profiler.profiled("las_index")
+    def build(file_path: str) -> np.ndarray:
+        """
+        Builds the index of a LAS file and saves it next to the file
+        :param file_path: Path to .las file
+        :return: Structured array with one row per block, see LasIndex.DTYPE
+        """
+        logger.info(f"Building the index of {file_path}")
+        block_size = Config.INDEX_BLOCK_SIZE.value
+        with laspy.open(file_path) as f:
+            blocks = np.zeros(math.ceil(f.header.point_count / block_size), dtype=LasIndex.DTYPE)
+            start = 0
+            for i, points in enumerate(tqdm(
+                    f.chunk_iterator(block_size),
+                    total=len(blocks),
+                    desc="Indexing point cloud",
+                    ncols=Config.LOADING_BAR_LENGTH.value
+            )):
+                blocks[i] = (
+                    start, len(points), points.X.min(), points.Y.min(), points.X.max(), points.Y.max(),
+                    points.intensity.max()
+                )
+                start += len(points)
+
+        # Written to a temporary file first, so an interrupted build does not leave a broken index. The temporary file
+        # is named after the process, as the index may be built by several processes at the same time
+        index_path = LasIndex.path(file_path=file_path)
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, blocks=blocks, source=np.array(LasIndex.__source(file_path=file_path)))
+
+        os.replace(tmp_path, index_path)
+        logger.info(f"Index of {len(blocks)} blocks saved at {index_path}")
+
+        return blocks
+
+    @staticmethod
+    def query(blocks: np.ndarray, bounds: tuple[int, int, int, int]) -> list[tuple[int, int]]:
+        """
+        Finds the records of the blocks that overlap a bounding box
+        :param blocks: Index of a LAS file
+        :param bounds: (x_min, y_min, x_max, y_max) in LAS integer coordinates
+        :return: (start, end) record ranges, end exclusive. Consecutive blocks are merged into one range
+        """
+        x_min, y_min, x_max, y_max = bounds
+        overlapping = blocks[
+            (blocks["x_min"] <= x_max) & (blocks["x_max"] >= x_min) &
+            (blocks["y_min"] <= y_max) & (blocks["y_max"] >= y_min)
+        ]
+
+        ranges = []
+        for start, count in zip(overlapping["start"].tolist(), overlapping["count"].tolist()):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], start + count)
+            else:
+                ranges.append((start, start + count))
+
+        return ranges
+
+    @staticmethod
+    def __source(file_path: str) -> list[int]:
+        """
+        Identifies the version of a LAS file an index was built from, without reading the file
+        :param file_path: Path to .las file
+        :return: File size, modification time in nanoseconds and block size
+        """
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns, Config.INDEX_BLOCK_SIZE.value]
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+
+from ..config import Config
+from ..logging import logger
+from ..modules.point_buffer import PointBuffer
+
+POINT_BUFFER_COLUMNS = ("xyz", "intensity", "normals", "labels", "record_indexes")
+
+
+@dataclass
+class Stage:
+    """
+    Named step of a pipeline. The function is called with the inputs as keyword arguments, and returns a dictionary
+    with the outputs
+    """
+    name: str
+    function: Callable[..., dict[str, Any]]
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+    settings: tuple[str, ...] = ()  # Names of the config values that affect the outputs
+    fingerprint: Callable[[], str] = None  # Extra fingerprint of the stage, e.g. of files it reads
+
+
+@dataclass
+class Pipeline:
+    """
+    Graph of stages connected by the names of their inputs and outputs. Every stage has a fingerprint made from its
+    settings and the fingerprints of its inputs, and its outputs are checkpointed when it completes. A stage whose
+    fingerprint matches its checkpoint is skipped, and its outputs are only loaded if a stage that has to run needs
+    them, so an interrupted run resumes after the last completed stage
+    """
+    stages: list[Stage]
+    checkpoint_dir: str
+    __manifest: dict  # Fingerprint and output filenames of each completed stage
+
+    def __init__(self, stages: list[Stage], checkpoint_dir: str) -> None:
+        """
+        Constructor for the Pipeline class
+        :param stages: Stages in an order where every stage comes after the stages producing its inputs
+        :param checkpoint_dir: Directory of the checkpoints of this pipeline
+        """
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"{output} is produced by both {producers[output]} and {stage.name}")
+
+                producers[output] = stage.name
+
+        self.stages = stages
+        self.checkpoint_dir = checkpoint_dir
+        self.__manifest = {}
+
+    def run(self, values: dict[str, Any], targets: tuple[str, ...]) -> dict[str, Any]:
+        """
+        Runs the stages needed for the targets
+        :param values: Inputs of the pipeline that are not produced by any stage, e.g. {"las_path": ...}. Their
+        fingerprint is their value, so inputs that are files should be given with a content hash, see Stage.fingerprint
+        :param targets: Names of the outputs to produce
+        :return: The targets
+        """
+        self.__manifest = self.__load_manifest() if Config.USE_CHECKPOINTS.value else {}
+        fingerprints = {name: self.__hash(value) for name, value in values.items()}
+        values = dict(values)
+        checkpointed = {}  # Outputs that can be loaded from a checkpoint, keyed on name
+
+        for stage in self.__required_stages(targets=targets, available=values.keys()):
+            fingerprint = self.__hash([
+                stage.name,
+                {name: Config[name].value for name in stage.settings},
+                stage.fingerprint() if stage.fingerprint is not None else None,
+                [fingerprints[name] for name in stage.inputs]
+            ])
+            for output in stage.outputs:
+                fingerprints[output] = self.__hash([fingerprint, output])
+
+            entry = self.__manifest.get(stage.name)
+            if entry is not None and entry["fingerprint"] == fingerprint and self.__is_complete(entry):
+                logger.info(f"Skipping stage {stage.name}, its inputs are unchanged")
+                checkpointed.update(entry["outputs"])
+                continue
+
+            logger.info(f"Running stage {stage.name}")
+            inputs = {name: self.__value(name, values, checkpointed) for name in stage.inputs}
+            outputs = stage.function(**inputs)
+            if set(outputs) != set(stage.outputs):
+                raise ValueError(
+                    f"Stage {stage.name} returned {', '.join(outputs)}, expected {', '.join(stage.outputs)}"
+                )
+
+            values.update(outputs)
+            for output in outputs:
+                checkpointed.pop(output, None)
+
+            if Config.USE_CHECKPOINTS.value:
+                self.__checkpoint(stage=stage, fingerprint=fingerprint, outputs=outputs)
+
+        return {name: self.__value(name, values, checkpointed) for name in targets}
+
+    def __required_stages(self, targets: tuple[str, ...], available: Any) -> list[Stage]:
+        """
+        Finds the stages that the targets depend on
+        :param targets: Names of the outputs to produce
+        :param available: Names of the values given to the pipeline
+        :return: The required stages, in pipeline order
+        """
+        producers = {output: stage for stage in self.stages for output in stage.outputs}
+        required = set()
+        missing = list(targets)
+
+        while missing:
+            name = missing.pop()
+            if name in available:
+                continue
+
+            if name not in producers:
+                raise ValueError(f"No stage produces {name}")
+
+            stage = producers[name]
+            if stage.name not in required:
+                required.add(stage.name)
+                missing.extend(stage.inputs)
+
+        return [stage for stage in self.stages if stage.name in required]
+
+    def __value(self, name: str, values: dict[str, Any], checkpointed: dict[str, str]) -> Any:
+        """
+        Gets a value from memory, or loads it from its checkpoint
+        :param name: Name of the value
+        :param values: Values in memory
+        :param checkpointed: Checkpoint filenames of the values that have not been loaded
+        :return:
+        """
+        if name not in values:
+            logger.debug(f"Loading {name} from checkpoint")
+            values[name] = self.__load(os.path.join(self.checkpoint_dir, checkpointed.pop(name)))
+
+        return values[name]
+
+    def __checkpoint(self, stage: Stage, fingerprint: str, outputs: dict[str, Any]) -> None:
+        """
+        Saves the outputs of a completed stage and records them in the manifest
+        :param stage: The completed stage
+        :param fingerprint: Fingerprint of the stage
+        :param outputs: Outputs of the stage
+        :return:
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        if self.__manifest.pop(stage.name, None) is not None:
+            self.__save_manifest()  # The old checkpoint is no longer valid while it is being overwritten
+
+        filenames = {
+            name: self.__save(os.path.join(self.checkpoint_dir, f"{stage.name}.{name}"), value)
+            for name, value in outputs.items()
+        }
+
+        self.__manifest[stage.name] = {"fingerprint": fingerprint, "outputs": filenames}
+        self.__save_manifest()
+        logger.debug(f"Checkpointed stage {stage.name}")
+
+    def __save_manifest(self) -> None:
+        """
+        Saves the manifest. It is written to a temporary file first, so an interruption cannot leave it half written
+        :return:
+        """
+        manifest_path = os.path.join(self.checkpoint_dir, "manifest.json")
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(self.__manifest, f, indent=4)
+
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def __load_manifest(self) -> dict:
+        """
+        Loads the manifest of the completed stages
+        :return: Fingerprint and output filenames of each completed stage, keyed on the stage name
+        """
+        manifest_path = os.path.join(self.checkpoint_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return {}
+
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def __is_complete(self, entry: dict) -> bool:
+        """
+        Checks that the checkpoints of a stage exist, and that the files its outputs point to still exist
+        :param entry: Manifest entry of the stage
+        :return:
+        """
+        for filename in entry["outputs"].values():
+            path = os.path.join(self.checkpoint_dir, filename)
+            if not os.path.exists(path):
+                return False
+
+            if path.endswith(".json"):
+                with open(path, "r") as f:
+                    value = json.load(f)
+
+                if isinstance(value, str) and os.path.isabs(value) and not os.path.exists(value):
+                    return False  # Output file of the stage has been removed
+
+        return True
+
+    @staticmethod
+    def __save(path: str, value: Any) -> str:
+        """
+        Saves a value. Point buffers are saved as a directory of .npy files, arrays as .npy files, JSON serializable
+        values as .json files and everything else is pickled. The extension is added to the path
+        :param path: Path without extension
+        :param value: Value to save
+        :return: Filename of the saved value
+        """
+        for stale_path in (path, *(path + extension for extension in (".npy", ".json", ".pkl"))):
+            if os.path.isdir(stale_path):
+                shutil.rmtree(stale_path)
+            elif os.path.exists(stale_path):
+                os.remove(stale_path)
+
+        if isinstance(value, PointBuffer):
+            os.makedirs(path)
+            for column in POINT_BUFFER_COLUMNS:
+                if getattr(value, column) is not None:
+                    np.save(os.path.join(path, f"{column}.npy"), getattr(value, column))
+        elif isinstance(value, np.ndarray):
+            path += ".npy"
+            np.save(path, value)
+        elif isinstance(value, (str, int, float, bool, type(None))):
+            path += ".json"
+            with open(path, "w") as f:
+                json.dump(value, f)
+        else:
+            path += ".pkl"
+            with open(path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return os.path.basename(path)
+
+    @staticmethod
+    def __load(path: str) -> Any:
+        """
+        Loads a value saved by __save
+        :param path: Path to the saved value
+        :return:
+        """
+        if os.path.isdir(path):
+            # Copy-on-write memory maps, as Open3D only accepts writeable arrays
+            return PointBuffer(**{
+                column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="c") for column in POINT_BUFFER_COLUMNS
+                if os.path.exists(os.path.join(path, f"{column}.npy"))
+            })
+
+        if path.endswith(".npy"):
+            return np.load(path)
+
+        if path.endswith(".json"):
+            with open(path, "r") as f:
+                return json.load(f)
+
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def __hash(value: Any) -> str:
+        """
+        Hashes a JSON serializable value
+        :param value:
+        :return: SHA-256 hex digest
+        """
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
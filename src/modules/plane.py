@@ -1,12 +1,17 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
+from typing import Any, Callable
 
 import numpy as np
-import open3d as o3d
 
 from ..config import Config
 from ..logging import logger
 from ..modules.point import Point
-from ..utils import point_plane_dist, vector_angle, pcd_to_df
+from ..modules.point_buffer import PointBuffer
+from ..utils import lazy_import, point_plane_dist, points_plane_dists, vector_angles
+
+o3d = lazy_import("open3d")
 
 
 @dataclass
@@ -15,10 +20,17 @@ class Plane:
     __b: float  # y
     __c: float  # z
     __d: float  # Distance from origin
-    __pcd: o3d.geometry.PointCloud
+    __pcd: PointBuffer
 
     def __init__(
-            self, a: float, b: float, c: float, d: float, pcd: o3d.geometry.PointCloud
+            self,
+            a: float,
+            b: float,
+            c: float,
+            d: float,
+            pcd: PointBuffer,
+            indexes: np.ndarray = None,
+            metrics: dict[str, Any] = None
     ) -> None:
         """
         Constructor for the Plane class
@@ -26,14 +38,20 @@ class Plane:
         :param b:
         :param c:
         :param d:
+        :param pcd: Inliers of the plane
+        :param indexes: Indexes of the inliers in the point cloud the segment was taken from
+        :param metrics: Metrics that are already known, e.g. {"dist_std": ...}. They are used instead of computing them
         """
+        self.__metrics = {}  # Cached segment metrics, cleared whenever the plane or its points change
         self.a = a
         self.b = b
         self.c = c
         self.d = d
         self.pcd = pcd
+        self.indexes = indexes
+        self.__metrics.update(metrics or {})
 
-        logger.debug(f"Plane created with {len(self.__pcd.points)} inliers")
+        logger.debug(f"Plane created with {len(self.__pcd)} inliers")
 
     @property
     def a(self) -> float:
@@ -54,6 +72,7 @@ class Plane:
             raise ValueError("a cannot be None")
 
         self.__a = a
+        self.reset_metrics()
 
     @property
     def b(self) -> float:
@@ -74,6 +93,7 @@ class Plane:
             raise ValueError("b cannot be None")
 
         self.__b = b
+        self.reset_metrics()
 
     @property
     def c(self) -> float:
@@ -94,6 +114,7 @@ class Plane:
             raise ValueError("c cannot be None")
 
         self.__c = c
+        self.reset_metrics()
 
     @property
     def d(self) -> float:
@@ -114,9 +135,10 @@ class Plane:
             raise ValueError("d cannot be None")
 
         self.__d = d
+        self.reset_metrics()
 
     @property
-    def pcd(self) -> o3d.geometry.PointCloud:
+    def pcd(self) -> PointBuffer:
         """
         Getter for pcd
         :return:
@@ -124,7 +146,7 @@ class Plane:
         return self.__pcd
 
     @pcd.setter
-    def pcd(self, pcd: o3d.geometry.PointCloud) -> None:
+    def pcd(self, pcd: PointBuffer) -> None:
         """
         Setter for pcd
         :param pcd:
@@ -133,13 +155,34 @@ class Plane:
         if pcd is None:
             raise ValueError("pcd cannot be None")
 
-        if len(pcd.points) == 0:
-            logger.warning("Point cloud has no points")
+        if not isinstance(pcd, PointBuffer):
+            raise TypeError(f"Expected PointBuffer, got {type(pcd)}")
 
-        if not isinstance(pcd, o3d.geometry.PointCloud):
-            raise TypeError(f"Expected o3d.geometry.PointCloud, got {type(pcd)}")
+        if len(pcd) == 0:
+            logger.warning("Point cloud has no points")
 
         self.__pcd = pcd
+        self.reset_metrics()
+
+    @property
+    def indexes(self) -> np.ndarray:
+        """
+        Getter for indexes
+        :return:
+        """
+        return self.__indexes
+
+    @indexes.setter
+    def indexes(self, indexes: np.ndarray) -> None:
+        """
+        Setter for indexes
+        :param indexes:
+        :return:
+        """
+        if indexes is not None and len(indexes) != len(self.pcd):
+            raise ValueError(f"Expected {len(self.pcd)} indexes, got {len(indexes)}")
+
+        self.__indexes = indexes
 
     def z(self, x: float, y: float) -> float:
         """
@@ -161,24 +204,32 @@ class Plane:
 
         return point_plane_dist(point, self)
 
-    @property
-    def distances(self) -> np.array:
+    def reset_metrics(self) -> None:
         """
-        Calculates all distances between the points and the plane
+        Clears the cached metrics. Must be called if the points of the point cloud are modified in place
         :return:
         """
-        df = pcd_to_df(self.pcd)
-        X, Y, Z = df["X"], df["Y"], df["Z"]
+        self.__metrics = {}
 
-        distances = np.zeros(len(X))
-        for i in range(len(X)):
-            x = X[i]
-            y = Y[i]
-            z = Z[i]
+    def __cached(self, name: str, compute: Callable[[], Any]) -> Any:
+        """
+        Returns a cached metric, computing it on first access
+        :param name: Name of the metric
+        :param compute: Function computing the metric
+        :return: The metric
+        """
+        if name not in self.__metrics:
+            self.__metrics[name] = compute()
 
-            distances[i] = self.point_distance(Point(x, y, z))
+        return self.__metrics[name]
 
-        return distances
+    @property
+    def distances(self) -> np.array:
+        """
+        Calculates all distances between the points and the plane
+        :return:
+        """
+        return self.__cached("distances", lambda: points_plane_dists(self.pcd.xyz, self))
 
     @property
     def mean_dist(self) -> float:
@@ -186,7 +237,7 @@ class Plane:
         Calculates the mean distance between the points and the plane
         :return:
         """
-        return np.mean(self.distances)
+        return self.__cached("mean_dist", lambda: np.mean(self.distances))
 
     @property
     def dist_std(self) -> float:
@@ -194,7 +245,7 @@ class Plane:
         Calculates the standard deviation of the distances between the points and the plane
         :return:
         """
-        return np.std(self.distances)
+        return self.__cached("dist_std", lambda: np.std(self.distances))
 
     @property
     def normal_vector(self) -> np.array:
@@ -210,20 +261,26 @@ class Plane:
         Calculates the deviation between and the estimated normal vectors of the segmented point cloud
         :return: Numpy array with the angles between the normal vectors given in degrees
         """
-        # TODO: Test
-        pcd = self.pcd
-        pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(
-            radius=Config.SEARCH_RADIUS.value,
-            max_nn=Config.MAX_NEAREST_NEIGHBOURS.value
-        ))
-
-        normals = np.asarray(pcd.normals)
-        deviation = np.zeros(len(normals))
+        return self.__cached("norm_vec_devs", self.__norm_vec_devs)
 
-        for i, normal in enumerate(normals):
-            deviation[i] = vector_angle(v1=self.normal_vector, v2=normal)
+    def __norm_vec_devs(self) -> np.array:
+        """
+        Calculates the deviation between the plane normal and the normals of the segmented point cloud. The normals
+        are normally estimated once on the full point cloud, see PointCloud.estimate_normals. They are only estimated
+        on the segment itself if the point cloud has none
+        :return: Numpy array with the angles between the normal vectors given in degrees
+        """
+        normals = self.pcd.normals
+        if normals is None:
+            logger.debug("Segment has no normals, estimating normals on the segment")
+            pcd = self.pcd.to_pcd()
+            pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(
+                radius=Config.SEARCH_RADIUS.value,
+                max_nn=Config.MAX_NEAREST_NEIGHBOURS.value
+            ))
+            normals = np.asarray(pcd.normals)
 
-        return deviation
+        return vector_angles(v=self.normal_vector, vectors=normals)
 
     @property
     def mean_angle_dev(self) -> float:
@@ -231,4 +288,4 @@ class Plane:
         Calculates the mean deviation between the estimated normal vectors of the plane and a normal vector of the plane
         :return: Mean deviation
         """
-        return np.mean(self.norm_vec_devs)
+        return self.__cached("mean_angle_dev", lambda: np.mean(self.norm_vec_devs))
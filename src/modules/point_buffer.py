@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ..logging import logger
+from ..utils import lazy_import
+
+o3d = lazy_import("open3d")
+
+if TYPE_CHECKING:
+    from ..modules.spatial_index import SpatialIndex
+
+
+@dataclass(eq=False)
+class PointBuffer:
+    """
+    Columnar point container that is passed through the pipeline. Selecting a range of points returns NumPy views,
+    and Open3D point clouds are only created where an Open3D algorithm is called
+    """
+    __xyz: np.ndarray  # x, y and z coordinates, shape (N, 3). LAS integer coordinates as int32 in compact mode
+    __intensity: np.ndarray  # Normalized intensity as float, or uint16 where the maximum value is 1, shape (N,)
+    __normals: np.ndarray | None  # Normal vectors, shape (N, 3)
+    __labels: np.ndarray | None  # Label of each point, see Label, shape (N,)
+    __record_indexes: np.ndarray | None  # Index of each point in the LAS file it was read from, shape (N,)
+    __spatial_index: SpatialIndex | None  # KD-tree of the points. Not carried over by select
+
+    def __init__(
+            self,
+            xyz: np.ndarray,
+            intensity: np.ndarray,
+            normals: np.ndarray = None,
+            labels: np.ndarray = None,
+            record_indexes: np.ndarray = None
+    ) -> None:
+        """
+        Constructor for the PointBuffer class. The arrays are stored as given, without copying
+        :param xyz:
+        :param intensity:
+        :param normals:
+        :param labels:
+        :param record_indexes:
+        """
+        self.xyz = xyz
+        self.intensity = intensity
+        self.normals = normals
+        self.labels = labels
+        self.record_indexes = record_indexes
+
+    @property
+    def xyz(self) -> np.ndarray:
+        """
+        Getter for xyz
+        :return:
+        """
+        return self.__xyz
+
+    @xyz.setter
+    def xyz(self, xyz: np.ndarray) -> None:
+        """
+        Setter for xyz
+        :param xyz:
+        :return:
+        """
+        if xyz is None:
+            raise ValueError("xyz cannot be None")
+
+        if xyz.ndim != 2 or xyz.shape[1] != 3:
+            raise ValueError(f"Expected xyz of shape (N, 3), got {xyz.shape}")
+
+        if len(xyz) == 0:
+            logger.debug("Point buffer has no points")  # E.g. an empty selection, an empty halo or tile
+
+        self.__xyz = xyz
+        self.__spatial_index = None  # Built for the previous points
+
+    @property
+    def intensity(self) -> np.ndarray:
+        """
+        Getter for intensity
+        :return:
+        """
+        return self.__intensity
+
+    @intensity.setter
+    def intensity(self, intensity: np.ndarray) -> None:
+        """
+        Setter for intensity
+        :param intensity:
+        :return:
+        """
+        if intensity is None:
+            raise ValueError("intensity cannot be None")
+
+        self.__validate_length(intensity, "intensity")
+        self.__intensity = intensity
+
+    @property
+    def normals(self) -> np.ndarray | None:
+        """
+        Getter for normals
+        :return: The normals, or None if they have not been estimated
+        """
+        return self.__normals
+
+    @normals.setter
+    def normals(self, normals: np.ndarray | None) -> None:
+        """
+        Setter for normals
+        :param normals:
+        :return:
+        """
+        if normals is not None:
+            self.__validate_length(normals, "normals")
+
+        self.__normals = normals
+
+    @property
+    def labels(self) -> np.ndarray | None:
+        """
+        Getter for labels
+        :return: The labels, or None if the points have not been labelled
+        """
+        return self.__labels
+
+    @labels.setter
+    def labels(self, labels: np.ndarray | None) -> None:
+        """
+        Setter for labels
+        :param labels:
+        :return:
+        """
+        if labels is not None:
+            self.__validate_length(labels, "labels")
+
+        self.__labels = labels
+
+    @property
+    def record_indexes(self) -> np.ndarray | None:
+        """
+        Getter for record_indexes
+        :return: The record indexes, or None if the points were not read from a LAS file
+        """
+        return self.__record_indexes
+
+    @record_indexes.setter
+    def record_indexes(self, record_indexes: np.ndarray | None) -> None:
+        """
+        Setter for record_indexes
+        :param record_indexes:
+        :return:
+        """
+        if record_indexes is not None:
+            self.__validate_length(record_indexes, "record_indexes")
+
+        self.__record_indexes = record_indexes
+
+    @property
+    def spatial_index(self) -> SpatialIndex | None:
+        """
+        Getter for spatial_index
+        :return: The spatial index, or None if it has not been built, see PointCloud.build_spatial_index
+        """
+        return self.__spatial_index
+
+    @spatial_index.setter
+    def spatial_index(self, spatial_index: SpatialIndex | None) -> None:
+        """
+        Setter for spatial_index
+        :param spatial_index:
+        :return:
+        """
+        if spatial_index is not None and len(spatial_index) != len(self):
+            raise ValueError(f"Expected a spatial index of {len(self)} points, got {len(spatial_index)}")
+
+        self.__spatial_index = spatial_index
+
+    def __validate_length(self, column: np.ndarray, name: str) -> None:
+        """
+        Checks that a column has one row per point
+        :param column:
+        :param name: Name of the column
+        :return:
+        """
+        if len(column) != len(self.xyz):
+            raise ValueError(f"Expected {len(self.xyz)} rows of {name}, got {len(column)}")
+
+    def __len__(self) -> int:
+        """
+        Number of points in the buffer
+        :return:
+        """
+        return len(self.xyz)
+
+    def select(self, indexes: slice | np.ndarray) -> PointBuffer:
+        """
+        Selects a subset of the points. Slices return views of the columns, index arrays and boolean masks return
+        copies
+        :param indexes: Slice, index array or boolean mask
+        :return: Point buffer with the selected points
+        """
+        return PointBuffer(
+            xyz=self.xyz[indexes],
+            intensity=self.intensity[indexes],
+            normals=None if self.normals is None else self.normals[indexes],
+            labels=None if self.labels is None else self.labels[indexes],
+            record_indexes=None if self.record_indexes is None else self.record_indexes[indexes]
+        )
+
+    def normalized_intensity(self) -> np.ndarray:
+        """
+        The intensity as floats between 0 and 1, whether it is stored as floats or compact uint16 values
+        :return: Numpy array of shape (N,)
+        """
+        if self.intensity.dtype == np.uint16:
+            return self.intensity / np.iinfo(np.uint16).max
+
+        return self.intensity
+
+    def to_pcd(self, normals: bool = False, colors: bool = False) -> o3d.geometry.PointCloud:
+        """
+        Creates an Open3D point cloud of the points. Only the requested columns are converted
+        :param normals: Whether to add the normals, if any. Default: False
+        :param colors: Whether to add the intensity as gray scale colors. Default: False
+        :return: Point cloud object
+        """
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(np.asarray(self.xyz, dtype=np.float64))  # Open3D only takes float64
+
+        if normals and self.normals is not None:
+            pcd.normals = o3d.utility.Vector3dVector(np.asarray(self.normals, dtype=np.float64))
+
+        if colors:
+            pcd.colors = o3d.utility.Vector3dVector(np.repeat(self.normalized_intensity()[:, np.newaxis], 3, axis=1))
+
+        return pcd
+
+    @staticmethod
+    def from_pcd(pcd: o3d.geometry.PointCloud) -> PointBuffer:
+        """
+        Creates a point buffer from an Open3D point cloud with the intensity stored as colors
+        :param pcd: Point cloud object
+        :return: Point buffer viewing the arrays of the point cloud
+        """
+        return PointBuffer(
+            xyz=np.asarray(pcd.points),
+            intensity=np.asarray(pcd.colors)[:, 0],
+            normals=np.asarray(pcd.normals) if pcd.has_normals() else None
+        )
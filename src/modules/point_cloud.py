@@ -1,23 +1,32 @@
+from __future__ import annotations
+
+import copy
 import math
 import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
 
-import laspy
 import numpy as np
-import open3d as o3d
-import pandas as pd
-from open3d.cpu.pybind.geometry import PointCloud
 from tqdm import tqdm
 
 from ..config import Config
 from ..logging import logger
-from ..modules import Plane
-from ..utils import df_to_pcd, pcd_to_df, indexes_to_pcd, pcd_to_plane, create_df
+from ..modules import LasIndex, Label, Plane, PointBuffer, Profiler, SegmentFeatures, Shapefile, SpatialIndex
+from ..utils import (
+    lazy_import, pcd_to_plane, to_shared_memory, from_shared_memory, prefix_moments, window_planes,
+    statistical_inlier_mask
+)
+
+laspy = lazy_import("laspy")
+o3d = lazy_import("open3d")
+shapely = lazy_import("shapely")
 
 
 class PointCloud:
     @staticmethod
-    def create(file_path: str) -> o3d.geometry.PointCloud:
+    @Profiler.profiled("create")
+    def create(file_path: str) -> PointBuffer:
         """
         Creates a point cloud object from a .las file.
         :param file_path: Path to .las file
@@ -33,36 +42,269 @@ class PointCloud:
             raise ValueError("Path does not end with .las")
 
         logger.info(f"Creating point cloud from {file_path}")
+        every_k_points = Config.UNIFORM_DOWN_SAMPLE.value if Config.DOWN_SAMPLE_ON_READ.value else 1
+
+        with laspy.open(file_path) as f:
+            point_count = f.header.point_count
+            logger.info(f"Point format: {f.header.point_format.id}")
+            logger.info(f"No. points: {point_count}")
+            logger.info(f"Dimensions: {', '.join([name for name in f.header.point_format.dimension_names])}")
+
+            # Preallocated buffers for the points kept by the uniform down sampling. The compact mode keeps the LAS
+            # integer coordinates and intensity, and only converts to float64 where Open3D needs it
+            compact = Config.COMPACT_POINTS.value
+            sampled_count = math.ceil(point_count / every_k_points)
+            xyz = np.empty((sampled_count, 3), dtype=np.int32 if compact else np.float64)
+            intensity = np.empty(sampled_count, dtype=np.uint16 if compact else np.float64)
+            record_indexes = np.empty(
+                sampled_count, dtype=np.uint32 if compact and point_count <= np.iinfo(np.uint32).max else np.int64
+            )  # Index of each kept point in the file
+            max_intensity = 0
+            read_count = 0  # Number of points read from the file
+            sampled = 0  # Number of points written to the buffers
+
+            for points in tqdm(
+                    f.chunk_iterator(Config.CHUNK_SIZE.value),
+                    total=math.ceil(point_count / Config.CHUNK_SIZE.value),
+                    desc="Reading point cloud",
+                    ncols=Config.LOADING_BAR_LENGTH.value
+            ):
+                # Keeping every k-th point of the file, counted from the first point of the file
+                kept = slice(-read_count % every_k_points, None, every_k_points)
+                n = len(range(*kept.indices(len(points))))
+
+                xyz[sampled:sampled + n, 0] = points.X[kept]
+                xyz[sampled:sampled + n, 1] = points.Y[kept]
+                xyz[sampled:sampled + n, 2] = points.Z[kept]
+                intensity[sampled:sampled + n] = points.intensity[kept]
+                record_indexes[sampled:sampled + n] = np.arange(*kept.indices(len(points))) + read_count
+                max_intensity = max(max_intensity, np.max(points.intensity))  # Maximum of all points in the file
+
+                read_count += len(points)
+                sampled += n
+
+        if max_intensity > 0 and compact:
+            # Normalizing intensity to the full uint16 range
+            intensity[:] = intensity.astype(np.uint32) * np.iinfo(np.uint16).max // max_intensity
+        elif max_intensity > 0:
+            intensity /= max_intensity  # Normalizing intensity
+
+        logger.debug(f"Read {sampled} of {read_count} points")
+
+        # Views of the filled buffers
+        return PointBuffer(xyz=xyz[:sampled], intensity=intensity[:sampled], record_indexes=record_indexes[:sampled])
+
+    @staticmethod
+    @Profiler.profiled("create")
+    def create_region(
+            file_path: str, region: tuple[float, float, float, float] | shapely.Geometry | np.ndarray
+    ) -> PointBuffer:
+        """
+        Creates a point cloud object from the points of a .las file within a region. Only the blocks of records that
+        overlap the region are read, found from the sidecar index of the file, see LasIndex. The points are down sampled
+        and normalized as in PointCloud.create, so they are the same points as when the whole file is read and cropped
+        :param file_path: Path to .las file
+        :param region: Bounding box (x_min, y_min, x_max, y_max), geometry or array of geometries, e.g. the buffered
+        geometries from Shapefile.buffer, in the coordinates of the LAS file
+        :return: Point cloud object
+        """
+        if not file_path or not file_path.endswith(".las"):
+            raise ValueError("Path does not end with .las")
+
+        blocks = LasIndex.load(file_path=file_path)
+        tree = None  # Geometries of the region, if it is not a bounding box
+        if not isinstance(region, tuple):
+            tree = shapely.STRtree(np.atleast_1d(region))
+            region = tuple(shapely.total_bounds(tree.geometries))
+
+        compact = Config.COMPACT_POINTS.value
+        every_k_points = Config.UNIFORM_DOWN_SAMPLE.value if Config.DOWN_SAMPLE_ON_READ.value else 1
+        xyz, intensity, record_indexes = [], [], []
+
         with laspy.open(file_path) as f:
-            las = f.read()  # Reading file and creating laspy object
+            scales, offsets, point_count = f.header.scales, f.header.offsets, f.header.point_count
+            x_min, y_min = np.floor((np.array(region[:2]) - offsets[:2]) / scales[:2]).astype(np.int64)
+            x_max, y_max = np.ceil((np.array(region[2:]) - offsets[:2]) / scales[:2]).astype(np.int64)
+            ranges = LasIndex.query(blocks=blocks, bounds=(x_min, y_min, x_max, y_max))
+
+            read_count = sum(end - start for start, end in ranges)
+            logger.info(
+                f"Reading {read_count} of {point_count} points from {file_path} in {len(ranges)} ranges"
+            )
+
+            for start, end in tqdm(ranges, desc="Reading region", ncols=Config.LOADING_BAR_LENGTH.value):
+                f.seek(start)
+                for chunk_start in range(start, end, Config.CHUNK_SIZE.value):
+                    points = f.read_points(min(Config.CHUNK_SIZE.value, end - chunk_start))
+                    indexes = np.arange(chunk_start, chunk_start + len(points))
+
+                    # Every k-th point of the file within the bounding box, and within a geometry if given
+                    kept = (indexes % every_k_points == 0) & (points.X >= x_min) & (points.X <= x_max) & \
+                           (points.Y >= y_min) & (points.Y <= y_max)
+                    if tree is not None:
+                        candidates = np.flatnonzero(kept)
+                        point_indexes, _ = tree.query(
+                            shapely.points(points.x[candidates], points.y[candidates]), predicate="intersects"
+                        )
+                        kept[:] = False
+                        kept[candidates[point_indexes]] = True
+
+                    xyz.append(np.column_stack((points.X[kept], points.Y[kept], points.Z[kept])))
+                    intensity.append(np.asarray(points.intensity[kept]))
+                    record_indexes.append(indexes[kept])
+
+        xyz = np.concatenate(xyz) if xyz else np.empty((0, 3), dtype=np.int32)
+        intensity = np.concatenate(intensity) if intensity else np.empty(0, dtype=np.uint16)
+        record_indexes = np.concatenate(record_indexes) if record_indexes else np.empty(0, dtype=np.int64)
+
+        # Normalizing intensity with the maximum of all points in the file
+        max_intensity = max(int(blocks["max_intensity"].max(initial=0)), 1)
+        if compact:
+            intensity = (intensity.astype(np.uint32) * np.iinfo(np.uint16).max // max_intensity).astype(np.uint16)
+        else:
+            intensity = intensity / max_intensity
+
+        logger.debug(f"Read {len(xyz)} points within the region")
+
+        return PointBuffer(
+            xyz=xyz if compact else xyz.astype(np.float64),
+            intensity=intensity,
+            record_indexes=record_indexes.astype(
+                np.uint32 if compact and point_count <= np.iinfo(np.uint32).max else np.int64
+            )
+        )
+
+    @staticmethod
+    @Profiler.profiled("write")
+    def write(pcd: PointBuffer, source_path: str, filename: str = None, compress: bool = None) -> str:
+        """
+        Writes the points of a point cloud as a copy of the LAS file they were read from. The records are streamed
+        from the source file in chunks, so the header and every attribute of the points are kept, and only the
+        classification of each point is set from its label. Points that are not in the point cloud are left out
+        :param pcd: Point cloud read from source_path, see PointBuffer.record_indexes
+        :param source_path: Path to the .las file the point cloud was read from
+        :param filename: Name of the file, without extension
+        :param compress: Whether to write a compressed .laz file. Default: Config.COMPRESS_OUTPUT
+        :return: Path to the written file
+        """
+        if pcd.record_indexes is None:
+            raise ValueError("Point cloud has no record indexes, so it cannot be written as a copy of its source file")
+
+        # Records in file order, so each chunk of the source file maps to one range of the points
+        order = np.argsort(pcd.record_indexes, kind="stable")
+        record_indexes = pcd.record_indexes[order]
+        labels = None if pcd.labels is None else pcd.labels[order]
+
+        def kept_records(chunk_start: int, chunk_end: int) -> tuple[np.ndarray, np.ndarray | None]:
+            start, end = np.searchsorted(record_indexes, [chunk_start, chunk_end])
+            return record_indexes[start:end] - chunk_start, None if labels is None else labels[start:end]
+
+        # Only the chunks with points are read, e.g. the chunks of a region read by PointCloud.create_region
+        chunk_size = Config.CHUNK_SIZE.value
+        chunk_starts = np.unique(record_indexes // chunk_size).astype(np.int64) * chunk_size
+
+        return PointCloud.__write_records(
+            source_path=source_path, filename=filename, compress=compress, kept_records=kept_records,
+            chunk_starts=chunk_starts
+        )
+
+    @staticmethod
+    @Profiler.profiled("write")
+    def write_labels(labels: np.ndarray, source_path: str, filename: str = None, compress: bool = None) -> str:
+        """
+        Writes a copy of a LAS file from a label per record of the file, see PointCloud.write. Records labelled
+        Label.REMOVED are left out. The labels are read one chunk at a time, so they can be a memory map
+        :param labels: Label of each record of the source file, shape (point count,)
+        :param source_path: Path to the .las file
+        :param filename: Name of the file, without extension
+        :param compress: Whether to write a compressed .laz file. Default: Config.COMPRESS_OUTPUT
+        :return: Path to the written file
+        """
+        def kept_records(chunk_start: int, chunk_end: int) -> tuple[np.ndarray, np.ndarray]:
+            chunk_labels = np.asarray(labels[chunk_start:chunk_end])
+            offsets = np.flatnonzero(chunk_labels != Label.REMOVED)
+            return offsets, chunk_labels[offsets]
+
+        return PointCloud.__write_records(
+            source_path=source_path, filename=filename, compress=compress, kept_records=kept_records
+        )
 
-        logger.info(f"Point format: {las.point_format.id}")
-        logger.info(f"No. points: {len(las.points)}")
-        logger.info(f"Dimensions: {', '.join([name for name in las.point_format.dimension_names])}")
+    @staticmethod
+    def __write_records(
+            source_path: str,
+            filename: str | None,
+            compress: bool | None,
+            kept_records: Callable[[int, int], tuple[np.ndarray, np.ndarray | None]],
+            chunk_starts: np.ndarray = None
+    ) -> str:
+        """
+        Streams the records of a LAS file to a new file in chunks, keeping the header and the records selected by
+        kept_records, and setting their classification from their labels
+        :param source_path: Path to the .las file
+        :param filename: Name of the file, without extension
+        :param compress: Whether to write a compressed .laz file. Default: Config.COMPRESS_OUTPUT
+        :param kept_records: Function of the (start, end) record range of a chunk, returning the offsets of the kept
+        records in the chunk and their labels. Records without labels keep their classification
+        :param chunk_starts: First record of each chunk of Config.CHUNK_SIZE records to read. Default: Every chunk
+        :return: Path to the written file
+        """
+        compress = Config.COMPRESS_OUTPUT.value if compress is None else compress
+        if compress and not laspy.LazBackend.detect_available():
+            raise RuntimeError("No LAZ backend is installed. Install lazrs or laszip to write .laz files")
+
+        filename = (uuid.uuid4().hex if filename is None else filename) + (".laz" if compress else ".las")
+        path = os.path.join(Config.PROCESSED_PC_DIR.value, filename)
+        logger.info(f"Writing point cloud to {path}")
+
+        # Classification code of each label. Points without a label keep their classification
+        classification_codes = np.zeros(len(Label), dtype=np.uint8)
+        classification_codes[Label.SURFACE] = Config.SURFACE_CLASSIFICATION.value
+        classification_codes[Label.SPEED_BUMP] = Config.SPEED_BUMP_CLASSIFICATION.value
+
+        with laspy.open(source_path) as reader, laspy.open(
+                path, mode="w", header=copy.deepcopy(reader.header), do_compress=compress
+        ) as writer:
+            if chunk_starts is None:
+                chunk_starts = range(0, reader.header.point_count, Config.CHUNK_SIZE.value)
 
-        # Creating dataframe
-        rel_intensity = las.intensity / np.max(las.intensity)  # Normalizing intensity
-        point_df = create_df(
-            X=las.X, Y=las.Y, Z=las.Z, intensity=rel_intensity
-        )  # Dataframe with coordinates and intensity
+            written = 0  # Number of records written
+            for chunk_start in tqdm(chunk_starts, desc="Writing point cloud", ncols=Config.LOADING_BAR_LENGTH.value):
+                reader.seek(int(chunk_start))
+                points = reader.read_points(Config.CHUNK_SIZE.value)
+                offsets, kept_labels = kept_records(int(chunk_start), int(chunk_start) + len(points))
+                if len(offsets) == 0:
+                    continue
 
-        return df_to_pcd(df=point_df)  # Creating point cloud object
+                kept_points = points[offsets]
+                if kept_labels is not None:
+                    kept_points.classification = np.where(
+                        kept_labels == Label.REMOVED, kept_points.classification, classification_codes[kept_labels]
+                    )
+
+                writer.write_points(kept_points)
+                written += len(offsets)
+
+            logger.info(f"Point cloud written with {written} of {reader.header.point_count} points")
+
+        return path
 
     @staticmethod
-    def save(pcd: o3d.geometry.PointCloud, filename: str = None) -> None:
+    @Profiler.profiled("save")
+    def save(pcd: PointBuffer, filename: str = None) -> str:
         """
         Saves a point cloud object as a .las file.
         :param pcd: Point cloud to be saved
         :param filename: Name of the file, without extension
-        :return:
+        :return: Path to the saved file
         """
         logger.info("Saving point cloud as .las file")
         filename = uuid.uuid4().hex + ".las" if filename is None else filename + ".las"  # Creating filename
         path = os.path.join(Config.PROCESSED_PC_DIR.value, filename)
 
-        point_df = pcd_to_df(pcd=pcd)  # Converting point cloud to dataframe
-        X, Y, Z = point_df['X'].to_numpy(), point_df['Y'].to_numpy(), point_df['Z'].to_numpy()
-        intensity = point_df['intensity'].to_numpy() * 255  # De-normalizing intensity
+        X, Y, Z = pcd.xyz[:, 0], pcd.xyz[:, 1], pcd.xyz[:, 2]
+        intensity = pcd.normalized_intensity() * 255  # De-normalizing intensity
+        if pcd.labels is not None:
+            intensity[pcd.labels == Label.SPEED_BUMP] = 0  # Marking points that are part of a speed bump
 
         header = laspy.LasHeader(point_format=2, version="1.2")  # Creating header
         las = laspy.LasData(header=header)  # Creating laspy object
@@ -74,8 +316,10 @@ class PointCloud:
             f"The following information was saved: {', '.join([name for name in las.point_format.dimension_names])}"
         )
 
+        return path
+
     @staticmethod
-    def display(*pcd: o3d.geometry.PointCloud, show_normals: bool = False) -> None:
+    def display(*pcd: PointBuffer | o3d.geometry.PointCloud, show_normals: bool = False) -> None:
         """
         Displays a point cloud object.
         :param show_normals: Whether to show normals. Default: False
@@ -86,14 +330,16 @@ class PointCloud:
             raise ValueError("Point cloud is None")
 
         logger.info("Displaying point cloud")
-        if any(len(p.points) == 0 for p in pcd):
+        if any(len(p.points if isinstance(p, o3d.geometry.PointCloud) else p) == 0 for p in pcd):
             logger.warning("Point cloud is empty")
 
+        pcd = [p.to_pcd(normals=True, colors=True) if isinstance(p, PointBuffer) else p for p in pcd]
         o3d.visualization.draw_geometries(pcd, point_show_normal=show_normals)  # Displaying point cloud
         logger.info("Visualisation window closed")
 
     @staticmethod
-    def merge(*pcd) -> o3d.geometry.PointCloud:
+    @Profiler.profiled("merge")
+    def merge(*pcd: PointBuffer) -> PointBuffer:
         """
         Merges point clouds.
         :param pcd: Point clouds to be merged
@@ -102,17 +348,25 @@ class PointCloud:
         if pcd is None:
             raise ValueError("Point cloud is None")
 
-        merged_df = pd.DataFrame(columns=['X', 'Y', 'Z', 'intensity'])
-
-        for i in tqdm(range(len(pcd)), desc="Merging point clouds", ncols=Config.LOADING_BAR_LENGTH.value):
-            df = pcd_to_df(pcd=pcd[i])  # Converting point cloud to dataframe
-            merged_df = pd.concat([merged_df, df], ignore_index=True)  # Merging dataframes
-
-        # Removing duplicates and keeping the ones with the highest intensity
-        merged_df = merged_df.sort_values(by=['X', 'Y', 'Z', 'intensity'], ascending=[False, False, False, True])
-        merged_df = merged_df.drop_duplicates(subset=['X', 'Y', 'Z'], keep='first')
-
-        return df_to_pcd(df=merged_df)  # Converting merged dataframe to point cloud
+        logger.debug(f"Merging {len(pcd)} point clouds")
+        normals = None if any(p.normals is None for p in pcd) else np.concatenate([p.normals for p in pcd])
+        labels = None if any(p.labels is None for p in pcd) else np.concatenate([p.labels for p in pcd])
+        record_indexes = None if any(p.record_indexes is None for p in pcd) \
+            else np.concatenate([p.record_indexes for p in pcd])
+        merged_pcd = PointBuffer(
+            xyz=np.concatenate([p.xyz for p in pcd]),
+            intensity=np.concatenate([p.intensity for p in pcd]),
+            normals=normals,
+            labels=labels,
+            record_indexes=record_indexes
+        )  # Merging the columns in one go
+
+        # Removing duplicates and keeping the ones with the highest label, or else the lowest intensity
+        priority = -merged_pcd.labels.astype(int) if labels is not None else merged_pcd.intensity
+        order = np.argsort(priority, kind="stable")
+        _, first_indexes = np.unique(merged_pcd.xyz[order], axis=0, return_index=True)
+
+        return merged_pcd.select(np.sort(order[first_indexes]))
 
     @staticmethod
     def inlier_outlier_comparison(
@@ -129,131 +383,306 @@ class PointCloud:
         return inlier_pcd, outlier_pcd
 
     @staticmethod
-    def pre_process(pcd: o3d.geometry.PointCloud) -> o3d.geometry.PointCloud:
+    @Profiler.profiled("pre_process")
+    def pre_process(pcd: PointBuffer, source_path: str) -> PointBuffer:
         """
         Processing of point cloud. The following happens in this function:
-        - Uniform down sampling
+        - Uniform down sampling (unless it was done while reading)
         - Statistical outlier removal
-        - Middle line point removal (not implemented)
+        - Middle line point removal (if enabled in the config)
         :param pcd: A raw point cloud
+        :param source_path: Path to the .las file the point cloud was read from. Its scale, offset and CRS are used to
+        crop the points to the middle line
         :return: A processed point cloud
         """
-        start_points = len(pcd.points)
+        start_points = len(pcd)
         logger.info("Pre-processing point cloud")
-        pcd = PointCloud.__uniform_down_sample(pcd=pcd)
+        if not Config.DOWN_SAMPLE_ON_READ.value:
+            pcd = PointCloud.__uniform_down_sample(pcd=pcd)
+
         pcd = PointCloud.__statistical_outlier_removal(pcd=pcd)
 
-        """
-        This does not work. See the report for more information about why
-        gdf = Shapefile.create(file_path=Config.SHAPEFILE_PATH.value)  # Creating shapefile
-        pcd = Shapefile.crop(gdf=gdf, pcd=pcd)  # Cropping point cloud
-        """
+        if Config.CROP_TO_MIDDLE_LINE.value:
+            with laspy.open(source_path) as f:
+                header = f.header
+
+            # Creating shapefile in the coordinate system of the LAS file, and cropping point cloud
+            gdf = Shapefile.create(file_path=Config.SHAPEFILE_PATH.value, crs=header.parse_crs())
+            pcd = Shapefile.crop(gdf=gdf, pcd=pcd, scales=header.scales, offsets=header.offsets)
 
         logger.info(
-            f"Point cloud reduced to {len(pcd.points)} points (removed {start_points - len(pcd.points)} points)"
+            f"Point cloud reduced to {len(pcd)} points (removed {start_points - len(pcd)} points)"
         )
+        if len(pcd) == 0:
+            logger.warning(f"No points of {source_path} are left after pre-processing")
+
+        return pcd
+
+    @staticmethod
+    @Profiler.profiled("spatial_index")
+    def build_spatial_index(pcd: PointBuffer) -> PointBuffer:
+        """
+        Builds the spatial index of a pre-processed point cloud, which is reused by the normal estimation and the
+        statistical outlier removal of each segment
+        :param pcd: A pre-processed point cloud
+        :return: The point cloud with a spatial index
+        """
+        logger.info("Building spatial index...")
+        pcd.spatial_index = SpatialIndex(xyz=pcd.xyz)
+
+        return pcd
+
+    @staticmethod
+    @Profiler.profiled("normal_estimation")
+    def estimate_normals(pcd: PointBuffer) -> PointBuffer:
+        """
+        Estimates the normals of the whole point cloud once. The normals are stored with the points and carried over
+        to every segment, so overlapping points are only processed once and neighbourhoods are not cut at the
+        segment edges. The spatial index of the point cloud is used if it has one
+        :param pcd: A pre-processed point cloud
+        :return: The point cloud with normals
+        """
+        logger.info("Estimating normals...")
+        if pcd.spatial_index is not None:
+            normals = pcd.spatial_index.normals(
+                k=Config.MAX_NEAREST_NEIGHBOURS.value, radius=Config.SEARCH_RADIUS.value
+            )
+        else:
+            o3d_pcd = pcd.to_pcd()
+            o3d_pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(
+                radius=Config.SEARCH_RADIUS.value,
+                max_nn=Config.MAX_NEAREST_NEIGHBOURS.value
+            ))
+            normals = np.asarray(o3d_pcd.normals)
+
+        pcd.normals = normals.astype(np.float32) if Config.COMPACT_POINTS.value else normals
+        logger.debug(f"Estimated normals for {len(pcd.normals)} points")
 
         return pcd
 
     @staticmethod
-    def detect(pcd: o3d.geometry.PointCloud) -> o3d.geometry.PointCloud:
+    def extract_features(pcd: PointBuffer, no_segments: int = None) -> tuple[list[Plane], np.ndarray]:
         """
-        Detects speed bumps in the segments
+        Segments the point cloud and computes the feature table of the segments, see SegmentFeatures
         :param pcd: The point cloud that we want to detect speed bumps in
-        :return:
+        :param no_segments: Number of segments. Default: Config.NO_SEGMENTS
+        :return: The plane of each segment and the feature table
         """
-        segments = PointCloud.__segment(pcd=pcd)  # Segmenting point cloud
-        processed_pcds = []
-        detection_count = 0
+        segment_ranges = PointCloud.__segment_ranges(total_points=len(pcd), no_segments=no_segments)
+        segments = PointCloud.__segment(pcd=pcd, segment_ranges=segment_ranges)  # Segmenting point cloud
 
-        for i in tqdm(range(len(segments)), desc="Detecting speed bumps", ncols=Config.LOADING_BAR_LENGTH.value):
-            segment = segments[i]
+        return segments, SegmentFeatures.create(segments=segments, segment_ranges=segment_ranges)
 
-            # Checking parameter
-            if Config.MIN_DIST_STD.value < segment.dist_std < Config.MAX_DIST_STD.value \
-                    and Config.MIN_ANGLE_DEV.value < segment.mean_angle_dev < Config.MAX_ANGLE_DEV.value:
-                logger.debug(
-                    f"Segment {i + 1} may contain a speed bump with a standard deviation of {segment.dist_std}"
-                    f"and the average deviation from the normal vector of "
-                    f"{np.mean(segment.norm_vec_devs)} degrees"
-                )
+    @staticmethod
+    @Profiler.profiled("detect")
+    def detect(pcd: PointBuffer, features_filename: str = None) -> PointBuffer:
+        """
+        Detects speed bumps in the segments. The segments are classified from their feature table, every point is
+        labelled once in a per-point label array, and the output point cloud is selected from the input in one pass
+        :param pcd: The point cloud that we want to detect speed bumps in
+        :param features_filename: Name of the file to save the feature table to, without extension. Default: Not saved
+        :return: The points that are inliers of at least one segment, labelled with Label.SURFACE or Label.SPEED_BUMP
+        """
+        segments, _, detections = PointCloud.classify_segments(pcd=pcd, features_filename=features_filename)
+        return PointCloud.label(pcd=pcd, segments=segments, detections=detections)
 
-                # Marking points that are part of a speed bump
-                df = pcd_to_df(segment.pcd)
-                df['intensity'] = 0.0  # Setting intensity to 0
-                marked_pcd = df_to_pcd(df=df)
+    @staticmethod
+    def classify_segments(
+            pcd: PointBuffer, features_filename: str = None, no_segments: int = None
+    ) -> tuple[list[Plane], np.ndarray, np.ndarray]:
+        """
+        Segments the point cloud and classifies the segments from their feature table
+        :param pcd: The point cloud that we want to detect speed bumps in
+        :param features_filename: Name of the file to save the feature table to, without extension. Default: Not saved
+        :param no_segments: Number of segments. Default: Config.NO_SEGMENTS
+        :return: The plane of each segment, the feature table and a boolean array that is True for the segments that
+        may contain a speed bump
+        """
+        segments, features = PointCloud.extract_features(pcd=pcd, no_segments=no_segments)
+        if features_filename is not None:
+            SegmentFeatures.save(features=features, filename=features_filename)
 
-                processed_pcds.append(marked_pcd)
-                detection_count += 1
-            else:
-                processed_pcds.append(segment.pcd)
+        return segments, features, PointCloud.classify(features=features)
 
+    @staticmethod
+    def classify(features: np.ndarray) -> np.ndarray:
+        """
+        Classifies the segments of a feature table with the thresholds in the config, see SegmentFeatures.classify
+        :param features: Feature table of the segments
+        :return: Boolean array that is True for the segments that may contain a speed bump
+        """
+        detections = SegmentFeatures.classify(features=features)
+        for i in np.flatnonzero(detections):
+            logger.debug(
+                f"Segment {i + 1} may contain a speed bump with a standard deviation of {features['dist_std'][i]} "
+                f"and the average deviation from the normal vector of {features['mean_angle_dev'][i]} degrees"
+            )
+
+        detection_count = np.count_nonzero(detections)
         logger.info(
             f"Found {detection_count} speed bumps" if detection_count > 0 else "No speed bumps found"
         )
-        return PointCloud.merge(*processed_pcds)
+
+        return detections
+
+    @staticmethod
+    def label(pcd: PointBuffer, segments: list[Plane], detections: np.ndarray) -> PointBuffer:
+        """
+        Labels the points from the classified segments, see PointCloud.classify_segments. The point cloud is not
+        modified, so it can be labelled again, e.g. with other thresholds
+        :param pcd: The point cloud the segments were taken from
+        :param segments: The plane of each segment
+        :param detections: Boolean array that is True for the segments that may contain a speed bump
+        :return: Copy of the points that are inliers of at least one segment, labelled with Label.SURFACE or
+        Label.SPEED_BUMP
+        """
+        # Labelling every point once. Speed bump labels from overlapping segments take precedence
+        labels = np.full(len(pcd), Label.REMOVED, dtype=np.uint8)  # Label of each point in pcd
+        if segments:
+            labels[np.concatenate([segment.indexes for segment in segments])] = Label.SURFACE
+
+        detected_segments = [segment.indexes for segment, detected in zip(segments, detections) if detected]
+        if detected_segments:
+            labels[np.concatenate(detected_segments)] = Label.SPEED_BUMP  # Marking points that are part of a speed bump
+
+        kept = labels != Label.REMOVED
+        labelled_pcd = pcd.select(kept)  # Copies, as kept is a mask
+        labelled_pcd.labels = labels[kept]
+
+        return labelled_pcd
 
     @staticmethod
-    def __voxel_down_sample(pcd: o3d.geometry.PointCloud) -> o3d.geometry.PointCloud:
+    @Profiler.profiled("down_sample")
+    def __voxel_down_sample(pcd: PointBuffer) -> PointBuffer:
         """
         Downsamples a point cloud object.
         :param pcd: Point cloud to be down sampled
         :return: Down sampled point cloud
         """
         logger.info(f"Downsampling point cloud with voxel size {Config.VOXEL_SIZE.value}...")
-        downpcd = pcd.voxel_down_sample(voxel_size=Config.VOXEL_SIZE.value)
-        logger.info(f"Downsampled point cloud has {len(downpcd.points)} points")
+        downpcd = PointBuffer.from_pcd(pcd.to_pcd(colors=True).voxel_down_sample(voxel_size=Config.VOXEL_SIZE.value))
+        logger.info(f"Downsampled point cloud has {len(downpcd)} points")
 
         return downpcd
 
     @staticmethod
-    def __uniform_down_sample(pcd: o3d.geometry.PointCloud) -> o3d.geometry.PointCloud:
+    @Profiler.profiled("down_sample")
+    def __uniform_down_sample(pcd: PointBuffer) -> PointBuffer:
         """
         Downsamples a point cloud object using uniform down sampling
         :param pcd:
         :return:
         """
         logger.debug(f"Downsampling point cloud with every {Config.UNIFORM_DOWN_SAMPLE.value}th point...")
-        downpcd = pcd.uniform_down_sample(every_k_points=Config.UNIFORM_DOWN_SAMPLE.value)
-        logger.debug(f"Downsampled point cloud has {len(downpcd.points)} points")
+        downpcd = pcd.select(slice(None, None, Config.UNIFORM_DOWN_SAMPLE.value))  # Strided views of the columns
+        logger.debug(f"Downsampled point cloud has {len(downpcd)} points")
 
         return downpcd
 
     @staticmethod
-    def __statistical_outlier_removal(pcd: o3d.geometry.PointCloud) -> o3d.geometry.PointCloud:
+    def __statistical_outlier_removal(pcd: PointBuffer) -> PointBuffer:
         """
         Removes statistical outliers from a point cloud object
         :param pcd:
         :return:
         """
+        inlier_indexes = PointCloud.__statistical_inlier_indexes(pcd=pcd)
+        downpcd = pcd.select(inlier_indexes)  # Creating point cloud from inlier indexes
+
+        return downpcd
+
+    @staticmethod
+    @Profiler.profiled("sor")
+    def __statistical_inlier_indexes(pcd: PointBuffer) -> np.ndarray:
+        """
+        Finds the points of a point cloud object that are not statistical outliers
+        :param pcd:
+        :return: Indexes of the inliers
+        """
         logger.debug("Removing statistical outliers...")
-        cd, inlier_indexes = pcd.remove_statistical_outlier(
+        cd, inlier_indexes = pcd.to_pcd().remove_statistical_outlier(
             nb_neighbors=Config.SOR_NO_NEIGHBOURS.value,
             std_ratio=Config.SOR_STD_RATIO.value
         )  # Removing statistical outliers
         logger.debug(f"Point cloud reduced to {len(inlier_indexes)} points")
-        downpcd = indexes_to_pcd(pcd=pcd, indexes=inlier_indexes)  # Creating point cloud from inlier indexes
 
-        return downpcd
+        return np.asarray(inlier_indexes, dtype=np.int64)  # Also integer if every point is removed
+
+    @staticmethod
+    def fit_segment(pcd: PointBuffer, indexes: np.ndarray, mean_distances: np.ndarray = None) -> Plane:
+        """
+        Fits a plane to a single segment. Performs another statistical outlier removal before the plane is fitted
+        using RANSAC
+        :param pcd: Point cloud of the segment
+        :param indexes: Indexes of the segment points in the point cloud the segment was taken from
+        :param mean_distances: Mean neighbour distance of each segment point from the spatial index of the point cloud.
+        Default: The neighbours are searched within the segment
+        :return: Plane object of the segment
+        """
+        if mean_distances is None:
+            inlier_indexes = PointCloud.__statistical_inlier_indexes(pcd=pcd)  # Performing another SOR
+        else:
+            with Profiler.stage("sor", points=len(pcd)):  # Performing another SOR without searching the neighbours
+                inlier_indexes = np.flatnonzero(statistical_inlier_mask(
+                    mean_distances=mean_distances, std_ratio=Config.SOR_STD_RATIO.value
+                ))
+
+        with Profiler.stage("ransac", points=len(inlier_indexes)):
+            return pcd_to_plane(pcd.select(inlier_indexes), indexes=indexes[inlier_indexes])  # Plane of segment
 
     @staticmethod
-    def __segment(pcd: o3d.geometry.PointCloud) -> list[Plane]:
+    @Profiler.profiled("segment")
+    def __segment(pcd: PointBuffer, segment_ranges: list[tuple[int, int]]) -> list[Plane]:
         """
         Segments a point cloud using basic principles for overlapping areas from photogrammetry
         :param pcd:
+        :param segment_ranges: List of (start index, end index) tuples, see __segment_ranges
         :return: Returns a list of plane objects
         """
         logger.info("Segmenting point cloud...")
-        pcd_df = pcd_to_df(pcd=pcd)  # Converting point cloud to dataframe
-        total_points = len(pcd_df)  # Total number of points in point cloud
-        segment_size = int(total_points / Config.NO_SEGMENTS.value)  # Size of each segment
+
+        if Config.SEGMENT_FIT_MODE.value == "moments":
+            return PointCloud.__moment_segment(pcd=pcd, segment_ranges=segment_ranges)
+
+        if Config.SEGMENT_FIT_MODE.value != "ransac":
+            raise ValueError(f"Unknown segment fit mode {Config.SEGMENT_FIT_MODE.value}")
+
+        # Neighbour distances for the SOR of the segments, found once for the whole point cloud
+        mean_distances = None if pcd.spatial_index is None \
+            else pcd.spatial_index.mean_neighbour_distances(k=Config.SOR_NO_NEIGHBOURS.value)
+
+        if Config.NO_WORKERS.value > 1:
+            return PointCloud.__parallel_segment(pcd=pcd, segment_ranges=segment_ranges, mean_distances=mean_distances)
+
+        segments = []  # List of segmented point clouds and planes
+        for i in tqdm(range(len(segment_ranges)), desc="Segmenting point cloud", ncols=Config.LOADING_BAR_LENGTH.value):
+            start_index, end_index = segment_ranges[i]
+            segment_pcd = pcd.select(slice(start_index, end_index + 1))  # Views of the segment points
+            segments.append(PointCloud.fit_segment(
+                pcd=segment_pcd,
+                indexes=np.arange(start_index, end_index + 1),
+                mean_distances=None if mean_distances is None else mean_distances[start_index:end_index + 1]
+            ))
+
+        return segments
+
+    @staticmethod
+    def __segment_ranges(total_points: int, no_segments: int = None) -> list[tuple[int, int]]:
+        """
+        Calculates the point ranges of the overlapping segments
+        :param total_points: Total number of points in point cloud
+        :param no_segments: Number of segments. Default: Config.NO_SEGMENTS
+        :return: List of (start index, end index) tuples. Both indexes are inclusive
+        """
+        no_segments = Config.NO_SEGMENTS.value if no_segments is None else no_segments
+        segment_size = int(total_points / no_segments)  # Size of each segment
         overlap_size = int(segment_size * Config.OVERLAP_PERCENTAGE.value)  # Size of overlap between segments
 
         # Calculating no of iterations required to segment point cloud
         N = math.ceil(np.divide(total_points - segment_size, segment_size * (1 - Config.OVERLAP_PERCENTAGE.value)) + 1)
 
         start_index = 0  # Start index of segment
-        segment_list = []  # List of segments
+        segment_ranges = []  # List of segment ranges
 
         for _ in range(N):
             end_index = start_index + segment_size  # End index of segment
@@ -265,20 +694,88 @@ class PointCloud:
             if end_index >= total_points:
                 end_index = total_points - 1
 
-            segment = pcd_df.iloc[start_index:end_index + 1]  # Segment of point cloud
-            segment_list.append(segment)
-
+            segment_ranges.append((start_index, end_index))
             start_index = end_index - overlap_size  # Adjusting start index for next segment
 
-        segments = []  # List of segmented point clouds and planes
-        for i in tqdm(range(len(segment_list)), desc="Segmenting point cloud", ncols=Config.LOADING_BAR_LENGTH.value):
-            segment = segment_list[i]  # Segment of point cloud
-            segment_pcd = df_to_pcd(df=segment)  # Converting segment to point cloud
-            segment_pcd = PointCloud.__statistical_outlier_removal(pcd=segment_pcd)  # Performing another SOR
-            plane = pcd_to_plane(segment_pcd)  # Plane of segment
-            segments.append(plane)
+        return segment_ranges
 
-        return segments
+    @staticmethod
+    def __moment_segment(pcd: PointBuffer, segment_ranges: list[tuple[int, int]]) -> list[Plane]:
+        """
+        Fits least squares planes to all segments from prefix sums of the point moments. The moments are accumulated
+        in one pass over the point cloud, after which every segment is fitted in constant time, so far more and
+        smaller segments can be used than with RANSAC. No SOR or RANSAC is done per segment, and the dist_std of each
+        plane is the standard deviation of the signed distances from the fit, so the thresholds may need to be
+        adjusted for this mode
+        :param pcd: Point cloud to be segmented
+        :param segment_ranges: List of (start index, end index) tuples
+        :return: Returns a list of plane objects
+        """
+        logger.debug(f"Fitting {len(segment_ranges)} segments from prefix moments")
+        start_indexes, end_indexes = np.array(segment_ranges).T
+        models, residual_stds = window_planes(
+            moments=prefix_moments(points=pcd.xyz), start_indexes=start_indexes, end_indexes=end_indexes
+        )
+
+        return [
+            Plane(
+                a=a, b=b, c=c, d=d,
+                pcd=pcd.select(slice(start_index, end_index + 1)),
+                indexes=np.arange(start_index, end_index + 1),
+                metrics={"dist_std": residual_std}
+            ) for (a, b, c, d), residual_std, start_index, end_index in zip(
+                models, residual_stds, start_indexes, end_indexes
+            )
+        ]
+
+    @staticmethod
+    def __parallel_segment(
+            pcd: PointBuffer, segment_ranges: list[tuple[int, int]], mean_distances: np.ndarray = None
+    ) -> list[Plane]:
+        """
+        Fits the segments in a process pool. The points are shared with the workers through shared memory, so only
+        the segment ranges are sent to the workers. The segment metrics are computed in the workers as well
+        :param pcd: Point cloud to be segmented
+        :param segment_ranges: List of (start index, end index) tuples
+        :param mean_distances: Mean neighbour distance of each point for the SOR of the segments, see fit_segment
+        :return: Returns a list of plane objects
+        """
+        logger.debug(f"Fitting {len(segment_ranges)} segments with {Config.NO_WORKERS.value} workers")
+        columns = {"xyz": pcd.xyz, "intensity": pcd.intensity}
+        if pcd.normals is not None:
+            columns["normals"] = pcd.normals
+
+        if mean_distances is not None:
+            columns["mean_distances"] = mean_distances  # Not a point buffer column, see _attach_points
+
+        shared_columns = {name: to_shared_memory(column) for name, column in columns.items()}
+        specs = {name: spec for name, (_, spec) in shared_columns.items()}
+
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=Config.NO_WORKERS.value,
+                    initializer=_attach_points,
+                    initargs=(specs, Config.overrides())
+            ) as executor:
+                start_indexes, end_indexes = zip(*segment_ranges)
+                results = list(tqdm(
+                    executor.map(
+                        _fit_shared_segment, start_indexes, end_indexes,
+                        chunksize=max(1, len(segment_ranges) // (4 * Config.NO_WORKERS.value))
+                    ),
+                    total=len(segment_ranges),
+                    desc="Segmenting point cloud",
+                    ncols=Config.LOADING_BAR_LENGTH.value
+                ))
+
+            for _, records in results:
+                Profiler.merge(records=records)  # Stages of the workers, e.g. sor and ransac
+
+            return [plane for plane, _ in results]
+        finally:
+            for shm, _ in shared_columns.values():
+                shm.close()
+                shm.unlink()
 
     @staticmethod
     def __color_pcd(pcd: o3d.geometry.PointCloud, color: list) -> o3d.geometry.PointCloud:
@@ -294,3 +791,46 @@ class PointCloud:
 
         pcd.paint_uniform_color(color)  # Coloring point cloud gray
         return pcd
+
+
+# Shared memory blocks, point buffer, mean neighbour distances and config overrides of a worker process
+_shared_points = None
+
+
+def _attach_points(specs: dict[str, tuple], overrides: dict[str, Any]) -> None:
+    """
+    Initializer of the worker processes. Attaches to the shared point columns
+    :param specs: Specifications of the shared columns of the point buffer, and of the mean neighbour distances
+    :param overrides: Config overrides of the process that started the pool, see Config.overrides. They are not
+    inherited by spawned processes
+    :return:
+    """
+    global _shared_points
+    Profiler.start_worker()
+    shared_columns = {name: from_shared_memory(spec) for name, spec in specs.items()}
+    columns = {name: column for name, (_, column) in shared_columns.items()}
+    mean_distances = columns.pop("mean_distances", None)
+    _shared_points = shared_columns, PointBuffer(**columns), mean_distances, overrides
+
+
+def _fit_shared_segment(start_index: int, end_index: int) -> tuple[Plane, dict[str, dict]]:
+    """
+    Fits a plane to a segment of the shared point buffer and computes its metrics in the worker process
+    :param start_index: Start index of the segment
+    :param end_index: End index of the segment, inclusive
+    :return: Plane object of the segment, and the measurements of its stages if profiling is enabled, see
+    Profiler.merge
+    """
+    _, pcd, mean_distances, overrides = _shared_points
+    with Config.override(overrides):
+        Profiler.reset()  # Measurements of the previous segment, which have been sent back
+        plane = PointCloud.fit_segment(
+            pcd=pcd.select(slice(start_index, end_index + 1)),
+            indexes=np.arange(start_index, end_index + 1),
+            mean_distances=None if mean_distances is None else mean_distances[start_index:end_index + 1]
+        )
+
+        # Computing the cached metrics used by the detection while still in the worker
+        _ = plane.dist_std, plane.mean_angle_dev
+
+    return plane, Profiler.records()
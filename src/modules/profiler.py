@@ -0,0 +1,246 @@
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Iterator
+
+import psutil
+
+from ..config import Config
+from ..logging import logger
+from ..modules.point_buffer import PointBuffer
+
+_records = {}  # Aggregated measurements of each stage, keyed on the stage path
+_records_lock = threading.Lock()
+_local = threading.local()  # Stack of the open stages of each thread
+
+
+@dataclass
+class Profiler:
+    """
+    Instrumentation of the pipeline stages. Each stage records its wall time, CPU time, resident memory and point
+    count. Stages can be nested, and are aggregated on their path (e.g. "segment/ransac"), so stages that run once per
+    segment are reported as one entry with a call count. Stages that run in worker processes are sent back with the
+    results of the workers and merged, see Profiler.merge
+    """
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str, points: int = None) -> Iterator[dict]:
+        """
+        Measures a stage if profiling is enabled in the config
+        :param name: Name of the stage
+        :param points: Number of points going into the stage
+        :return: Dictionary where the number of points coming out of the stage can be set as "output_points"
+        """
+        measurement = {}
+        if not Config.PROFILE.value:
+            yield measurement
+            return
+
+        stack = Profiler.__stack()
+        stack.append(name)
+        path = "/".join(stack)
+
+        rss_start = Profiler.__rss()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            stack.pop()
+
+            with _records_lock:
+                record = _records.setdefault(path, Profiler.__new_record(rss_start=rss_start))
+                record["calls"] += 1
+                record["wall_time"] += wall_time
+                record["cpu_time"] += cpu_time  # CPU time of the whole process, including other threads
+                record["points"] += points or 0
+                record["output_points"] += measurement.get("output_points", 0)
+                record["rss_end"] = Profiler.__rss()
+                record["peak_rss"] = max(record["peak_rss"], Profiler.__peak_rss())
+
+    @staticmethod
+    def profiled(name: str) -> Callable:
+        """
+        Decorator measuring every call of a function as a stage. The points going in are counted from the point
+        buffer arguments, and the points coming out from a returned point buffer
+        :param name: Name of the stage
+        :return:
+        """
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs) -> Any:
+                if not Config.PROFILE.value:
+                    return function(*args, **kwargs)
+
+                points = sum(len(arg) for arg in (*args, *kwargs.values()) if isinstance(arg, PointBuffer))
+                with Profiler.stage(name, points=points) as measurement:
+                    value = function(*args, **kwargs)
+                    if isinstance(value, PointBuffer):
+                        measurement["output_points"] = len(value)
+
+                return value
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    @contextmanager
+    def session(name: str) -> Iterator[None]:
+        """
+        Profiles a run of the program. The stage measurements are reset when the session starts and saved as a JSON
+        report in the profile directory when it ends. cProfile and tracemalloc are run around the session if enabled
+        in the config
+        :param name: Name of the run, used in the report filename
+        :return:
+        """
+        if not Config.PROFILE.value:
+            yield
+            return
+
+        Profiler.reset()
+        profile = cProfile.Profile() if Config.PROFILE_CPROFILE.value else None
+        if Config.PROFILE_TRACEMALLOC.value:
+            tracemalloc.start()
+
+        started_at = datetime.now()
+        if profile is not None:
+            profile.enable()
+
+        try:
+            with Profiler.stage(name):
+                yield
+        finally:
+            if profile is not None:
+                profile.disable()
+
+            os.makedirs(Config.PROFILE_DIR.value, exist_ok=True)
+            filename = f"{name}_{started_at.strftime('%Y%m%d_%H%M%S')}"
+            report = {"name": name, "started_at": started_at.isoformat(), "stages": Profiler.records()}
+
+            if profile is not None:
+                profile_path = os.path.join(Config.PROFILE_DIR.value, filename + ".prof")
+                profile.dump_stats(profile_path)  # Can be inspected with pstats or snakeviz
+                report["cprofile"] = profile_path
+
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                report["tracemalloc"] = {
+                    "peak_traced": tracemalloc.get_traced_memory()[1],
+                    "top_allocations": [
+                        {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+                        for stat in snapshot.statistics("lineno")[:Config.PROFILE_TOP_ALLOCATIONS.value]
+                    ]
+                }
+                tracemalloc.stop()
+
+            report_path = os.path.join(Config.PROFILE_DIR.value, filename + ".json")
+            with open(report_path, "w") as f:
+                json.dump(report, f, indent=4)
+
+            logger.info(f"Profile report saved at {report_path}")
+
+    @staticmethod
+    def records() -> dict[str, dict]:
+        """
+        The measurements of the stages recorded since the last reset
+        :return: Copy of the measurements, keyed on the stage path in the order the stages were first entered
+        """
+        with _records_lock:
+            return {path: dict(record) for path, record in _records.items()}
+
+    @staticmethod
+    def reset() -> None:
+        """
+        Removes the recorded measurements
+        :return:
+        """
+        with _records_lock:
+            _records.clear()
+
+    @staticmethod
+    def start_worker() -> None:
+        """
+        Starts the measurements of a worker process. Forked workers inherit the measurements and the open stages of the
+        process that started them, which are removed, so the worker only records its own stages
+        :return:
+        """
+        Profiler.reset()
+        _local.stack = []
+
+    @staticmethod
+    def merge(records: dict[str, dict]) -> None:
+        """
+        Adds the measurements recorded by a worker process, see Profiler.records. The stages of the worker are nested
+        in the open stages of the current thread. Their CPU time and memory are those of the worker process
+        :param records: Measurements of the worker, keyed on the stage path
+        :return:
+        """
+        prefix = Profiler.__stack()
+        with _records_lock:
+            for path, measured in records.items():
+                record = _records.setdefault(
+                    "/".join([*prefix, path]), Profiler.__new_record(rss_start=measured["rss_start"])
+                )
+                for name in ("calls", "wall_time", "cpu_time", "points", "output_points"):
+                    record[name] += measured[name]
+
+                record["rss_end"] = measured["rss_end"]
+                record["peak_rss"] = max(record["peak_rss"], measured["peak_rss"])
+
+    @staticmethod
+    def __new_record(rss_start: int) -> dict[str, Any]:
+        """
+        Creates the measurements of a stage that has not been called yet
+        :param rss_start: Resident set size when the stage was first entered
+        :return:
+        """
+        return {
+            "calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "points": 0, "output_points": 0,
+            "rss_start": rss_start, "rss_end": 0, "peak_rss": 0
+        }
+
+    @staticmethod
+    def __stack() -> list[str]:
+        """
+        The open stages of the current thread
+        :return:
+        """
+        if not hasattr(_local, "stack"):
+            _local.stack = []
+
+        return _local.stack
+
+    @staticmethod
+    def __rss() -> int:
+        """
+        Resident set size of the process
+        :return: Bytes
+        """
+        return psutil.Process().memory_info().rss
+
+    @staticmethod
+    def __peak_rss() -> int:
+        """
+        Peak resident set size of the process so far. The peak of a stage is the peak when it ended, so a stage that
+        did not raise the peak reports the peak of an earlier stage
+        :return: Bytes
+        """
+        memory_info = psutil.Process().memory_info()
+        if hasattr(memory_info, "peak_wset"):  # Windows
+            return memory_info.peak_wset
+
+        import resource  # Not available on Windows
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024  # Kilobytes on Linux
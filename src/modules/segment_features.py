@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..config import Config
+from ..logging import logger
+from ..modules.plane import Plane
+from ..modules.profiler import Profiler
+from ..utils import lazy_import
+
+pd = lazy_import("pandas")
+
+THRESHOLD_NAMES = ("MIN_DIST_STD", "MAX_DIST_STD", "MIN_ANGLE_DEV", "MAX_ANGLE_DEV")
+
+
+@dataclass
+class SegmentFeatures:
+    """
+    Compact per-segment feature table, stored as a NumPy structured array. Detection is a vectorized classification
+    of the table, so thresholds can be evaluated without segmenting the point cloud again
+    """
+    DTYPE = np.dtype([
+        ("start_index", np.int64),  # First point of the segment
+        ("end_index", np.int64),  # Last point of the segment, inclusive
+        ("point_count", np.int64),  # Number of inliers of the plane
+        ("dist_std", np.float64),
+        ("mean_angle_dev", np.float64),
+        ("a", np.float64),
+        ("b", np.float64),
+        ("c", np.float64),
+        ("d", np.float64),
+    ])
+
+    @staticmethod
+    @Profiler.profiled("metrics")
+    def create(segments: list[Plane], segment_ranges: list[tuple[int, int]]) -> np.ndarray:
+        """
+        Creates the feature table of the segments
+        :param segments: Plane of each segment
+        :param segment_ranges: (start index, end index) of each segment
+        :return: Structured array with one row per segment
+        """
+        features = np.zeros(len(segments), dtype=SegmentFeatures.DTYPE)
+        for i, (segment, (start_index, end_index)) in enumerate(zip(segments, segment_ranges)):
+            features[i] = (
+                start_index, end_index, len(segment.pcd), segment.dist_std, segment.mean_angle_dev,
+                segment.a, segment.b, segment.c, segment.d
+            )
+
+        return features
+
+    @staticmethod
+    def save(features: np.ndarray, filename: str) -> str:
+        """
+        Saves a feature table as a .npy file in the processed point cloud directory
+        :param features: Feature table
+        :param filename: Name of the file, without extension
+        :return: Path to the saved file
+        """
+        path = os.path.join(Config.PROCESSED_PC_DIR.value, filename + ".npy")
+        np.save(path, features)
+        logger.info(f"Segment features saved at {path}")
+
+        return path
+
+    @staticmethod
+    def load(file_path: str) -> np.ndarray:
+        """
+        Loads a feature table
+        :param file_path: Path to .npy file
+        :return: Feature table
+        """
+        features = np.load(file_path)
+        if features.dtype != SegmentFeatures.DTYPE:
+            raise ValueError(f"{file_path} is not a segment feature table")
+
+        return features
+
+    @staticmethod
+    def thresholds() -> np.ndarray:
+        """
+        The detection thresholds from the config
+        :return: Array of MIN_DIST_STD, MAX_DIST_STD, MIN_ANGLE_DEV and MAX_ANGLE_DEV
+        """
+        return np.array([Config[name].value for name in THRESHOLD_NAMES], dtype=np.float64)
+
+    @staticmethod
+    def classify(features: np.ndarray, thresholds: np.ndarray = None) -> np.ndarray:
+        """
+        Classifies the segments of a feature table
+        :param features: Feature table
+        :param thresholds: Threshold combinations of shape (4,) or (G, 4), ordered as THRESHOLD_NAMES.
+        Default: The thresholds from the config
+        :return: Boolean array that is True for segments that may contain a speed bump, of shape (S,) or (G, S)
+        """
+        thresholds = SegmentFeatures.thresholds() if thresholds is None else np.asarray(thresholds)
+        min_dist_std, max_dist_std, min_angle_dev, max_angle_dev = np.moveaxis(thresholds[..., np.newaxis], -2, 0)
+
+        return (min_dist_std < features["dist_std"]) & (features["dist_std"] < max_dist_std) \
+            & (min_angle_dev < features["mean_angle_dev"]) & (features["mean_angle_dev"] < max_angle_dev)
+
+    @staticmethod
+    def sweep(
+            features: np.ndarray, grid: dict[str, np.ndarray], truth: np.ndarray = None
+    ) -> pd.DataFrame:
+        """
+        Evaluates every combination of threshold values against a feature table in one broadcast
+        :param features: Feature table
+        :param grid: Values to evaluate for each threshold, keyed on the names in THRESHOLD_NAMES. Thresholds that
+        are left out are taken from the config
+        :param truth: Boolean array that is True for the segments that contain a speed bump. Used to score the
+        combinations
+        :return: Dataframe with the thresholds and the detection count of each combination, and the precision, recall
+        and F1 score if truth is given
+        """
+        values = [
+            np.atleast_1d(grid[name]) if name in grid else np.atleast_1d(Config[name].value)
+            for name in THRESHOLD_NAMES
+        ]
+        thresholds = np.stack(np.meshgrid(*values, indexing="ij"), axis=-1).reshape(-1, len(THRESHOLD_NAMES))
+        logger.info(f"Evaluating {len(thresholds)} threshold combinations on {len(features)} segments")
+
+        detections = SegmentFeatures.classify(features=features, thresholds=thresholds)  # Shape (G, S)
+        results = pd.DataFrame(thresholds, columns=THRESHOLD_NAMES)
+        results["detections"] = np.count_nonzero(detections, axis=1)
+
+        if truth is not None:
+            truth = np.asarray(truth, dtype=bool)
+            if len(truth) != len(features):
+                raise ValueError(f"Expected {len(features)} truth values, got {len(truth)}")
+
+            true_positives = np.count_nonzero(detections & truth, axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                precision = np.nan_to_num(true_positives / results["detections"].to_numpy())
+                recall = np.nan_to_num(true_positives / np.count_nonzero(truth))
+                f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+
+            results["precision"], results["recall"], results["f1"] = precision, recall, f1
+
+        return results
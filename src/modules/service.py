@@ -0,0 +1,305 @@
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+from ..config import Config
+from ..logging import logger
+from ..utils import import_lazy_modules
+
+
+@dataclass
+class Job:
+    """
+    Detection job of the service: a LAS file and the config overrides it is processed with
+    """
+    id: str
+    las_path: str
+    overrides: dict[str, Any]
+    future: Future
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    @property
+    def status(self) -> str:
+        """
+        Status of the job: "queued", "running", "done" or "failed"
+        :return:
+        """
+        if not self.future.done():
+            return "running" if self.future.running() else "queued"
+
+        return "failed" if self.future.cancelled() or self.future.exception() is not None else "done"
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        JSON serializable summary of the job
+        :return:
+        """
+        summary = {
+            "id": self.id,
+            "las_path": self.las_path,
+            "config": self.overrides,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at
+        }
+        if summary["status"] == "done":
+            summary["result"] = self.future.result()
+        elif summary["status"] == "failed":
+            summary["error"] = "Cancelled" if self.future.cancelled() else str(self.future.exception())
+
+        return summary
+
+
+@dataclass
+class Service:
+    """
+    Long-running detection service. Jobs are submitted to a local HTTP endpoint and run in a pool of worker processes.
+    The workers are started once, and keep their imports and the shapefiles they have loaded between jobs, so small
+    jobs do not pay the start-up time of the program. Each job runs with its own config overrides, see
+    Config.override, and fits its segments with at most its share of the CPUs (Config.NO_WORKERS). Endpoints:
+    - POST /jobs with {"las_path": ..., "config": {...}} submits a job
+    - GET /jobs/<id> returns the status and result of a job, and GET /jobs those of every job
+    - GET /health returns the number of workers and queued jobs
+    """
+    function: Callable[[str], dict[str, Any]]  # Runs a job on a LAS file. Must be picklable
+    workers: int
+    __jobs: dict[str, Job]  # Submitted jobs in submission order, keyed on their id
+    __lock: threading.Lock
+    __executor: ProcessPoolExecutor | None
+
+    def __init__(self, function: Callable[[str], dict[str, Any]], workers: int = None) -> None:
+        """
+        Constructor for the Service class
+        :param function: Runs a job on a LAS file and returns a JSON serializable result. Must be picklable, e.g. a
+        static method of a module-level class
+        :param workers: Number of worker processes. Default: Config.SERVICE_WORKERS
+        """
+        self.function = function
+        self.workers = Config.SERVICE_WORKERS.value if workers is None else workers
+        self.__jobs = {}
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def serve(self, host: str = None, port: int = None) -> None:
+        """
+        Starts the workers and serves the endpoint until interrupted
+        :param host: Default: Config.SERVICE_HOST
+        :param port: Default: Config.SERVICE_PORT
+        :return:
+        """
+        host = Config.SERVICE_HOST.value if host is None else host
+        port = Config.SERVICE_PORT.value if port is None else port
+
+        # Spawned rather than forked, as the workers are started from a process that runs the server threads
+        self.__executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+        )
+        for future in [self.__executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()  # Every submission starts a worker while none is idle
+
+        logger.info(f"Started {self.workers} workers")
+
+        server = ThreadingHTTPServer((host, port), _RequestHandler)
+        server.service = self
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # Stopping the service shuts it down as Ctrl+C
+        logger.info(f"Serving on http://{host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down")
+        finally:
+            server.server_close()
+            self.__executor.shutdown(cancel_futures=True)
+            self.__executor = None
+
+    def submit(self, las_path: str, overrides: dict[str, Any] = None) -> Job:
+        """
+        Queues a job
+        :param las_path: Path to .las file
+        :param overrides: Values of the settings to override for the job, keyed on the setting name
+        :return: The queued job
+        """
+        overrides = overrides or {}
+        if not isinstance(overrides, dict):
+            raise TypeError(f"Expected the config overrides as an object, got {type(overrides).__name__}")
+
+        unknown = [name for name in overrides if name not in Config.__members__]
+        if unknown:
+            raise ValueError(f"Unknown settings {', '.join(unknown)}")
+
+        if not os.path.exists(las_path):
+            raise FileNotFoundError(f"Point cloud {las_path} not found")
+
+        job = Job(
+            id=uuid.uuid4().hex,
+            las_path=las_path,
+            overrides=overrides,
+            future=self.__executor.submit(
+                _run_job, self.function, las_path, overrides, max((os.cpu_count() or 1) // self.workers, 1)
+            )
+        )
+        job.future.add_done_callback(lambda _: self.__finish(job=job))
+        with self.__lock:
+            self.__jobs[job.id] = job
+
+        logger.info(f"Queued job {job.id} for {las_path}")
+        return job
+
+    def job(self, job_id: str) -> Job | None:
+        """
+        Finds a job
+        :param job_id:
+        :return: The job, or None if there is no job with the id
+        """
+        with self.__lock:
+            return self.__jobs.get(job_id)
+
+    def jobs(self) -> list[Job]:
+        """
+        The jobs that have been submitted, in submission order
+        :return:
+        """
+        with self.__lock:
+            return list(self.__jobs.values())
+
+    def health(self) -> dict[str, Any]:
+        """
+        Summary of the state of the service
+        :return:
+        """
+        statuses = [job.status for job in self.jobs()]
+        return {
+            "workers": self.workers,
+            **{status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+        }
+
+    def __finish(self, job: Job) -> None:
+        """
+        Records the end of a job, and forgets the oldest finished jobs beyond Config.SERVICE_JOB_HISTORY
+        :param job: The finished job
+        :return:
+        """
+        job.finished_at = time.time()
+        if job.status == "failed":
+            logger.error(f"Job {job.id} for {job.las_path} failed: {job.to_dict()['error']}")
+        else:
+            logger.info(f"Job {job.id} for {job.las_path} done in {job.finished_at - job.submitted_at:.2f} s")
+
+        with self.__lock:
+            finished = [job_id for job_id, other in self.__jobs.items() if other.future.done()]
+            for job_id in finished[:max(len(finished) - Config.SERVICE_JOB_HISTORY.value, 0)]:
+                del self.__jobs[job_id]
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoint of the service, see Service
+    """
+
+    def do_GET(self) -> None:
+        """
+        Returns the health of the service, a job, or every job
+        :return:
+        """
+        service = self.server.service
+        if self.path == "/health":
+            self.__respond(200, service.health())
+        elif self.path == "/jobs":
+            self.__respond(200, [job.to_dict() for job in service.jobs()])
+        elif self.path.startswith("/jobs/") and service.job(self.path[len("/jobs/"):]) is not None:
+            self.__respond(200, service.job(self.path[len("/jobs/"):]).to_dict())
+        else:
+            self.__respond(404, {"error": f"Not found: {self.path}"})
+
+    def do_POST(self) -> None:
+        """
+        Submits a job
+        :return:
+        """
+        if self.path != "/jobs":
+            self.__respond(404, {"error": f"Not found: {self.path}"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if "las_path" not in body:
+                raise ValueError("las_path is missing")
+
+            job = self.server.service.submit(las_path=body["las_path"], overrides=body.get("config"))
+        except (FileNotFoundError, TypeError, ValueError) as e:
+            self.__respond(400, {"error": str(e)})
+            return
+
+        self.__respond(202, job.to_dict())
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """
+        Logs the requests with the logger of the program instead of to stderr
+        :param format:
+        :param args:
+        :return:
+        """
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def __respond(self, status: int, body: Any) -> None:
+        """
+        Sends a JSON response
+        :param status: HTTP status code
+        :param body: JSON serializable body
+        :return:
+        """
+        content = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _init_worker() -> None:
+    """
+    Initializer of the worker processes. Interrupts are left to the service, which finishes the running jobs when it
+    shuts down
+    :return:
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _warm_up() -> None:
+    """
+    Starts a worker process, and imports the modules of the program and their dependencies, which are otherwise
+    imported on first use
+    :return:
+    """
+    package = importlib.import_module(__package__)
+    for name in package.__all__:
+        getattr(package, name)
+
+    import_lazy_modules()
+
+
+def _run_job(
+        function: Callable[[str], dict[str, Any]], las_path: str, overrides: dict[str, Any], fit_workers: int
+) -> dict[str, Any]:
+    """
+    Runs a job in a worker process with its config overrides
+    :param function: Runs a job on a LAS file
+    :param las_path: Path to .las file
+    :param overrides: Values of the settings to override, keyed on the setting name
+    :param fit_workers: Maximum number of processes the job fits segments with, so the jobs of all the workers
+    together do not start more processes than there are CPUs
+    :return: Result of the job
+    """
+    fit_workers = min(overrides.get("NO_WORKERS", Config.NO_WORKERS.value), fit_workers)
+    with Config.override({**overrides, "NO_WORKERS": fit_workers}):
+        return function(las_path)
@@ -1,60 +1,171 @@
+from __future__ import annotations
+
+import importlib.util
+import os
+import pickle
 from dataclasses import dataclass
+from typing import Any
 
-import fiona
-import geopandas as gpd
-import open3d as o3d
-from shapely import Point
-from shapely.geometry import shape
+import numpy as np
 
 from ..config import Config
 from ..logging.logger import logger
-from ..utils import pcd_to_df, df_to_pcd
+from ..modules.point_buffer import PointBuffer
+from ..modules.profiler import Profiler
+from ..utils import lazy_import, transform_geometries
+
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+pyproj = lazy_import("pyproj")
+shapely = lazy_import("shapely")
+
+_loaded = {}  # Source and geo-dataframe of the shapefiles loaded by this process, keyed on the path of their cache
 
 
 @dataclass
 class Shapefile:
     @staticmethod
-    def create(file_path: str) -> gpd.GeoDataFrame:
+    @Profiler.profiled("shapefile")
+    def create(file_path: str, crs: Any = None) -> gpd.GeoDataFrame:
         """
-        Creates a shapefile object and converts the coordinates to Cartesian coordinates
+        Creates a shapefile object. The features are read in bulk, missing and empty geometries are removed and
+        invalid geometries are repaired as arrays, and the geometries are reprojected with one transformation of all
+        their coordinates. The result is cached next to the shapefile, so the shapefile is only read once, and is kept
+        in memory for later calls in the same process
         :param file_path: Path to shapefile
+        :param crs: Coordinate system to reproject the geometries to, e.g. the CRS of the LAS file. Default: The
+        coordinate system of the shapefile
         :return: Geo-dataframe object
         """
-        valid_features = []
-        invalid_feature_count = 0
+        target_crs = None if crs is None else pyproj.CRS.from_user_input(crs)
+        cache_path = os.path.splitext(file_path)[0] + ".shpcache.pkl"
+        source = Shapefile.__source(file_path=file_path, crs=target_crs)
+
+        loaded = _loaded.get(cache_path)
+        if loaded is not None and loaded[0] == source:
+            return loaded[1].copy()  # Copied, so the caller cannot change the shapefile of later calls
+
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+
+            if cached["source"] == source:
+                logger.info(f"Loading shapefile from {cache_path}")
+                gdf = gpd.GeoDataFrame(
+                    cached["attributes"], geometry=shapely.from_wkb(cached["wkb"]), crs=cached["crs"]
+                )
+                _loaded[cache_path] = source, gdf
+                return gdf.copy()
 
         logger.info(f"Reading shapefile from {file_path}")
+        # pyogrio reads the geometries as one array of WKB. Fiona is used if it is not installed
+        gdf = gpd.read_file(file_path, engine="pyogrio" if importlib.util.find_spec("pyogrio") else "fiona")
+
+        # Removing missing and empty geometries
+        geometries = np.asarray(gdf.geometry.array)
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        if not valid.all():
+            logger.warning(f"Removed {np.count_nonzero(~valid)} invalid features from shapefile")
+
+        gdf, geometries = gdf[valid].reset_index(drop=True), geometries[valid]
 
-        with fiona.open(file_path, 'r') as shp:
-            for feature in shp:
-                # Removing invalid features
-                try:
-                    shp_geom = shape(feature['geometry'])
-                    if not shp_geom.is_empty:
-                        valid_features.append(feature)
-                except Exception as e:
-                    invalid_feature_count += 1
+        invalid = ~shapely.is_valid(geometries)
+        if invalid.any():
+            logger.warning(f"Repaired {np.count_nonzero(invalid)} invalid geometries in shapefile")
+            geometries[invalid] = shapely.make_valid(geometries[invalid])
 
-        if invalid_feature_count > 0:
-            logger.warning(f"Removed {invalid_feature_count} invalid features from shapefile")
+        source_crs = gdf.crs
+        if target_crs is not None and source_crs is None:
+            logger.warning(f"{file_path} has no coordinate system, so it is assumed to be in {target_crs.name}")
+        elif target_crs is not None and source_crs != target_crs:
+            geometries = transform_geometries(geometries=geometries, source_crs=source_crs, target_crs=target_crs)
 
-        gdf = gpd.GeoDataFrame.from_features(valid_features)  # Create a geopandas dataframe from the valid features
-        return gdf
+        crs = source_crs if target_crs is None else target_crs
+        gdf = gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name), geometry=geometries, crs=crs)
+
+        # Written to a temporary file first, so an interrupted write does not leave a broken cache. The temporary file
+        # is named after the process, as several processes of the service may write the cache at the same time
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "source": source,
+                "attributes": pd.DataFrame(gdf.drop(columns=gdf.geometry.name)),
+                "wkb": shapely.to_wkb(geometries),
+                "crs": None if crs is None else crs.to_wkt()
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, cache_path)
+        logger.debug(f"Cached shapefile at {cache_path}")
+
+        _loaded[cache_path] = source, gdf
+        return gdf.copy()
 
     @staticmethod
-    def crop(gdf: gpd.GeoDataFrame, pcd: o3d.geometry.PointCloud) -> o3d.geometry.PointCloud:
+    @Profiler.profiled("crop")
+    def crop(gdf: gpd.GeoDataFrame, pcd: PointBuffer, scales: np.ndarray, offsets: np.ndarray) -> PointBuffer:
         """
         Crops a point cloud based on the middle line of the road from a shapefile.
-        :param gdf: Shapefile object
+        :param gdf: Shapefile object, in the coordinate system of the LAS file
         :param pcd: Point cloud object
+        :param scales: Scales of the header of the LAS file the points were read from
+        :param offsets: Offsets of the header of the LAS file the points were read from
         :return: Cropped point cloud
         """
         logger.info("Cropping point cloud to middle line from shapefile")
 
-        pcd_df = pcd_to_df(pcd=pcd)  # Convert point cloud to dataframe
-        for i in range(len(pcd_df)):
-            point = Point(pcd_df['X'][i], pcd_df['Y'][i])  # Create a shapely point object
-            if gdf.distance(point) > Config.MIDDLE_LINE_THRESHOLD.value:  # Check if point is outside max distance
-                pcd_df.drop(i, inplace=True)  # Drop point if not within the threshold
+        # The points hold the integer coordinates of the LAS file, while the geometries and the threshold are in the
+        # coordinates of the file
+        xy = pcd.xyz[:, :2] * np.asarray(scales)[:2] + np.asarray(offsets)[:2]
+        mask = Shapefile.crop_mask(gdf=gdf, xy=xy)
+        logger.debug(f"Point cloud cropped to {np.count_nonzero(mask)} of {len(mask)} points")
+
+        return pcd.select(mask)
+
+    @staticmethod
+    def buffer(gdf: gpd.GeoDataFrame, distance: float) -> np.ndarray:
+        """
+        Buffers the geometries of a shapefile, e.g. to use as the region to read with PointCloud.create_region. The
+        buffers are not merged, as the union of the buffers of a large shapefile is slow to compute, and points are
+        tested against the buffers through an STRtree instead
+        :param gdf: Shapefile object
+        :param distance: Buffer distance
+        :return: Array of the buffered geometries
+        """
+        return shapely.buffer(np.asarray(gdf.geometry.array), distance)
+
+    @staticmethod
+    def crop_mask(gdf: gpd.GeoDataFrame, xy: np.ndarray) -> np.ndarray:
+        """
+        Finds the points within the middle line threshold of any geometry in the shapefile. The geometries are
+        buffered by the threshold and put in an STRtree, which is queried with all points at once
+        :param gdf: Shapefile object
+        :param xy: Numpy array of shape (N, 2) with the x and y coordinates of the points, in the coordinates of the
+        shapefile
+        :return: Boolean mask of shape (N,) that is True for the points to keep
+        """
+        buffers = shapely.buffer(np.asarray(gdf.geometry.array), Config.MIDDLE_LINE_THRESHOLD.value)
+        tree = shapely.STRtree(buffers)
+
+        # Pairs of (point index, geometry index) for every point that is inside a buffer
+        point_indexes, _ = tree.query(shapely.points(xy), predicate="intersects")
+
+        mask = np.zeros(len(xy), dtype=bool)
+        mask[point_indexes] = True
+
+        return mask
+
+    @staticmethod
+    def __source(file_path: str, crs: pyproj.CRS | None) -> list:
+        """
+        Identifies the version of a shapefile and the coordinate system a cached shapefile was created for
+        :param file_path: Path to shapefile
+        :param crs: Coordinate system the geometries are reprojected to
+        :return: Size and modification time of each file of the shapefile, and the coordinate system
+        """
+        base_path = os.path.splitext(file_path)[0]
+        files = [
+            [extension, os.stat(base_path + extension).st_size, os.stat(base_path + extension).st_mtime_ns]
+            for extension in (".shp", ".shx", ".dbf", ".prj", ".cpg") if os.path.exists(base_path + extension)
+        ]
 
-        return df_to_pcd(df=pcd_df)  # Convert dataframe back to point cloud
+        return [files, None if crs is None else crs.to_wkt()]
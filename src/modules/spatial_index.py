@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..config import Config
+from ..logging import logger
+from ..utils import lazy_import, neighbourhood_normals
+
+spatial = lazy_import("scipy.spatial")
+
+
+@dataclass
+class SpatialIndex:
+    """
+    KD-tree of a point cloud that is built once after pre-processing and shared by the neighbourhood queries of the
+    pipeline, so the segments do not build a KD-tree each. Query results that are used more than once are cached
+    """
+    __tree: spatial.cKDTree
+    __mean_distances: dict[int, np.ndarray]
+
+    def __init__(self, xyz: np.ndarray) -> None:
+        """
+        Constructor for the SpatialIndex class
+        :param xyz: Coordinates of the points of shape (N, 3)
+        """
+        logger.debug(f"Building spatial index of {len(xyz)} points")
+        # Faster to build than a balanced tree
+        self.__tree = spatial.cKDTree(xyz, balanced_tree=False, compact_nodes=False)
+        self.__mean_distances = {}  # Mean neighbour distances of each point, keyed on the number of neighbours
+
+    def __len__(self) -> int:
+        """
+        Number of points in the index
+        :return:
+        """
+        return self.__tree.n
+
+    def mean_neighbour_distances(self, k: int) -> np.ndarray:
+        """
+        Mean distance from each point to its k nearest neighbours, the point itself included as in Open3D
+        :param k: Number of neighbours
+        :return: Numpy array of shape (N,)
+        """
+        if k not in self.__mean_distances:
+            distances, _ = self.__tree.query(self.__tree.data, k=k, workers=Config.NO_WORKERS.value)
+            self.__mean_distances[k] = np.mean(distances.reshape(len(self), -1), axis=1)
+
+        return self.__mean_distances[k]
+
+    def normals(self, k: int, radius: float, chunk_size: int = 100_000) -> np.ndarray:
+        """
+        Estimates the normal vector of each point from at most k neighbours within the radius, like Open3D's hybrid
+        search. The neighbourhoods are gathered and solved in chunks to limit the memory use
+        :param k: Maximum number of neighbours
+        :param radius: Search radius
+        :param chunk_size: Number of points per chunk
+        :return: Unit normal vectors pointing upwards of shape (N, 3)
+        """
+        points = self.__tree.data
+        normals = np.empty((len(self), 3))
+
+        for start in range(0, len(self), chunk_size):
+            end = min(start + chunk_size, len(self))
+            _, indexes = self.__tree.query(
+                points[start:end], k=k, distance_upper_bound=radius, workers=Config.NO_WORKERS.value
+            )
+            indexes = indexes.reshape(end - start, -1)
+            valid = indexes < len(self)  # Missing neighbours have the index N, and are sorted last
+
+            k_found = np.max(np.count_nonzero(valid, axis=1), initial=0)
+            indexes, valid = indexes[:, :k_found], valid[:, :k_found]  # Dropping columns without any neighbours
+            normals[start:end] = neighbourhood_normals(
+                neighbourhoods=points[np.where(valid, indexes, 0)], valid=valid
+            )
+
+        return normals
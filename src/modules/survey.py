@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import shutil
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..config import Config
+from ..logging import logger
+from ..modules import Cache, Detections, Label, Plane, PointBuffer, PointCloud, Profiler, SegmentFeatures
+from ..utils import lazy_import
+
+gpd = lazy_import("geopandas")
+laspy = lazy_import("laspy")
+pd = lazy_import("pandas")
+
+HALO_COLUMNS = ("xyz", "intensity", "labels", "record_indexes")  # Point buffer columns of the halo that are saved
+
+# Config values that must not change during a survey, as the final segments of earlier files are not processed again
+SURVEY_SETTINGS = (
+    "COMPACT_POINTS", "DOWN_SAMPLE_ON_READ", "UNIFORM_DOWN_SAMPLE", "SOR_NO_NEIGHBOURS", "SOR_STD_RATIO",
+    "CROP_TO_MIDDLE_LINE", "SEGMENT_FIT_MODE", "SURVEY_SEGMENT_SIZE", "OVERLAP_PERCENTAGE", "MIN_DIST_STD",
+    "MAX_DIST_STD", "MIN_ANGLE_DEV", "MAX_ANGLE_DEV", "OUTPUT_MODE"
+)
+
+
+@dataclass
+class Survey:
+    """
+    Incremental processing of a mobile mapping survey that arrives as a sequence of LAS files in scan order. The
+    files are segmented as one continuous point cloud with segments of Config.SURVEY_SEGMENT_SIZE points, so the
+    segments do not depend on the size of the files. A segment that ends before the last point of the survey is
+    final. The segments that reach the last point touch the seam to the next file, so their points are kept as the
+    halo and are segmented again together with the next file. Each file therefore costs time proportional to its own
+    size, and only the outputs of the files with points in the halo are written again
+    """
+    directory: str  # Directory of the state of the survey
+    __state: dict  # Ingested files and the names of the saved state files
+
+    def __init__(self, directory: str) -> None:
+        """
+        Constructor for the Survey class. The state of an earlier run is loaded if the directory has one
+        :param directory: Directory of the state of the survey
+        """
+        self.directory = directory
+        self.__state = self.__load_state()
+
+    def contains(self, las_path: str) -> bool:
+        """
+        Checks if a LAS file has been ingested
+        :param las_path: Path to .las file
+        :return:
+        """
+        name = os.path.splitext(os.path.basename(las_path))[0]
+        for file in self.__state["files"]:
+            if file["name"] == name:
+                if file["hash"] != Cache.file_hash(file_path=las_path):
+                    raise ValueError(
+                        f"{las_path} has changed since it was ingested. Start a new survey in another SURVEY_DIR"
+                    )
+
+                return True
+
+        return False
+
+    @Profiler.profiled("ingest")
+    def ingest(self, las_path: str, pcd: PointBuffer) -> dict[str, str]:
+        """
+        Adds the next LAS file of the survey. Its points are segmented together with the halo, the segments touching
+        the seam are re-evaluated, and the outputs enabled by Config.OUTPUT_MODE are updated
+        :param las_path: Path to .las file. It must follow the ingested files in scan order
+        :param pcd: Pre-processed point cloud of the file
+        :return: Paths to the updated outputs
+        """
+        if Config.OUTPUT_MODE.value not in ("points", "detections", "both"):
+            raise ValueError(f"Unknown output mode {Config.OUTPUT_MODE.value}")
+
+        if self.contains(las_path=las_path):
+            raise ValueError(f"{las_path} has already been ingested")
+
+        state = self.__state
+        file = self.__file(las_path=las_path)
+        if state["files"]:
+            self.__validate(file=file)
+        else:
+            state["settings"] = {name: Config[name].value for name in SURVEY_SETTINGS}
+
+        # The halo followed by the new points. File of each point, as an index into the ingested files
+        halo, halo_files = self.__load_halo()
+        file_index = len(state["files"])
+        state["files"].append(file)
+        point_files = np.concatenate((halo_files, np.full(len(pcd), file_index, dtype=np.int32)))
+        combined = PointBuffer(
+            xyz=np.concatenate((halo.xyz, pcd.xyz)),
+            intensity=np.concatenate((halo.intensity, pcd.intensity)),
+            record_indexes=np.concatenate((halo.record_indexes, pcd.record_indexes))
+        )
+        logger.info(f"Ingesting {las_path} with {len(pcd)} new points and {len(halo)} points in the halo")
+
+        segments, features, detections = self.__classify(pcd=combined)
+
+        # Segments that reach the last point are not final, and the halo starts at the first of them. Without such
+        # segments, the halo starts after the last final segment, so no segments keep every point for the next file
+        seam = features["end_index"] >= len(combined) - 1
+        if seam.any():
+            seam_start = int(features["start_index"][seam].min())
+        else:
+            seam_start = int(features["end_index"].max(initial=-1)) + 1
+        final = ~seam
+        final_segments = [segment for segment, is_final in zip(segments, final) if is_final]
+
+        # Labels of the final segments of earlier files are kept for the points of the halo
+        labels = Survey.__segment_labels(segments=segments, detections=detections, point_count=len(combined))
+        labels[:len(halo)] = np.maximum(labels[:len(halo)], halo.labels)
+        halo_labels = Survey.__segment_labels(
+            segments=final_segments, detections=detections[final], point_count=len(combined)
+        )[seam_start:]
+        kept = max(len(halo) - seam_start, 0)  # Points of the old halo that are still in the halo
+        halo_labels[:kept] = np.maximum(halo_labels[:kept], halo.labels[len(halo) - kept:])
+
+        # Indexes of the survey, counted from the first point of the first file
+        features["start_index"] += state["point_offset"]
+        features["end_index"] += state["point_offset"]
+        final_features = np.concatenate((self.__load_features(), features[final]))
+
+        run = file_index + 1
+        names = {"halo": f"halo.{run}", "features": f"features.{run}.npy"}
+        shutil.rmtree(os.path.join(self.directory, names["halo"]), ignore_errors=True)  # Halo of an interrupted run
+        os.makedirs(os.path.join(self.directory, names["halo"]))
+        halo_pcd = combined.select(slice(seam_start, None))
+        halo_pcd.labels = halo_labels
+        for column in HALO_COLUMNS:
+            np.save(os.path.join(self.directory, names["halo"], f"{column}.npy"), getattr(halo_pcd, column))
+
+        np.save(os.path.join(self.directory, names["halo"], "files.npy"), point_files[seam_start:])
+        np.save(os.path.join(self.directory, names["features"]), final_features)
+
+        outputs = {
+            "features_path": SegmentFeatures.save(
+                features=np.concatenate((final_features, features[seam])), filename="survey_segment_features"
+            )
+        }
+
+        # Label of each record of the files with points in this run
+        for index in np.unique(point_files).tolist():
+            touched = state["files"][index]
+            in_file = point_files == index
+            record_labels = self.__load_labels(file=touched)
+            record_labels[combined.record_indexes[in_file]] = labels[in_file]
+
+            touched["labels"] = f"labels.{touched['name']}.{run}.npy"
+            np.save(os.path.join(self.directory, touched["labels"]), record_labels)
+            if Config.OUTPUT_MODE.value in ("points", "both"):
+                outputs[f"{touched['name']}_output_path"] = PointCloud.write_labels(
+                    labels=record_labels, source_path=touched["path"], filename=f"{touched['name']}_marked_point_cloud"
+                )
+
+        if Config.OUTPUT_MODE.value in ("detections", "both"):
+            names["detections"] = f"detections.{run}.pkl"
+            final_gdf = Survey.__detections(
+                segments=final_segments, features=features[final], detections=detections[final],
+                source_path=las_path, first_segment=len(final_features) - np.count_nonzero(final),
+                previous=self.__load_detections()
+            )
+            with open(os.path.join(self.directory, names["detections"]), "wb") as f:
+                pickle.dump(final_gdf, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            gdf = Survey.__detections(
+                segments=[segment for segment, is_seam in zip(segments, seam) if is_seam], features=features[seam],
+                detections=detections[seam], source_path=las_path, first_segment=len(final_features),
+                previous=final_gdf
+            )
+            outputs["detections_path"] = Detections.save(gdf=gdf, filename="survey_detections")
+
+        state["point_offset"] += seam_start
+        state.update(names)
+        self.__save_state()
+        logger.info(
+            f"Ingested {las_path}. {np.count_nonzero(final)} segments are final, and {len(halo_pcd)} points are kept "
+            f"for the next file"
+        )
+
+        return outputs
+
+    def __classify(self, pcd: PointBuffer) -> tuple[list[Plane], np.ndarray, np.ndarray]:
+        """
+        Segments the halo and the new points into segments of at least Config.SURVEY_SEGMENT_SIZE points, and
+        classifies the segments
+        :param pcd: The halo followed by the new points
+        :return: The plane of each segment, the feature table and the detections
+        """
+        no_segments = len(pcd) // Config.SURVEY_SEGMENT_SIZE.value
+        no_segments = min(no_segments, len(pcd) // (Config.SOR_NO_NEIGHBOURS.value + 1))
+        if no_segments < 1:
+            logger.info("Too few points to segment, all of them are kept for the next file")
+            return [], np.empty(0, dtype=SegmentFeatures.DTYPE), np.zeros(0, dtype=bool)
+
+        if Config.SPATIAL_INDEX.value:
+            pcd = PointCloud.build_spatial_index(pcd=pcd)
+
+        pcd = PointCloud.estimate_normals(pcd=pcd)
+        return PointCloud.classify_segments(pcd=pcd, no_segments=no_segments)
+
+    @staticmethod
+    def __detections(
+            segments: list[Plane], features: np.ndarray, detections: np.ndarray, source_path: str,
+            first_segment: int, previous: gpd.GeoDataFrame | None
+    ) -> gpd.GeoDataFrame:
+        """
+        Creates the geometries of the detected segments and appends them to the detections of earlier segments
+        :param segments: The plane of each segment
+        :param features: Feature table of the segments, with indexes of the survey
+        :param detections: Boolean array that is True for the segments that may contain a speed bump
+        :param source_path: Path to a .las file of the survey, whose scale, offset and CRS are used
+        :param first_segment: Number of segments before these in the survey feature table
+        :param previous: Detections of the segments before these, if any
+        :return: Geo-dataframe with one row per detected segment of the survey
+        """
+        gdf = Detections.create(segments=segments, features=features, detections=detections, source_path=source_path)
+        gdf["segment"] += first_segment  # Numbered as the rows of the survey feature table
+        if previous is None:
+            return gdf
+
+        return gpd.GeoDataFrame(pd.concat((previous, gdf), ignore_index=True), crs=gdf.crs)
+
+    def __validate(self, file: dict) -> None:
+        """
+        Checks that a LAS file and the config match the survey
+        :param file: Entry of the file, see __file
+        :return:
+        """
+        first = self.__state["files"][0]
+        if not np.allclose(file["scales"], first["scales"]) or not np.allclose(file["offsets"], first["offsets"]):
+            raise ValueError(
+                f"{file['path']} has another scale or offset than {first['path']}. The LAS integer coordinates of the "
+                f"files of a survey must match"
+            )
+
+        changed = [
+            name for name in SURVEY_SETTINGS if Config[name].value != self.__state["settings"].get(name)
+        ]
+        if changed:
+            raise ValueError(
+                f"{', '.join(changed)} changed since the survey was started. Start a new survey in another SURVEY_DIR"
+            )
+
+    @staticmethod
+    def __file(las_path: str) -> dict:
+        """
+        Creates the entry of a LAS file in the state of the survey
+        :param las_path: Path to .las file
+        :return:
+        """
+        with laspy.open(las_path) as f:
+            header = f.header
+            return {
+                "name": os.path.splitext(os.path.basename(las_path))[0],
+                "path": os.path.abspath(las_path),
+                "hash": Cache.file_hash(file_path=las_path),
+                "point_count": header.point_count,
+                "scales": header.scales.tolist(),
+                "offsets": header.offsets.tolist(),
+                "labels": None  # Filename of the label of each record
+            }
+
+    @staticmethod
+    def __segment_labels(segments: list[Plane], detections: np.ndarray, point_count: int) -> np.ndarray:
+        """
+        Labels the points of the segments as PointCloud.label does
+        :param segments: The plane of each segment
+        :param detections: Boolean array that is True for the segments that may contain a speed bump
+        :param point_count: Number of points the segments were taken from
+        :return: Label of each point
+        """
+        labels = np.full(point_count, Label.REMOVED, dtype=np.uint8)
+        if segments:
+            labels[np.concatenate([segment.indexes for segment in segments])] = Label.SURFACE
+
+        detected_segments = [segment.indexes for segment, detected in zip(segments, detections) if detected]
+        if detected_segments:
+            labels[np.concatenate(detected_segments)] = Label.SPEED_BUMP
+
+        return labels
+
+    def __load_halo(self) -> tuple[PointBuffer, np.ndarray]:
+        """
+        Loads the points of the segments that touched the seam in the last run
+        :return: The halo, labelled by the final segments, and the file of each of its points
+        """
+        if self.__state["halo"] is None:
+            compact = Config.COMPACT_POINTS.value
+            return PointBuffer(
+                xyz=np.empty((0, 3), dtype=np.int32 if compact else np.float64),
+                intensity=np.empty(0, dtype=np.uint16 if compact else np.float64),
+                labels=np.empty(0, dtype=np.uint8),
+                record_indexes=np.empty(0, dtype=np.int64)
+            ), np.empty(0, dtype=np.int32)
+
+        halo_dir = os.path.join(self.directory, self.__state["halo"])
+        return PointBuffer(**{
+            column: np.load(os.path.join(halo_dir, f"{column}.npy")) for column in HALO_COLUMNS
+        }), np.load(os.path.join(halo_dir, "files.npy"))
+
+    def __load_features(self) -> np.ndarray:
+        """
+        Loads the feature table of the final segments
+        :return:
+        """
+        if self.__state["features"] is None:
+            return np.empty(0, dtype=SegmentFeatures.DTYPE)
+
+        return np.load(os.path.join(self.directory, self.__state["features"]))
+
+    def __load_detections(self) -> gpd.GeoDataFrame | None:
+        """
+        Loads the detections of the final segments
+        :return: The detections, or None if no detections have been saved
+        """
+        if self.__state["detections"] is None:
+            return None
+
+        with open(os.path.join(self.directory, self.__state["detections"]), "rb") as f:
+            return pickle.load(f)
+
+    def __load_labels(self, file: dict) -> np.ndarray:
+        """
+        Loads the label of each record of an ingested file
+        :param file: Entry of the file
+        :return:
+        """
+        if file["labels"] is None:
+            return np.full(file["point_count"], Label.REMOVED, dtype=np.uint8)
+
+        return np.load(os.path.join(self.directory, file["labels"]))
+
+    def __load_state(self) -> dict:
+        """
+        Loads the state of the survey
+        :return: The state, or the state of an empty survey if the directory has none
+        """
+        state_path = os.path.join(self.directory, "state.json")
+        if not os.path.exists(state_path):
+            return {
+                "files": [], "settings": None, "point_offset": 0, "halo": None,
+                "features": None, "detections": None
+            }
+
+        with open(state_path, "r") as f:
+            return json.load(f)
+
+    def __save_state(self) -> None:
+        """
+        Saves the state of the survey, and removes the files of the previous state. Every run saves its state files
+        under new names, and the state is written to a temporary file first, so an interrupted run leaves the previous
+        state intact
+        :return:
+        """
+        state_path = os.path.join(self.directory, "state.json")
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(self.__state, f, indent=4)
+
+        os.replace(state_path + ".tmp", state_path)
+
+        referenced = {"state.json"} | {file["labels"] for file in self.__state["files"]} | {
+            self.__state[name] for name in ("halo", "features", "detections")
+        }
+        for name in os.listdir(self.directory):
+            if name not in referenced:
+                path = os.path.join(self.directory, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
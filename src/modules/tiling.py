@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+import math
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Iterator
+
+import numpy as np
+from tqdm import tqdm
+
+from ..config import Config
+from ..logging import logger
+from ..modules import Detections, Label, Plane, PointBuffer, PointCloud, Profiler, SegmentFeatures
+from ..utils import lazy_import
+
+gpd = lazy_import("geopandas")
+laspy = lazy_import("laspy")
+pd = lazy_import("pandas")
+
+MAX_GRID_CELLS = 1024  # Maximum number of grid cells along each axis
+PROCESSING_BYTES_PER_POINT = 256  # Peak memory of the pipeline per point of a tile, measured with 1e6 points
+TILE_COLUMNS = ("xyz", "intensity", "record_indexes")  # Point buffer columns spilled to disk
+
+
+@dataclass
+class TileGrid:
+    """
+    Square grid cells the tiles are made of, in LAS integer coordinates. A tile is a square of cells (its core) and
+    the halo, a margin of cells around the core that is processed with the tile but labelled by its neighbour
+    """
+    origin: np.ndarray  # x and y of the corner of the first cell
+    cell_size: int  # Side of a cell
+    shape: tuple[int, int]  # Number of cells along x and y
+    tile_cells: int  # Number of cells along each side of the core of a tile
+    halo_cells: int  # Number of cells in the halo on each side of a tile
+
+    @property
+    def tile_shape(self) -> tuple[int, int]:
+        """
+        Number of tiles along x and y
+        :return:
+        """
+        return math.ceil(self.shape[0] / self.tile_cells), math.ceil(self.shape[1] / self.tile_cells)
+
+    def cells(self, xy: np.ndarray) -> np.ndarray:
+        """
+        Finds the cell of each point. Points outside the grid are put in the nearest cell
+        :param xy: x and y of the points, shape (N, 2)
+        :return: Cell indexes along x and y, shape (N, 2)
+        """
+        cells = (np.asarray(xy, dtype=np.int64) - self.origin) // self.cell_size
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def tiles(self, xy: np.ndarray) -> np.ndarray:
+        """
+        Finds the tile whose core contains each point
+        :param xy: x and y of the points, shape (N, 2)
+        :return: Tile indexes along x and y, shape (N, 2)
+        """
+        return self.cells(xy) // self.tile_cells
+
+
+@dataclass
+class Tile:
+    """
+    Points of a tile, spilled to memory-mapped .npy files
+    """
+    index: tuple[int, int]  # Index of the tile along x and y
+    directory: str  # Directory of the .npy file of each column
+    point_count: int  # Number of points in the core and the halo
+    core_point_count: int  # Number of points in the core
+
+
+@dataclass
+class Tiling:
+    """
+    Out-of-core processing of point clouds that do not fit in memory. The LAS file is split into square tiles with a
+    halo, sized so that the pipeline of one tile fits in Config.MEMORY_BUDGET, and the tiles are spilled to
+    memory-mapped .npy files. Each tile is pre-processed and detected on its own, and the labels of the points in its
+    core are stitched into a memory-mapped label per record of the file, from which the output is written
+    """
+
+    @staticmethod
+    def run(file_path: str, prefix: str = "") -> dict[str, str]:
+        """
+        Detects the speed bumps in a LAS file tile by tile, and saves the outputs enabled by Config.OUTPUT_MODE
+        :param file_path: Path to .las file
+        :param prefix: Prefix of the names of the saved files
+        :return: Path to the marked point cloud as "output_path" and to the detections as "detections_path"
+        """
+        if Config.OUTPUT_MODE.value not in ("points", "detections", "both"):
+            raise ValueError(f"Unknown output mode {Config.OUTPUT_MODE.value}")
+
+        tile_dir = os.path.join(Config.TILE_DIR.value, os.path.splitext(os.path.basename(file_path))[0])
+        shutil.rmtree(tile_dir, ignore_errors=True)  # Tiles of an interrupted run
+        os.makedirs(tile_dir)
+
+        labels = None
+        try:
+            grid, tiles = Tiling.split(file_path=file_path, tile_dir=tile_dir)
+            with laspy.open(file_path) as f:
+                point_count = f.header.point_count
+
+            # Label of each record of the file. Records that are in no tile or removed in their tile are left out
+            labels = np.lib.format.open_memmap(
+                os.path.join(tile_dir, "labels.npy"), mode="w+", dtype=np.uint8, shape=(point_count,)
+            )
+            labels[:] = Label.REMOVED
+
+            total_points = sum(tile.core_point_count for tile in tiles)
+            features, detections = [], []
+            for tile in tqdm(tiles, desc="Processing tiles", ncols=Config.LOADING_BAR_LENGTH.value):
+                with Profiler.stage("tile", points=tile.point_count):
+                    tile_features, tile_detections = Tiling.__process(
+                        grid=grid, tile=tile, labels=labels, source_path=file_path, total_points=total_points
+                    )
+
+                features.append(tile_features)
+                if tile_detections is not None:
+                    detections.append(tile_detections)
+
+            features = np.concatenate(features) if features else np.empty(0, dtype=SegmentFeatures.DTYPE)
+            SegmentFeatures.save(features=features, filename=f"{prefix}segment_features")
+            logger.info(f"Found {np.count_nonzero(SegmentFeatures.classify(features=features))} speed bumps")
+
+            outputs = {}
+            if Config.OUTPUT_MODE.value in ("points", "both"):
+                labels.flush()
+                outputs["output_path"] = PointCloud.write_labels(
+                    labels=labels, source_path=file_path, filename=f"{prefix}marked_point_cloud"
+                )
+
+            if Config.OUTPUT_MODE.value in ("detections", "both"):
+                gdf = gpd.GeoDataFrame(pd.concat(detections, ignore_index=True)) if detections \
+                    else Detections.create(segments=[], features=features, detections=np.zeros(0, dtype=bool),
+                                           source_path=file_path)
+                outputs["detections_path"] = Detections.save(gdf=gdf, filename=f"{prefix}detections")
+
+            return outputs
+        finally:
+            labels = None  # Closing the memory map before its file is removed
+            shutil.rmtree(tile_dir, ignore_errors=True)
+
+    @staticmethod
+    @Profiler.profiled("split")
+    def split(file_path: str, tile_dir: str) -> tuple[TileGrid, list[Tile]]:
+        """
+        Splits a LAS file into tiles. The file is read twice: once to count the points in each grid cell, from which
+        the largest tiles that fit in the memory budget are found, and once to spill the points to the tiles. The
+        points are down sampled while reading as in PointCloud.create
+        :param file_path: Path to .las file
+        :param tile_dir: Directory the tiles are saved in
+        :return: The grid and the tiles that have points in their core
+        """
+        logger.info(f"Splitting {file_path} into tiles")
+        with laspy.open(file_path) as f:
+            header = f.header
+            point_count = header.point_count
+
+            # Bounds in LAS integer coordinates
+            mins = np.floor((header.mins[:2] - header.offsets[:2]) / header.scales[:2]).astype(np.int64)
+            maxs = np.ceil((header.maxs[:2] - header.offsets[:2]) / header.scales[:2]).astype(np.int64)
+            halo = int(np.ceil(Config.TILE_HALO.value / header.scales[:2]).max())
+
+            cell_size = max(halo, math.ceil((maxs - mins + 1).max() / MAX_GRID_CELLS), 1)
+            grid = TileGrid(
+                origin=mins,
+                cell_size=cell_size,
+                shape=tuple(int(n) for n in (maxs - mins) // cell_size + 1),
+                tile_cells=1,
+                halo_cells=math.ceil(halo / cell_size)
+            )
+
+            counts = np.zeros(grid.shape, dtype=np.int64)  # Number of points in each cell
+            max_intensity = 0
+            for xyz, intensity, _ in Tiling.__sampled_chunks(reader=f, desc="Counting points"):
+                cells = grid.cells(xyz[:, :2])
+                counts += np.bincount(
+                    cells[:, 0] * grid.shape[1] + cells[:, 1], minlength=counts.size
+                ).reshape(grid.shape)
+                max_intensity = max(max_intensity, int(intensity.max(initial=0)))
+
+        table = Tiling.__summed_area_table(counts=counts)
+        grid.tile_cells = Tiling.__tile_cells(grid=grid, table=table)
+        point_counts = Tiling.__tile_counts(grid=grid, table=table, halo_cells=grid.halo_cells)
+        core_counts = Tiling.__tile_counts(grid=grid, table=table, halo_cells=0)
+        logger.info(
+            f"Split into {np.count_nonzero(core_counts)} tiles of {grid.tile_cells * grid.cell_size} units with a "
+            f"halo of {grid.halo_cells * grid.cell_size} units, and at most {point_counts.max()} points per tile"
+        )
+
+        # Memory-mapped columns of the tiles with points in their core
+        compact = Config.COMPACT_POINTS.value
+        dtypes = {
+            "xyz": np.int32 if compact else np.float64,
+            "intensity": np.uint16 if compact else np.float64,
+            "record_indexes": np.uint32 if compact and point_count <= np.iinfo(np.uint32).max else np.int64
+        }
+        tiles, columns, filled = {}, {}, {}
+        for i, j in zip(*np.nonzero(core_counts)):
+            tile = Tile(
+                index=(int(i), int(j)),
+                directory=os.path.join(tile_dir, f"tile_{i}_{j}"),
+                point_count=int(point_counts[i, j]),
+                core_point_count=int(core_counts[i, j])
+            )
+            os.makedirs(tile.directory)
+            tiles[tile.index] = tile
+            columns[tile.index] = {
+                name: np.lib.format.open_memmap(
+                    os.path.join(tile.directory, f"{name}.npy"), mode="w+", dtype=dtype,
+                    shape=(tile.point_count, 3) if name == "xyz" else (tile.point_count,)
+                ) for name, dtype in dtypes.items()
+            }
+            filled[tile.index] = 0
+
+        with laspy.open(file_path) as f:
+            for xyz, intensity, record_indexes in Tiling.__sampled_chunks(reader=f, desc="Splitting into tiles"):
+                if max_intensity > 0 and compact:
+                    intensity = intensity.astype(np.uint32) * np.iinfo(np.uint16).max // max_intensity
+                elif max_intensity > 0:
+                    intensity = intensity / max_intensity
+
+                for index, selected in Tiling.__tile_points(grid=grid, xy=xyz[:, :2]):
+                    if index not in tiles:
+                        continue  # Halo of a tile without points in its core
+
+                    start, end = filled[index], filled[index] + len(selected)
+                    columns[index]["xyz"][start:end] = xyz[selected]
+                    columns[index]["intensity"][start:end] = intensity[selected]
+                    columns[index]["record_indexes"][start:end] = record_indexes[selected]
+                    filled[index] = end
+
+        for tile_columns in columns.values():
+            for column in tile_columns.values():
+                column.flush()
+
+        return grid, list(tiles.values())
+
+    @staticmethod
+    def load(tile: Tile) -> PointBuffer:
+        """
+        Loads the points of a tile as copy-on-write memory maps, so only the pages that are used are read
+        :param tile: Tile saved by split
+        :return:
+        """
+        return PointBuffer(**{
+            name: np.load(os.path.join(tile.directory, f"{name}.npy"), mmap_mode="c") for name in TILE_COLUMNS
+        })
+
+    @staticmethod
+    def __process(
+            grid: TileGrid, tile: Tile, labels: np.ndarray, source_path: str, total_points: int
+    ) -> tuple[np.ndarray, gpd.GeoDataFrame | None]:
+        """
+        Pre-processes a tile and detects the speed bumps in it. The labels of the points in the core are written to
+        the label of their record, and the segments whose centroid is in the core are kept
+        :param grid: Grid of the tiles
+        :param tile: Tile to process
+        :param labels: Label of each record of the source file
+        :param source_path: Path to the .las file the tile was split from
+        :param total_points: Total number of points in the tiles, used to keep the segments as long as when the whole
+        point cloud is segmented
+        :return: Feature table of the kept segments, and their detections if enabled by Config.OUTPUT_MODE
+        """
+        pcd = PointCloud.pre_process(pcd=Tiling.load(tile=tile), source_path=source_path)
+        no_segments = round(Config.NO_SEGMENTS.value * tile.point_count / total_points)
+        no_segments = min(no_segments, len(pcd) // (Config.SOR_NO_NEIGHBOURS.value + 1))
+        if no_segments < 1:
+            logger.debug(f"Skipping tile {tile.index}, too few points are left after pre-processing")
+            return np.empty(0, dtype=SegmentFeatures.DTYPE), None
+
+        if Config.SPATIAL_INDEX.value:
+            pcd = PointCloud.build_spatial_index(pcd=pcd)
+
+        pcd = PointCloud.estimate_normals(pcd=pcd)
+        segments, features, detections = PointCloud.classify_segments(pcd=pcd, no_segments=no_segments)
+
+        if Config.OUTPUT_MODE.value in ("points", "both"):
+            labelled_pcd = PointCloud.label(pcd=pcd, segments=segments, detections=detections)
+            in_core = np.all(grid.tiles(labelled_pcd.xyz[:, :2]) == tile.index, axis=1)
+            labels[labelled_pcd.record_indexes[in_core]] = labelled_pcd.labels[in_core]
+
+        # Segments of the halo are kept by the tile they are centred in
+        kept = Tiling.__core_segments(grid=grid, tile=tile, segments=segments)
+        features, detections = features[kept], detections[kept]
+        if Config.OUTPUT_MODE.value == "points":
+            return features, None
+
+        gdf = Detections.create(
+            segments=[segment for segment, is_kept in zip(segments, kept) if is_kept],
+            features=features,
+            detections=detections,
+            source_path=source_path
+        )
+        gdf.insert(0, "tile", f"{tile.index[0]}_{tile.index[1]}")
+
+        return features, gdf
+
+    @staticmethod
+    def __tile_points(grid: TileGrid, xy: np.ndarray) -> Iterator[tuple[tuple[int, int], np.ndarray]]:
+        """
+        Groups points by the tiles whose core or halo contain them. A point in a halo is in more than one tile
+        :param grid: Grid of the tiles
+        :param xy: x and y of the points, shape (N, 2)
+        :return: Index of each tile with points, and the indexes of its points in ascending order
+        """
+        tile_shape = np.array(grid.tile_shape)
+        cells = grid.cells(xy)
+        first_tiles = np.maximum((cells - grid.halo_cells) // grid.tile_cells, 0)
+        last_tiles = np.minimum((cells + grid.halo_cells) // grid.tile_cells, tile_shape - 1)
+
+        # (point index, tile id) pairs of the points and each tile containing them
+        point_indexes, tile_ids = [], []
+        span = 2 * grid.halo_cells // grid.tile_cells + 2  # Maximum number of tiles containing a point along each axis
+        for offset in np.ndindex(span, span):
+            tile_indexes = first_tiles + offset
+            in_tile = np.flatnonzero(np.all(tile_indexes <= last_tiles, axis=1))
+            point_indexes.append(in_tile)
+            tile_ids.append(tile_indexes[in_tile, 0] * tile_shape[1] + tile_indexes[in_tile, 1])
+
+        point_indexes, tile_ids = np.concatenate(point_indexes), np.concatenate(tile_ids)
+        order = np.lexsort((point_indexes, tile_ids))  # Points of a tile are kept in file order
+        point_indexes, tile_ids = point_indexes[order], tile_ids[order]
+
+        unique_ids, starts = np.unique(tile_ids, return_index=True)
+        for tile_id, selected in zip(unique_ids, np.split(point_indexes, starts[1:])):
+            yield tuple(int(n) for n in divmod(int(tile_id), int(tile_shape[1]))), selected
+
+    @staticmethod
+    def __core_segments(grid: TileGrid, tile: Tile, segments: list[Plane]) -> np.ndarray:
+        """
+        Finds the segments whose centroid is in the core of a tile
+        :param grid: Grid of the tiles
+        :param tile: The tile the segments were taken from
+        :param segments: The plane of each segment
+        :return: Boolean array that is True for the segments in the core
+        """
+        kept = np.zeros(len(segments), dtype=bool)
+        for i, segment in enumerate(segments):
+            if len(segment.pcd) > 0:
+                centroid = segment.pcd.xyz[:, :2].mean(axis=0, keepdims=True)
+                kept[i] = np.all(grid.tiles(centroid) == tile.index)
+
+        return kept
+
+    @staticmethod
+    def __tile_cells(grid: TileGrid, table: np.ndarray) -> int:
+        """
+        Finds the largest number of cells along each side of a tile where no tile has more points than fit in the
+        memory budget. Each tile size is checked from the same summed-area table, in time linear in the number of tiles
+        :param grid: Grid of the tiles
+        :param table: Summed-area table of the number of points in each cell, see __summed_area_table
+        :return:
+        """
+        budget_points = max(Config.MEMORY_BUDGET.value // PROCESSING_BYTES_PER_POINT, 1)
+        for tile_cells in range(max(grid.shape), 0, -1):
+            grid.tile_cells = tile_cells
+            if Tiling.__tile_counts(grid=grid, table=table, halo_cells=grid.halo_cells).max() <= budget_points:
+                return tile_cells
+
+        logger.warning(
+            f"Some tiles have more points than fit in the memory budget of {Config.MEMORY_BUDGET.value} bytes. "
+            f"Reduce TILE_HALO or increase MEMORY_BUDGET"
+        )
+        return 1
+
+    @staticmethod
+    def __summed_area_table(counts: np.ndarray) -> np.ndarray:
+        """
+        Sums the points of the cells below and left of each cell, so the points of any block of cells are counted from
+        its four corners
+        :param counts: Number of points in each cell
+        :return: Number of points in the cells before each cell along x and y, with a leading row and column of zeros
+        """
+        table = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1), dtype=np.int64)
+        table[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+
+        return table
+
+    @staticmethod
+    def __tile_counts(grid: TileGrid, table: np.ndarray, halo_cells: int) -> np.ndarray:
+        """
+        Counts the points of each tile from the summed-area table of the cell counts
+        :param grid: Grid of the tiles
+        :param table: Summed-area table of the number of points in each cell, see __summed_area_table
+        :param halo_cells: Number of halo cells on each side of a tile
+        :return: Number of points of each tile along x and y
+        """
+        bounds = []  # First and last cell of each tile (exclusive) along each axis
+        for n_cells, n_tiles in zip(grid.shape, grid.tile_shape):
+            starts = np.arange(n_tiles) * grid.tile_cells
+            bounds.append((
+                np.clip(starts - halo_cells, 0, n_cells), np.clip(starts + grid.tile_cells + halo_cells, 0, n_cells)
+            ))
+
+        (x_start, x_end), (y_start, y_end) = bounds
+        return table[np.ix_(x_end, y_end)] - table[np.ix_(x_start, y_end)] - table[np.ix_(x_end, y_start)] \
+            + table[np.ix_(x_start, y_start)]
+
+    @staticmethod
+    def __sampled_chunks(reader: laspy.LasReader, desc: str) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Reads a LAS file in chunks, keeping every k-th point of the file as in PointCloud.create
+        :param reader: Opened LAS file
+        :param desc: Description of the progress bar
+        :return: LAS integer coordinates, raw intensity and record index of the kept points of each chunk
+        """
+        every_k_points = Config.UNIFORM_DOWN_SAMPLE.value if Config.DOWN_SAMPLE_ON_READ.value else 1
+        read_count = 0
+        for points in tqdm(
+                reader.chunk_iterator(Config.CHUNK_SIZE.value),
+                total=math.ceil(reader.header.point_count / Config.CHUNK_SIZE.value),
+                desc=desc,
+                ncols=Config.LOADING_BAR_LENGTH.value
+        ):
+            kept = slice(-read_count % every_k_points, None, every_k_points)
+            xyz = np.column_stack((points.X[kept], points.Y[kept], points.Z[kept]))
+            yield xyz, np.asarray(points.intensity[kept]), np.arange(*kept.indices(len(points))) + read_count
+
+            read_count += len(points)
@@ -1,3 +1,63 @@
-from .misc_utils import *
-from .conversion_utils import *
-from .computation_utils import *
\ No newline at end of file
+import importlib
+from typing import TYPE_CHECKING, Any
+
+# Submodule of each helper. The submodules are imported on first access (PEP 562), see src.modules
+_SUBMODULES = {
+    "pcd_file_names": "misc_utils",
+    "create_df": "misc_utils",
+    "indexes_to_pcd": "conversion_utils",
+    "pcd_to_plane": "conversion_utils",
+    "transform_geometries": "conversion_utils",
+    "utm_to_cartesian": "conversion_utils",
+    "point_plane_dist": "computation_utils",
+    "points_plane_dists": "computation_utils",
+    "std": "computation_utils",
+    "rad_to_deg": "computation_utils",
+    "deg_to_rad": "computation_utils",
+    "vector_angle": "computation_utils",
+    "vector_angles": "computation_utils",
+    "ransac_iterations": "computation_utils",
+    "fit_plane": "computation_utils",
+    "ransac_plane": "computation_utils",
+    "prefix_moments": "computation_utils",
+    "window_planes": "computation_utils",
+    "neighbourhood_normals": "computation_utils",
+    "statistical_inlier_mask": "computation_utils",
+    "to_shared_memory": "parallel_utils",
+    "from_shared_memory": "parallel_utils",
+    "LazyModule": "lazy_utils",
+    "lazy_import": "lazy_utils",
+    "import_lazy_modules": "lazy_utils",
+}
+
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Imports the submodule of a helper on first access
+    :param name: Name of the helper
+    :return:
+    """
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_SUBMODULES[name]}", __name__), name)
+    globals()[name] = value  # Later accesses do not go through __getattr__
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .lazy_utils import LazyModule, lazy_import, import_lazy_modules
+    from .misc_utils import pcd_file_names, create_df
+    from .conversion_utils import indexes_to_pcd, pcd_to_plane, transform_geometries, utm_to_cartesian
+    from .computation_utils import (
+        point_plane_dist, points_plane_dists, std, rad_to_deg, deg_to_rad, vector_angle, vector_angles,
+        ransac_iterations, fit_plane, ransac_plane, prefix_moments, window_planes, neighbourhood_normals,
+        statistical_inlier_mask
+    )
+    from .parallel_utils import to_shared_memory, from_shared_memory
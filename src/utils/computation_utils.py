@@ -22,6 +22,17 @@ def point_plane_dist(point: Point, plane: Plane) -> float:
     )
 
 
+def points_plane_dists(points: np.ndarray, plane: Plane) -> np.ndarray:
+    """
+    Calculates the distances between an array of points and a plane in one vectorized operation
+    :param points: Numpy array of shape (N, 3) with x, y and z coordinates
+    :param plane: Plane object
+    :return: Numpy array of shape (N,) with the distances
+    """
+    normal_vector = np.array([plane.a, plane.b, plane.c])
+    return np.abs(points @ normal_vector + plane.d) / np.linalg.norm(normal_vector)
+
+
 def std(data: np.ndarray) -> float:
     """
     Calculates the standard deviation of a numpy array
@@ -63,3 +74,222 @@ def vector_angle(v1: np.array, v2: np.array) -> float:
     :return: Angle in degrees
     """
     return rad_to_deg(np.arccos(np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))))
+
+
+def vector_angles(v: np.array, vectors: np.ndarray) -> np.ndarray:
+    """
+    Calculates the angles between the line of a vector and the lines of every row of an array of vectors. The sign of
+    the vectors is ignored, as the sign of a normal vector is arbitrary, so the angles are between 0 and 90 degrees
+    :param v: Vector of shape (3,)
+    :param vectors: Numpy array of shape (N, 3)
+    :return: Numpy array of shape (N,) with the angles in degrees
+    """
+    cos_angles = np.abs(vectors @ v) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(v))
+    return rad_to_deg(np.arccos(np.clip(cos_angles, 0, 1)))
+
+
+def ransac_iterations(inlier_ratio: float, confidence: float, sample_size: int = 3) -> float:
+    """
+    Calculates the number of RANSAC iterations needed to draw at least one outlier free sample with the given
+    confidence
+    :param inlier_ratio: Ratio of inliers among the points
+    :param confidence: Probability of drawing at least one outlier free sample
+    :param sample_size: Number of points per sample
+    :return: Required number of iterations, inf if no outlier free sample can be expected
+    """
+    outlier_free = inlier_ratio ** sample_size  # Probability of a sample with only inliers
+    if outlier_free >= 1:
+        return 0
+
+    if outlier_free <= 0:
+        return np.inf
+
+    return np.log(1 - confidence) / np.log(1 - outlier_free)
+
+
+def fit_plane(points: np.ndarray) -> np.ndarray:
+    """
+    Fits a plane to points using least squares, i.e. the plane through the centroid with the direction of least
+    variance as normal vector
+    :param points: Numpy array of shape (N, 3)
+    :return: Plane model (a, b, c, d) with a unit normal vector pointing upwards
+    """
+    centroid = np.mean(points, axis=0)
+    _, eigenvectors = np.linalg.eigh(np.cov(points - centroid, rowvar=False))
+    normal = eigenvectors[:, 0]  # Eigenvector of the smallest eigenvalue
+    if normal[2] < 0:
+        normal = -normal  # Pointing the normal upwards, as the point normals
+
+    return np.append(normal, -normal @ centroid)
+
+
+def ransac_plane(
+        points: np.ndarray,
+        threshold: float,
+        max_iterations: int,
+        confidence: float = 0.99,
+        batch_size: int = 64,
+        rng: np.random.Generator = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fits a plane to points using RANSAC. The plane hypotheses are drawn in batches and all hypotheses of a batch are
+    scored against all points in one matrix product. The search stops as soon as the number of iterations required
+    for the given confidence has been reached, and the best plane is refined by least squares on its inliers
+    :param points: Numpy array of shape (N, 3)
+    :param threshold: Maximum distance for a point to be considered an inlier
+    :param max_iterations: Maximum number of hypotheses
+    :param confidence: Probability of finding an outlier free sample, used for stopping early
+    :param batch_size: Number of hypotheses scored at a time
+    :param rng: Random generator. Default: A new unseeded generator
+    :return: Plane model (a, b, c, d) with a unit normal vector pointing upwards and a boolean inlier mask of shape (N,)
+    """
+    if len(points) < 3:
+        raise ValueError(f"At least 3 points are required to fit a plane, got {len(points)}")
+
+    rng = np.random.default_rng() if rng is None else rng
+    centroid = np.mean(points, axis=0)
+    centred = points - centroid  # Centring the points to keep the products well conditioned
+
+    best_model = None
+    best_count = 0
+    iterations = 0
+    required_iterations = max_iterations
+
+    while iterations < min(required_iterations, max_iterations):
+        batch = min(batch_size, max_iterations - iterations)
+        iterations += batch
+
+        samples = centred[rng.integers(0, len(centred), size=(batch, 3))]  # Shape (batch, 3, 3)
+        normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+        norms = np.linalg.norm(normals, axis=1)
+        valid = norms > 0  # Removing degenerate samples
+        if not np.any(valid):
+            continue
+
+        normals = normals[valid] / norms[valid, np.newaxis]
+        d = -np.einsum('ij,ij->i', normals, samples[valid, 0])
+
+        # Scoring all hypotheses of the batch at once, shape (N, hypotheses)
+        counts = np.count_nonzero(np.abs(centred @ normals.T + d) <= threshold, axis=0)
+        best = np.argmax(counts)
+
+        if counts[best] > best_count:
+            best_count = counts[best]
+            best_model = np.append(normals[best], d[best])
+            required_iterations = ransac_iterations(best_count / len(centred), confidence)
+
+    if best_model is None:
+        raise ValueError("Unable to fit a plane to degenerate points")
+
+    # Refining the best plane on its inliers and finding the final inliers
+    inlier_mask = np.abs(centred @ best_model[:3] + best_model[3]) <= threshold
+    if np.count_nonzero(inlier_mask) >= 3:
+        best_model = fit_plane(centred[inlier_mask])
+        inlier_mask = np.abs(centred @ best_model[:3] + best_model[3]) <= threshold
+
+    if best_model[2] < 0:
+        best_model = -best_model  # Pointing the normal upwards, as the point normals
+
+    a, b, c, d = best_model
+    return np.array([a, b, c, d - best_model[:3] @ centroid]), inlier_mask
+
+
+def prefix_moments(points: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates the cumulative first and second moments of points along their order, so the moments of any range of
+    points can be found in constant time. The points are centred on their mean to limit the loss of precision
+    :param points: Numpy array of shape (N, 3)
+    :return: The mean used as origin of shape (3,), the cumulative sums of x, y and z of shape (N + 1, 3), and the
+    cumulative sums of xx, xy, xz, yy, yz and zz of shape (N + 1, 6). Row i holds the sums of the first i points
+    """
+    origin = np.mean(points, axis=0)
+    centred = points - origin
+    x, y, z = centred[:, 0], centred[:, 1], centred[:, 2]
+
+    first = np.zeros((len(points) + 1, 3))
+    np.cumsum(centred, axis=0, out=first[1:])
+
+    second = np.zeros((len(points) + 1, 6))
+    np.cumsum(np.column_stack([x * x, x * y, x * z, y * y, y * z, z * z]), axis=0, out=second[1:])
+
+    return origin, first, second
+
+
+def window_planes(
+        moments: tuple[np.ndarray, np.ndarray, np.ndarray],
+        start_indexes: np.ndarray,
+        end_indexes: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fits least squares planes to ranges of points from their prefix moments, without visiting the points
+    :param moments: Prefix moments from prefix_moments
+    :param start_indexes: Start index of each range
+    :param end_indexes: End index of each range, inclusive
+    :return: Plane models (a, b, c, d) with unit normal vectors of shape (W, 4), and the standard deviation of the
+    signed distances between the points of each range and its plane of shape (W,)
+    """
+    origin, first, second = moments
+    start_indexes = np.asarray(start_indexes)
+    end_indexes = np.asarray(end_indexes) + 1  # Exclusive end indexes
+
+    n = (end_indexes - start_indexes)[:, np.newaxis]
+    mean = (first[end_indexes] - first[start_indexes]) / n
+    xx, xy, xz, yy, yz, zz = ((second[end_indexes] - second[start_indexes]) / n).T
+
+    # Covariance matrices of the ranges, shape (W, 3, 3)
+    covariances = np.stack([
+        np.stack([xx, xy, xz], axis=1),
+        np.stack([xy, yy, yz], axis=1),
+        np.stack([xz, yz, zz], axis=1)
+    ], axis=1) - mean[:, :, np.newaxis] * mean[:, np.newaxis, :]
+
+    eigenvalues, eigenvectors = np.linalg.eigh(covariances)
+    normals = eigenvectors[:, :, 0]  # Eigenvectors of the smallest eigenvalues
+    normals[normals[:, 2] < 0] *= -1  # Pointing all normals upwards
+    d = -np.einsum('ij,ij->i', normals, mean + origin)
+
+    return np.column_stack([normals, d]), np.sqrt(np.clip(eigenvalues[:, 0], 0, None))
+
+
+def neighbourhood_normals(neighbourhoods: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Estimates the normal vector of each point from its neighbourhood using PCA, for many points at once
+    :param neighbourhoods: Coordinates of the neighbours of each point of shape (N, k, 3)
+    :param valid: Boolean array of shape (N, k) that is False for missing neighbours
+    :return: Unit normal vectors pointing upwards of shape (N, 3). Points with less than 3 neighbours get (0, 0, 1)
+    """
+    counts = np.count_nonzero(valid, axis=1)
+    normals = np.tile(np.array([0.0, 0.0, 1.0]), (len(counts), 1))  # Too few neighbours to define a plane
+
+    solvable = counts >= 3  # Only solving the neighbourhoods that define a plane
+    if not np.any(solvable):
+        return normals
+
+    neighbourhoods, weights = neighbourhoods[solvable], valid[solvable, :, np.newaxis]
+    counts = counts[solvable, np.newaxis]
+
+    means = np.sum(neighbourhoods * weights, axis=1) / counts
+    centred = (neighbourhoods - means[:, np.newaxis, :]) * weights
+    covariances = np.matmul(centred.transpose(0, 2, 1), centred) / counts[:, :, np.newaxis]
+
+    _, eigenvectors = np.linalg.eigh(covariances)
+    solved = eigenvectors[:, :, 0]  # Eigenvectors of the smallest eigenvalues
+    solved[solved[:, 2] < 0] *= -1  # Pointing all normals upwards
+    normals[solvable] = solved
+
+    return normals
+
+
+def statistical_inlier_mask(mean_distances: np.ndarray, std_ratio: float) -> np.ndarray:
+    """
+    Finds the statistical inliers among points from the mean distance to their nearest neighbours. A point is an
+    outlier if its mean distance is more than std_ratio standard deviations above the mean of all points
+    :param mean_distances: Mean distance from each point to its nearest neighbours of shape (N,)
+    :param std_ratio: Number of standard deviations
+    :return: Boolean array of shape (N,) that is True for the inliers
+    """
+    if len(mean_distances) < 2:
+        return np.ones(len(mean_distances), dtype=bool)
+
+    threshold = np.mean(mean_distances) + std_ratio * np.std(mean_distances, ddof=1)
+    return (mean_distances > 0) & (mean_distances < threshold)  # Same criterion as Open3D
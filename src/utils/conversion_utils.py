@@ -1,48 +1,21 @@
 from __future__ import annotations
 
-import geopandas as gpd
+from typing import TYPE_CHECKING, Any
+
 import numpy as np
-import open3d as o3d
-import pandas as pd
-import pyproj
 
 from ..config import Config
 from ..logging import logger
+from .computation_utils import ransac_plane
+from .lazy_utils import lazy_import
 
+gpd = lazy_import("geopandas")
+o3d = lazy_import("open3d")
+pyproj = lazy_import("pyproj")
+shapely = lazy_import("shapely")
 
-def df_to_pcd(df: pd.DataFrame) -> o3d.geometry.PointCloud:
-    """
-    Converts a dataframe to a point cloud object.
-    :param df: Dataframe to be converted
-    :return: Point cloud object
-    """
-    logger.debug("Creating point cloud...")
-    pcd = o3d.geometry.PointCloud()  # Point cloud object
-    pcd.points = o3d.utility.Vector3dVector(np.asarray(df[['X', 'Y', 'Z']]))
-    marked_point_indexes = np.where(df['intensity'].to_numpy() == 0.0)  # Marked points
-    # TODO: Make the marked color green
-
-    pcd.colors = o3d.utility.Vector3dVector(np.asarray(df[['intensity', 'intensity', 'intensity']]))
-    logger.debug(f"Point cloud created with {len(pcd.points)} points")
-
-    return pcd
-
-
-def pcd_to_df(pcd: o3d.geometry.PointCloud) -> pd.DataFrame:
-    """
-    Converts a point cloud object to a dataframe.
-    :param pcd: Point cloud to be converted, assumes that the point cloud has intensity values
-    :return: Dataframe with x, y, z and intensity columns
-    """
-    logger.debug("Converting point cloud to dataframe...")
-    df = pd.DataFrame()
-    df['X'] = np.asarray(pcd.points)[:, 0]
-    df['Y'] = np.asarray(pcd.points)[:, 1]
-    df['Z'] = np.asarray(pcd.points)[:, 2]
-    df['intensity'] = np.asarray(pcd.colors)[:, 0]
-    logger.debug(f"Point cloud converted to dataframe with {len(df)} rows")
-
-    return df
+if TYPE_CHECKING:
+    from ..modules import Plane, PointBuffer
 
 
 def indexes_to_pcd(pcd: o3d.geometry.PointCloud, indexes: list[int]) -> o3d.geometry.PointCloud:
@@ -56,33 +29,63 @@ def indexes_to_pcd(pcd: o3d.geometry.PointCloud, indexes: list[int]) -> o3d.geom
     return reduced_pc
 
 
-def pcd_to_plane(pcd: o3d.geometry.PointCloud) -> Plane:
+def pcd_to_plane(pcd: PointBuffer, indexes: np.ndarray = None) -> Plane:
     """
-    Creates a plane from a point cloud. This is done using RANSAC.
+    Creates a plane from a point cloud. This is done using RANSAC, see ransac_plane.
     :param pcd: Point cloud to generate plane from
-    :return: Plane object
+    :param indexes: Indexes of the points of pcd in the point cloud it was taken from. Default: The indexes in pcd
+    :return: Plane object with the RANSAC inliers and their indexes
     """
     from ..modules.plane import Plane  # Import here to avoid circular imports
 
     logger.debug("Generating plane from point cloud")
-    plane_model, inlier_indexes = pcd.segment_plane(
-        distance_threshold=Config.RANSAC_THRESH.value,
-        ransac_n=Config.RANSAC_N.value,
-        num_iterations=Config.RANSAC_ITER.value
+    plane_model, inlier_mask = ransac_plane(
+        points=pcd.xyz,
+        threshold=Config.RANSAC_THRESH.value,
+        max_iterations=Config.RANSAC_ITER.value,
+        confidence=Config.RANSAC_CONFIDENCE.value,
+        batch_size=Config.RANSAC_BATCH_SIZE.value
     )
 
-    pcd = df_to_pcd(pcd_to_df(pcd).loc[inlier_indexes])
+    inlier_pcd = pcd.select(inlier_mask)
+    inlier_indexes = np.flatnonzero(inlier_mask) if indexes is None else np.asarray(indexes)[inlier_mask]
 
     a, b, c, d = plane_model
-    plane = Plane(a=a, b=b, c=c, d=d, pcd=pcd)
+    plane = Plane(a=a, b=b, c=c, d=d, pcd=inlier_pcd, indexes=inlier_indexes)
 
     return plane
 
 
-def utm_to_cartesian(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def transform_geometries(geometries: np.ndarray, source_crs: Any, target_crs: Any) -> np.ndarray:
+    """
+    Reprojects geometries. The coordinates of the 2D and the 3D geometries are each transformed as one array, so
+    geometries with heights keep them
+    :param geometries: Array of shapely geometries
+    :param source_crs: Coordinate system of the geometries
+    :param target_crs: Coordinate system to reproject the geometries to
+    :return: Array of the reprojected geometries, with the dimension of the input geometries
+    """
+    transformer = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    geometries = np.asarray(geometries, dtype=object)
+    has_z = shapely.get_coordinate_dimension(geometries) == 3
+
+    transformed = geometries.copy()
+    for include_z in (False, True):
+        selected = has_z == include_z
+        if np.any(selected):
+            transformed[selected] = shapely.transform(
+                geometries[selected], lambda coords: np.column_stack(transformer.transform(*coords.T)),
+                include_z=include_z
+            )
+
+    return transformed
+
+
+def utm_to_cartesian(gdf: gpd.GeoDataFrame, crs: Any = 'EPSG:3857') -> gpd.GeoDataFrame:
     """
     Converts a geo-dataframe from any coordinate system to cartesian coordinate system.
     :param gdf: Geo-dataframe to be converted
+    :param crs: Cartesian coordinate system. Default: EPSG:3857
     :return: Geo-dataframe in a cartesian coordinate system
     """
     if gdf is None:
@@ -91,16 +94,5 @@ def utm_to_cartesian(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     if gdf.crs is None:
         raise ValueError("Geo-dataframe has no coordinate system")
 
-    source_coordinate_system = gdf.crs  # Source coordinate system
-    target_coordinate_system = 'EPSG:3857'  # Cartesian coordinate system
-
-    # Transformer object for transformation
-    transformer = pyproj.Transformer.from_crs(
-        source_coordinate_system,
-        target_coordinate_system,  # FIXME: This is not working
-        always_xy=True
-    )
-
-    gdf['geometry'] = gdf['geometry'].to_crs(transformer.transform)  # Convert geometry column to Cartesian coordinates
-
-    return gdf
+    geometries = transform_geometries(geometries=np.asarray(gdf.geometry.array), source_crs=gdf.crs, target_crs=crs)
+    return gdf.set_geometry(gpd.GeoSeries(geometries, index=gdf.index, crs=crs))
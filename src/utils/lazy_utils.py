@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import importlib
+import sys
+from types import ModuleType
+from typing import Any, Callable
+
+# Functions called with a module when it is first used through lazy_import
+IMPORT_HOOKS: dict[str, Callable[[ModuleType], None]] = {
+    "open3d": lambda module: module.utility.set_verbosity_level(module.utility.VerbosityLevel.Error),
+}
+
+_lazy_modules: list[LazyModule] = []  # Placeholders created by lazy_import, see import_lazy_modules
+
+
+class LazyModule(ModuleType):
+    """
+    Placeholder of a module that is imported on first attribute access, so heavy dependencies only slow down the code
+    paths that use them
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        Constructor for the LazyModule class
+        :param name: Name of the module, e.g. "open3d"
+        """
+        super().__init__(name)
+        self.__module = None
+        _lazy_modules.append(self)
+
+    def __getattr__(self, attribute: str) -> Any:
+        """
+        Imports the module if it has not been imported, and gets an attribute of it
+        :param attribute:
+        :return:
+        """
+        if self.__module is None:
+            self.__module = _import(self.__name__)
+
+        return getattr(self.__module, attribute)
+
+    def __dir__(self) -> list[str]:
+        """
+        Attributes of the module. Imports the module
+        :return:
+        """
+        return dir(_import(self.__name__))
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Imports a module on first use. Used for the dependencies that take long to import
+    :param name: Name of the module, e.g. "open3d"
+    :return: The module if it has been imported already, otherwise a placeholder that imports it on first attribute
+    access
+    """
+    return _import(name) if name in sys.modules else LazyModule(name)
+
+
+def import_lazy_modules() -> None:
+    """
+    Imports the modules of every placeholder created so far. Used by long-running processes, which would rather pay
+    the import time up front than on the first use
+    :return:
+    """
+    for module in _lazy_modules:
+        _import(module.__name__)
+
+
+def _import(name: str) -> ModuleType:
+    """
+    Imports a module, and calls its import hook the first time
+    :param name: Name of the module
+    :return:
+    """
+    module = importlib.import_module(name)
+    hook = IMPORT_HOOKS.pop(name, None)
+    if hook is not None:
+        hook(module)
+
+    return module
@@ -1,8 +1,11 @@
-import os
+from __future__ import annotations
 
-import pandas as pd
+import os
 
 from ..config import Config
+from .lazy_utils import lazy_import
+
+pd = lazy_import("pandas")
 
 
 def pcd_file_names() -> list[str]:
@@ -27,3 +30,4 @@ def create_df(**cols) -> pd.DataFrame:
         df[col_name] = col
 
     return df
+
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def to_shared_memory(array: np.ndarray) -> tuple[shared_memory.SharedMemory, tuple]:
+    """
+    Copies an array into a new shared memory block, so worker processes can read it without pickling
+    :param array: Array to be shared
+    :return: The shared memory block and the specification (name, shape, dtype) needed to attach to it. The caller
+    is responsible for closing and unlinking the block
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared_array[:] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def from_shared_memory(spec: tuple) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Attaches to a shared memory block created by to_shared_memory
+    :param spec: Specification (name, shape, dtype) of the shared array
+    :return: The shared memory block and an array view on it. The block must be kept alive as long as the view is used
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
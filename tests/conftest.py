@@ -0,0 +1,67 @@
+import laspy
+import numpy as np
+import pyproj
+import pytest
+
+from src import Config
+
+
+def write_las(
+        path: str,
+        xyz: np.ndarray,
+        scales: tuple[float, float, float] = (0.01, 0.01, 0.01),
+        offsets: tuple[float, float, float] = (0, 0, 0),
+        crs: str = None
+) -> str:
+    """
+    Writes points to a LAS file
+    :param path: Path to .las file
+    :param xyz: Coordinates of the points of shape (N, 3), in the coordinates of the file
+    :param scales: Scales of the header
+    :param offsets: Offsets of the header
+    :param crs: Coordinate system of the file, e.g. "EPSG:25832"
+    :return: The path
+    """
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales, header.offsets = np.array(scales), np.array(offsets)
+    if crs is not None:
+        header.add_crs(pyproj.CRS.from_user_input(crs))
+
+    las = laspy.LasData(header)
+    las.x, las.y, las.z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    las.intensity = np.full(len(xyz), 100, dtype=np.uint16)
+    las.write(path)
+
+    return path
+
+
+def road(x_start: float, x_end: float, n: int, seed: int, noise: float = 0.002) -> np.ndarray:
+    """
+    Points of a flat road along x, in scan order
+    :param x_start: Start of the road
+    :param x_end: End of the road
+    :param n: Number of points
+    :param seed: Seed of the random generator
+    :param noise: Standard deviation of the heights
+    :return: Coordinates of shape (N, 3)
+    """
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(x_start, x_end, n))
+    return np.column_stack([x, rng.uniform(0, 5, n), rng.normal(0, noise, n)])
+
+
+@pytest.fixture(autouse=True)
+def processed_dir(tmp_path):
+    """
+    Writes the outputs, caches and checkpoints of a test to its temporary directory
+    """
+    processed = tmp_path / "processed"
+    with Config.override({
+        "PROCESSED_PC_DIR": str(processed),
+        "CACHE_DIR": str(processed / "cache"),
+        "PROFILE_DIR": str(processed / "profiles"),
+        "CHECKPOINT_DIR": str(processed / "checkpoints"),
+        "TILE_DIR": str(processed / "tiles"),
+        "SURVEY_DIR": str(processed / "survey"),
+    }):
+        yield processed
@@ -0,0 +1,25 @@
+import contextvars
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from src import Config
+from src.modules import Cache
+
+
+def test_file_hashes_from_concurrent_threads_are_all_kept(tmp_path):
+    paths = []
+    for i in range(32):
+        paths.append(tmp_path / f"file_{i}.bin")
+        paths[-1].write_bytes(bytes([i]) * 100_000)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        # Each thread runs in a copy of the context of the test, which holds the cache directory of the test
+        contexts = [contextvars.copy_context() for _ in paths]
+        digests = list(pool.map(
+            lambda context, path: context.run(Cache.file_hash, file_path=str(path)), contexts, paths
+        ))
+
+    assert digests == [hashlib.sha256(path.read_bytes()).hexdigest() for path in paths]
+    with open(f"{Config.CACHE_DIR.value}/hashes.json") as f:
+        assert sorted(json.load(f).values()) == sorted(digests)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from src.utils import fit_plane, prefix_moments, ransac_plane, window_planes
+
+
+def tilted_plane(rng: np.random.Generator, n: int = 500, noise: float = 0.001) -> np.ndarray:
+    """
+    Points on the plane z = 0.2x - 0.1y + 3 with a little vertical noise
+    """
+    xy = rng.uniform(-5, 5, size=(n, 2))
+    z = 0.2 * xy[:, 0] - 0.1 * xy[:, 1] + 3 + rng.normal(0, noise, n)
+    return np.column_stack([xy, z])
+
+
+def expected_normal() -> np.ndarray:
+    normal = np.array([-0.2, 0.1, 1.0])
+    return normal / np.linalg.norm(normal)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_ransac_plane_normal_points_upwards(seed):
+    rng = np.random.default_rng(seed)
+    points = tilted_plane(rng)
+    outliers = rng.uniform(-5, 5, size=(50, 3)) + [0, 0, 10]
+
+    model, inliers = ransac_plane(np.vstack([points, outliers]), threshold=0.01, max_iterations=1000, rng=rng)
+
+    np.testing.assert_allclose(model[:3], expected_normal(), atol=1e-3)
+    assert np.all(inliers[:len(points)])
+    assert not np.any(inliers[len(points):])
+
+
+def test_fit_plane_normal_points_upwards():
+    points = tilted_plane(np.random.default_rng(0))
+
+    for sample in (points, points[::-1], -points):
+        model = fit_plane(sample)
+        assert model[2] > 0
+        np.testing.assert_allclose(sample @ model[:3] + model[3], 0, atol=0.01)
+
+
+def test_fit_plane_flips_a_downward_normal():
+    xy = np.random.default_rng(0).uniform(-5, 5, size=(500, 2))
+    points = np.column_stack([xy, 0.2 * xy[:, 0] + 0.1 * xy[:, 1] + 3])
+    _, eigenvectors = np.linalg.eigh(np.cov(points - points.mean(axis=0), rowvar=False))
+    assert eigenvectors[2, 0] < 0  # The least squares normal of these points comes out pointing downwards
+
+    model = fit_plane(points)
+
+    normal = np.array([-0.2, -0.1, 1.0]) / np.linalg.norm([-0.2, -0.1, 1.0])
+    np.testing.assert_allclose(model, np.append(normal, -3 * normal[2]), atol=1e-9)
+
+
+def test_window_planes_match_fit_plane():
+    points = tilted_plane(np.random.default_rng(0), n=300)
+    starts, ends = np.array([0, 100, 200]), np.array([99, 199, 299])
+
+    models, residual_stds = window_planes(prefix_moments(points), starts, ends)
+
+    for model, residual_std, start, end in zip(models, residual_stds, starts, ends):
+        window = points[start:end + 1]
+        np.testing.assert_allclose(model, fit_plane(window), atol=1e-6)
+        assert residual_std == pytest.approx(np.std(window @ model[:3] + model[3]), rel=1e-6)
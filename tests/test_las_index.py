@@ -0,0 +1,52 @@
+import numpy as np
+import shapely
+
+from src import Config
+from src.modules import LasIndex, PointCloud
+from .conftest import road, write_las
+
+SETTINGS = {"INDEX_BLOCK_SIZE": 500, "DOWN_SAMPLE_ON_READ": True, "UNIFORM_DOWN_SAMPLE": 3}
+
+
+def test_region_is_read_from_the_overlapping_blocks(tmp_path):
+    las_path = write_las(str(tmp_path / "road.las"), road(0, 60, 6000, seed=0))
+
+    with Config.override(SETTINGS):
+        region = PointCloud.create_region(file_path=las_path, region=(20.0, 0.0, 30.0, 5.0))
+        pcd = PointCloud.create(file_path=las_path)
+        ranges = LasIndex.query(blocks=LasIndex.load(file_path=las_path), bounds=(2000, 0, 3000, 500))
+
+    # The same points as reading the whole file and cropping it, from the blocks along x 20 to 30 only
+    in_region = (pcd.xyz[:, 0] >= 2000) & (pcd.xyz[:, 0] <= 3000)
+    np.testing.assert_array_equal(region.record_indexes, pcd.record_indexes[in_region])
+    np.testing.assert_array_equal(region.xyz, pcd.xyz[in_region])
+    np.testing.assert_array_equal(region.intensity, pcd.intensity[in_region])
+    assert sum(end - start for start, end in ranges) <= 1000 + 2 * 500  # Partly overlapping blocks at each end
+
+
+def test_region_geometries_select_the_points_within_them(tmp_path):
+    las_path = write_las(str(tmp_path / "road.las"), road(0, 60, 6000, seed=1))
+    geometries = np.array([shapely.box(10, 0, 15, 2.5), shapely.box(40, 2.5, 45, 5)])
+
+    with Config.override(SETTINGS):
+        region = PointCloud.create_region(file_path=las_path, region=geometries)
+        pcd = PointCloud.create(file_path=las_path)
+
+    xy = pcd.xyz[:, :2] * 0.01
+    within = shapely.intersects_xy(shapely.union_all(geometries), xy[:, 0], xy[:, 1])
+    assert np.any(within)
+    np.testing.assert_array_equal(region.record_indexes, pcd.record_indexes[within])
+
+
+def test_index_is_rebuilt_when_the_file_changes(tmp_path):
+    las_path = str(tmp_path / "road.las")
+
+    with Config.override(SETTINGS):
+        write_las(las_path, road(0, 60, 6000, seed=2))
+        assert len(LasIndex.load(file_path=las_path)) == 12
+
+        write_las(las_path, road(0, 60, 3000, seed=2))
+        blocks = LasIndex.load(file_path=las_path)
+
+    assert len(blocks) == 6
+    assert blocks["count"].sum() == 3000
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from src import Config
+from src.modules import Pipeline, PointBuffer, Stage
+
+
+def stages(calls: list[str], fail: str = None) -> list[Stage]:
+    """
+    Stages loading points, computing their heights and thresholding them, which record their calls
+    :param calls: List the names of the stages are appended to when they run
+    :param fail: Name of a stage that raises instead of running
+    :return:
+    """
+    def stage(name: str, function, inputs: tuple[str, ...], outputs: tuple[str, ...], settings=()) -> Stage:
+        def run(**kwargs):
+            if name == fail:
+                raise KeyboardInterrupt
+
+            calls.append(name)
+            return function(**kwargs)
+
+        return Stage(name=name, function=run, inputs=inputs, outputs=outputs, settings=settings)
+
+    return [
+        stage(
+            "load", lambda n: {"pcd": PointBuffer(xyz=np.arange(n * 3.0).reshape(n, 3), intensity=np.ones(n))},
+            ("n",), ("pcd",)
+        ),
+        stage("heights", lambda pcd: {"heights": pcd.xyz[:, 2].copy()}, ("pcd",), ("heights",)),
+        stage(
+            "classify", lambda heights: {"count": int(np.count_nonzero(heights > Config.MIN_DIST_STD.value))},
+            ("heights",), ("count",), settings=("MIN_DIST_STD",)
+        ),
+    ]
+
+
+def test_only_stages_with_changed_inputs_are_run_again(tmp_path):
+    calls = []
+    with Config.override({"MIN_DIST_STD": 10}):
+        first = Pipeline(stages=stages(calls), checkpoint_dir=str(tmp_path)).run(values={"n": 10}, targets=("count",))
+        again = Pipeline(stages=stages(calls), checkpoint_dir=str(tmp_path)).run(values={"n": 10}, targets=("count",))
+
+    with Config.override({"MIN_DIST_STD": 20}):
+        changed = Pipeline(stages=stages(calls), checkpoint_dir=str(tmp_path)).run(values={"n": 10}, targets=("count",))
+
+    assert (first, again, changed) == ({"count": 7}, {"count": 7}, {"count": 3})
+    assert calls == ["load", "heights", "classify", "classify"]
+
+
+def test_interrupted_run_resumes_after_the_last_completed_stage(tmp_path):
+    calls = []
+    with pytest.raises(KeyboardInterrupt):
+        Pipeline(stages=stages(calls, fail="classify"), checkpoint_dir=str(tmp_path)).run(
+            values={"n": 10}, targets=("count",)
+        )
+
+    outputs = Pipeline(stages=stages(calls), checkpoint_dir=str(tmp_path)).run(
+        values={"n": 10}, targets=("count", "pcd")
+    )
+
+    # The point cloud of the interrupted run is loaded from its checkpoint
+    assert calls == ["load", "heights", "classify"]
+    np.testing.assert_array_equal(outputs["pcd"].xyz, np.arange(30.0).reshape(10, 3))
+
+
+def test_checkpoints_are_not_used_when_disabled(tmp_path):
+    calls = []
+    with Config.override({"USE_CHECKPOINTS": False}):
+        for _ in range(2):
+            Pipeline(stages=stages(calls), checkpoint_dir=str(tmp_path)).run(values={"n": 10}, targets=("heights",))
+
+    assert calls == ["load", "heights"] * 2
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from src.modules import Plane, PointBuffer
+from src.utils import vector_angles
+
+
+def test_vector_angles_ignore_the_sign_of_the_vectors():
+    vectors = np.array([[0, 0, 1], [0, 0, -1], [1, 0, 1], [-1, 0, -1], [1, 0, 0]], dtype=float)
+
+    np.testing.assert_allclose(vector_angles(np.array([0, 0, 1.0]), vectors), [0, 0, 45, 45, 90], atol=1e-9)
+    np.testing.assert_allclose(vector_angles(np.array([0, 0, -1.0]), vectors), [0, 0, 45, 45, 90], atol=1e-9)
+
+
+@pytest.mark.parametrize("sign", [1, -1])
+def test_mean_angle_dev_does_not_depend_on_the_plane_normal_sign(sign):
+    rng = np.random.default_rng(0)
+    xyz = np.column_stack([rng.uniform(0, 1, (100, 2)), np.zeros(100)])
+    normals = np.tile([0.0, 0.0, 1.0], (100, 1))
+    pcd = PointBuffer(xyz=xyz, intensity=np.ones(100), normals=normals)
+
+    plane = Plane(a=0, b=0, c=sign * 1.0, d=0, pcd=pcd)
+
+    assert plane.mean_angle_dev == pytest.approx(0)
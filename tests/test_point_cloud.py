@@ -0,0 +1,60 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from src import Config
+from src.modules import Label, Plane, PointBuffer, PointCloud
+from src.modules.service import _run_job
+from .conftest import road, write_las
+
+
+@pytest.fixture
+def spawn():
+    """
+    Starts worker processes by spawning, as on Windows and macOS, so they do not inherit the context of the test
+    """
+    method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    yield
+    multiprocessing.set_start_method(method, force=True)
+
+
+def test_segment_workers_use_the_config_overrides(tmp_path, spawn):
+    las_path = write_las(str(tmp_path / "road.las"), road(0, 30, 3000, seed=0, noise=0.02))
+
+    inlier_counts = {}
+    with Config.override({
+        "UNIFORM_DOWN_SAMPLE": 1, "SPATIAL_INDEX": False, "NO_SEGMENTS": 10,
+        "SOR_STD_RATIO": 0.1,  # Removing more points than by default
+        "RANSAC_THRESH": 10 ** 9,  # Keeping every point left by the SOR, so the counts do not depend on sampling
+    }):
+        pcd = PointCloud.create(file_path=las_path)
+        for workers in (1, 2):
+            with Config.override({"NO_WORKERS": workers}):
+                segments, _ = PointCloud.extract_features(pcd=pcd)
+                inlier_counts[workers] = [len(segment.pcd) for segment in segments]
+
+    assert inlier_counts[2] == inlier_counts[1]
+
+
+@pytest.mark.parametrize("overrides, expected", [({}, 2), ({"NO_WORKERS": 1}, 1), ({"NO_WORKERS": 8}, 2)])
+def test_service_jobs_fit_segments_with_their_share_of_the_cpus(overrides, expected):
+    with Config.override({"NO_WORKERS": 16}):
+        assert _run_job(lambda _: Config.NO_WORKERS.value, "road.las", overrides, fit_workers=2) == expected
+
+
+def test_label_does_not_modify_the_point_cloud():
+    pcd = PointBuffer(xyz=np.zeros((6, 3)), intensity=np.ones(6), record_indexes=np.arange(10, 16))
+    segments = [
+        Plane(a=0, b=0, c=1, d=0, pcd=pcd.select(indexes), indexes=indexes)
+        for indexes in (np.array([0, 1, 2]), np.array([2, 3]))
+    ]
+
+    for detections in (np.array([False, True]), np.array([False, False])):
+        labelled_pcd = PointCloud.label(pcd=pcd, segments=segments, detections=detections)
+
+        assert pcd.labels is None
+        np.testing.assert_array_equal(labelled_pcd.record_indexes, [10, 11, 12, 13])
+        second_label = Label.SPEED_BUMP if detections[1] else Label.SURFACE
+        np.testing.assert_array_equal(labelled_pcd.labels, [Label.SURFACE, Label.SURFACE, second_label, second_label])
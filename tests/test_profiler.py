@@ -0,0 +1,24 @@
+import pytest
+
+from src import Config
+from src.modules import PointCloud, Profiler
+from .conftest import road, write_las
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_segment_stages_are_recorded_with_and_without_workers(tmp_path, workers):
+    las_path = write_las(str(tmp_path / "road.las"), road(0, 30, 3000, seed=0))
+
+    with Config.override({"PROFILE": True, "UNIFORM_DOWN_SAMPLE": 1, "NO_SEGMENTS": 10, "NO_WORKERS": workers}):
+        pcd = PointCloud.build_spatial_index(pcd=PointCloud.create(file_path=las_path))
+        Profiler.reset()
+        with Profiler.stage("run"):
+            segments, _ = PointCloud.extract_features(pcd=pcd)
+
+        records = Profiler.records()
+
+    assert records["run/segment"]["calls"] == 1
+    for stage in ("sor", "ransac"):
+        assert records[f"run/segment/{stage}"]["calls"] == len(segments)
+        assert records[f"run/segment/{stage}"]["wall_time"] > 0
+    assert records["run/segment/ransac"]["points"] == sum(len(segment.pcd) for segment in segments)
@@ -0,0 +1,50 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from src import Config
+from src.modules import PointCloud
+from src.utils import transform_geometries
+from .conftest import write_las
+
+
+def test_crop_to_middle_line_on_scaled_and_offset_header(tmp_path):
+    rng = np.random.default_rng(0)
+    origin = np.array([500_000, 7_000_000, 100])
+    xyz = origin + rng.uniform(0, 100, size=(2000, 3)) * [1, 1, 0.01]
+    las_path = write_las(
+        str(tmp_path / "road.las"), xyz, scales=(0.001, 0.001, 0.001), offsets=origin, crs="EPSG:25832"
+    )
+
+    # Middle line along x = 500 050 in the file, saved in another coordinate system
+    line = shapely.LineString([(500_050, 7_000_000), (500_050, 7_000_100)])
+    line = transform_geometries(geometries=np.array([line]), source_crs="EPSG:25832", target_crs="EPSG:4326")
+    gpd.GeoDataFrame(geometry=line, crs="EPSG:4326").to_file(tmp_path / "middle_line.shp")
+
+    with Config.override({
+        "SHAPEFILE_PATH": str(tmp_path / "middle_line.shp"),
+        "CROP_TO_MIDDLE_LINE": True,
+        "MIDDLE_LINE_THRESHOLD": 2,
+        "DOWN_SAMPLE_ON_READ": True,
+        "UNIFORM_DOWN_SAMPLE": 1,
+        "SOR_STD_RATIO": 100,  # Keeping every point
+    }):
+        pcd = PointCloud.pre_process(pcd=PointCloud.create(file_path=las_path), source_path=las_path)
+
+    kept_x = np.sort(pcd.xyz[:, 0] * 0.001 + origin[0])
+    expected_x = np.sort(xyz[np.abs(xyz[:, 0] - 500_050) <= 2, 0])
+    assert len(kept_x) > 0
+    np.testing.assert_allclose(kept_x, expected_x, atol=0.01)
+
+
+def test_reprojection_keeps_the_heights_of_3d_geometries():
+    line_2d = shapely.LineString([(500_050, 7_000_000), (500_050, 7_000_100)])
+    line_3d = shapely.LineString([(500_050, 7_000_000, 12.5), (500_050, 7_000_100, 13.5)])
+
+    line_2d, line_3d = transform_geometries(
+        geometries=np.array([line_2d, line_3d]), source_crs="EPSG:25832", target_crs="EPSG:4326"
+    )
+
+    assert not line_2d.has_z
+    np.testing.assert_allclose(shapely.get_coordinates(line_3d, include_z=True)[:, 2], [12.5, 13.5])
+    np.testing.assert_allclose(shapely.get_coordinates(line_3d), shapely.get_coordinates(line_2d))
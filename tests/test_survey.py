@@ -0,0 +1,59 @@
+import laspy
+import numpy as np
+
+from src import Config
+from src.modules import PointCloud, Survey
+from .conftest import road, write_las
+
+SETTINGS = {
+    "UNIFORM_DOWN_SAMPLE": 1,
+    "SOR_STD_RATIO": 100,  # Keeping every point of the flat road
+    "SURVEY_SEGMENT_SIZE": 60,
+    "OUTPUT_MODE": "points",
+}
+
+
+def test_file_without_segments_is_kept_for_the_next_file(tmp_path, processed_dir):
+    first = write_las(str(tmp_path / "a.las"), road(0, 0.05, 5, seed=0), scales=(0.001, 0.001, 0.001))
+    second = write_las(str(tmp_path / "b.las"), road(0.05, 30, 3000, seed=1), scales=(0.001, 0.001, 0.001))
+
+    with Config.override(SETTINGS):
+        survey = Survey(directory=str(processed_dir / "survey"))
+        survey.ingest(las_path=first, pcd=PointCloud.create(file_path=first))  # Too few points for a segment
+        outputs = survey.ingest(las_path=second, pcd=PointCloud.create(file_path=second))
+
+    # The points of the first file are segmented together with the second file, instead of being dropped
+    assert "a_output_path" in outputs
+    with laspy.open(outputs["a_output_path"]) as f:
+        assert f.header.point_count == 5
+
+    with laspy.open(outputs["b_output_path"]) as f:
+        assert f.header.point_count > 0.9 * 3000
+
+    # The segments have the size of the survey, not a size derived from the first file
+    features = np.load(outputs["features_path"])
+    final = features[:-1]  # The last segment reaches the end of the survey, so it is shorter
+    assert len(features) >= 3005 // 60
+    assert np.all(final["end_index"] - final["start_index"] >= SETTINGS["SURVEY_SEGMENT_SIZE"])
+
+
+def test_points_are_labelled_once_across_files(tmp_path, processed_dir):
+    points = road(0, 60, 6000, seed=2)
+    paths = [
+        write_las(str(tmp_path / f"part_{i}.las"), part, scales=(0.001, 0.001, 0.001))
+        for i, part in enumerate(np.array_split(points, 3))
+    ]
+
+    with Config.override(SETTINGS):
+        survey = Survey(directory=str(processed_dir / "survey"))
+        for path in paths:
+            outputs = survey.ingest(las_path=path, pcd=PointCloud.create(file_path=path))
+            assert survey.contains(las_path=path)
+
+    written = 0
+    for i in range(3):
+        with laspy.open(str(processed_dir / f"part_{i}_marked_point_cloud.las")) as f:
+            written += f.header.point_count
+
+    assert set(outputs) >= {"features_path", "part_2_output_path"}
+    assert 0.9 * len(points) < written <= len(points)
@@ -0,0 +1,39 @@
+import laspy
+import numpy as np
+
+from src import Config
+from src.modules import Tiling
+from src.modules.tiling import PROCESSING_BYTES_PER_POINT
+from .conftest import road, write_las
+
+BUDGET_POINTS = 2000
+
+
+def test_tiles_fit_in_the_memory_budget(tmp_path, processed_dir):
+    points = road(0, 60, 6000, seed=0)
+    las_path = write_las(str(tmp_path / "road.las"), points, scales=(0.001, 0.001, 0.001))
+
+    with Config.override({"UNIFORM_DOWN_SAMPLE": 1, "TILE_HALO": 1.0,
+                          "MEMORY_BUDGET": BUDGET_POINTS * PROCESSING_BYTES_PER_POINT}):
+        grid, tiles = Tiling.split(file_path=las_path, tile_dir=str(processed_dir / "tiles"))
+
+    assert len(tiles) > 1
+    assert all(tile.point_count <= BUDGET_POINTS for tile in tiles)
+    assert sum(tile.core_point_count for tile in tiles) == len(points)
+
+    # Every point is in the core of one tile, and also in the halos of the tiles next to it
+    record_indexes = np.concatenate([Tiling.load(tile=tile).record_indexes for tile in tiles])
+    assert set(record_indexes) == set(range(len(points)))
+    assert len(record_indexes) == sum(tile.point_count for tile in tiles)
+
+
+def test_tiled_run_labels_each_record_once(tmp_path):
+    points = road(0, 60, 6000, seed=1)
+    las_path = write_las(str(tmp_path / "road.las"), points, scales=(0.001, 0.001, 0.001))
+
+    with Config.override({"UNIFORM_DOWN_SAMPLE": 1, "TILE_HALO": 1.0, "SOR_STD_RATIO": 100, "NO_SEGMENTS": 50,
+                          "OUTPUT_MODE": "points", "MEMORY_BUDGET": BUDGET_POINTS * PROCESSING_BYTES_PER_POINT}):
+        outputs = Tiling.run(file_path=las_path)
+
+    with laspy.open(outputs["output_path"]) as f:
+        assert 0.9 * len(points) < f.header.point_count <= len(points)